@@ -1,12 +1,42 @@
+import os
 import re
 import json
+import sqlite3
 import gspread
 import datetime
+import atexit
 import builtins
 import textwrap
-from gspread.exceptions import APIError
+import threading
+import time
+import math
+import calendar
+import mmap
+import bisect
+import struct
+import sys
+import zlib
+import base64
+import random
+import functools
+import hashlib
+import uuid
+import contextlib
+import concurrent.futures
+from array import array
+from collections import deque
+from cachetools import TTLCache
+from gspread.exceptions import APIError, WorksheetNotFound
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
 from google.auth.exceptions import GoogleAuthError, DefaultCredentialsError
+try:
+    import fcntl
+except ImportError:
+    # No file locks outside POSIX, assets are only locked in-process
+    fcntl = None
 
 
 # Text wrapper
@@ -54,128 +84,5372 @@ def custom_print(*args, sep=' ', end='\n', file=None, width=70, **kwargs):
 builtins.print = custom_print
 
 
-# Define the Google API scopes that the application will need access to.
+# Instrumentation
 
 
-class DataBaseActions:
+# Threads working for the command the user is waiting on (see
+# Books.fan_out) set 'command' to its name
+FOREGROUND = threading.local()
+
+
+def in_foreground():
+    """
+    Returns True when the current thread works for the user, the main
+    thread or a thread running part of its command.
+    """
+    return (
+        threading.current_thread() is threading.main_thread()
+        or getattr(FOREGROUND, "command", None) is not None
+    )
+
+
+def percentile(samples, q):
+    """
+    Returns the q-th percentile (0 to 100) of a list of samples with the
+    nearest rank method, 0 for an empty list.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(1, math.ceil(q / 100 * len(ordered))) - 1]
+
+
+class CommandMetrics:
+    """
+    Counts the storage operations made by each command and records how
+    long they take, so the cost of every command can be checked with
+    './stats'.
+
+    Operations are tagged with the innermost command running on the
+    main thread ('entry', 'check', 'set', 'bulk'...), 'menu' outside
+    of any command, or 'background' when a background thread such as
+    the journal makes them. The time
+    spent waiting for the user to type is left out of command
+    durations. Commands taking longer than the budget are logged to
+    'slow_commands.log' along with the operations they made.
+
+    Attributes:
+        budget (float): Seconds above which a command is logged as slow.
+        calls (dict): (command, operation) to its number of calls.
+        samples (dict): (command, operation) to its latest durations,
+            in seconds.
+        transferred (dict): (command, operation) to the bytes received,
+            for the operations going over the network.
+        commands (list): The commands running on the main thread,
+            innermost last.
+    """
+
+    # Durations kept per (command, operation), the oldest are dropped
+    SAMPLES = 10000
+
+    def __init__(self, budget=2.0):
+        self.budget = budget
+        self.calls = {}
+        self.samples = {}
+        self.transferred = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def tag(self):
+        """
+        Returns the command the current operation belongs to.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return getattr(FOREGROUND, "command", None) or "background"
+        return self.commands[-1]["name"] if self.commands else "menu"
+
+    def record(self, operation, seconds, command=None, size=None):
+        """
+        Records one operation and its duration under the given command,
+        the current one by default, with the bytes it received if it
+        went over the network.
+        """
+        key = (command or self.tag(), operation)
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            samples = self.samples.setdefault(key, deque(maxlen=self.SAMPLES))
+            samples.append(seconds)
+            if size is not None:
+                self.transferred[key] = self.transferred.get(key, 0) + size
+            if command is None and key[0] != "background" and self.commands:
+                made = self.commands[-1]["operations"]
+                made[operation] = made.get(operation, 0) + 1
+
+    def measured(self, function):
+        """
+        Decorator recording every call of a method as the operation
+        '<instance name>.<method name>', e.g. 'sheets.append_rows'.
+        """
+        @functools.wraps(function)
+        def wrapper(instance, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(instance, *args, **kwargs)
+            finally:
+                self.record(
+                    f"{instance.name}.{function.__name__}",
+                    time.perf_counter() - start,
+                )
+        return wrapper
+
+    @contextlib.contextmanager
+    def command(self, name):
+        """
+        Tags the operations made inside the block with a command, then
+        records the command duration as its 'command' operation.
+        """
+        frame = {
+            "name": name,
+            "start": time.perf_counter(),
+            "waited": 0.0,
+            "operations": {},
+        }
+        self.commands.append(frame)
+        try:
+            yield
+        finally:
+            self.commands.pop()
+            seconds = time.perf_counter() - frame["start"] - frame["waited"]
+            self.record("command", seconds, command=name)
+            if seconds > self.budget:
+                self.log_slow(frame, seconds)
+
+    @contextlib.contextmanager
+    def waiting(self):
+        """
+        Leaves the time spent inside the block, waiting for the user,
+        out of the running commands durations.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            for frame in self.commands:
+                frame["waited"] += time.perf_counter() - start
+
+    def log_slow(self, frame, seconds):
+        """
+        Appends a command over the budget to 'slow_commands.log'.
+        """
+        try:
+            os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+            path = os.path.join(LOCAL_STATE_DIR, "slow_commands.log")
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({
+                    "time": datetime.datetime.now().isoformat(),
+                    "command": frame["name"],
+                    "seconds": round(seconds, 3),
+                    "operations": frame["operations"],
+                }) + "\n")
+        except OSError:
+            pass
+
+    def report(self):
+        """
+        Returns one row per (command, operation): the command, the
+        operation, its number of calls, its p50, p95 and p99 durations
+        in milliseconds and the kilobytes it received ('' for the
+        operations not going over the network).
+        """
+        with self.lock:
+            items = sorted(
+                (key, self.calls[key], list(self.samples[key]),
+                 self.transferred.get(key))
+                for key in self.calls
+            )
+        return [
+            [command, operation, calls] + [
+                round(percentile(samples, q) * 1000, 1) for q in (50, 95, 99)
+            ] + ["" if size is None else round(size / 1024, 1)]
+            for (command, operation), calls, samples, size in items
+        ]
+
+    def dump(self, path):
+        """
+        Writes the report to a JSON file.
+
+        Args:
+            path (str): Location of the file.
+        """
+        headers = [
+            "command", "operation", "calls", "p50", "p95", "p99", "kb",
+        ]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({
+                "time": datetime.datetime.now().isoformat(),
+                "budget": self.budget,
+                "unit": "ms",
+                "operations": [
+                    dict(zip(headers, row)) for row in self.report()
+                ],
+            }, file, indent=2)
+
+
+METRICS = CommandMetrics(
+    budget=float(os.environ.get("TRADING_BOOK_SLOW_COMMAND", 2))
+)
+
+
+# Storage backends
+
+# Folder holding every local file the system writes (SQLite engine, etc.)
+LOCAL_STATE_DIR = os.environ.get("TRADING_BOOK_STATE_DIR", ".trading_book")
+
+# Book opened by default, its local files are kept in LOCAL_STATE_DIR and
+# those of the other books in a folder of their own in 'books'
+DEFAULT_BOOK = "trading_book"
+
+
+def book_state_dir(book):
+    """
+    Returns the folder holding the local files of a book.
+    """
+    if book == DEFAULT_BOOK:
+        return LOCAL_STATE_DIR
+    return os.path.join(LOCAL_STATE_DIR, "books", book)
+
+
+class WorksheetSchemas(dict):
+    """
+    Column layouts keyed by worksheet name. The partitions of a
+    partitioned worksheet share its layout, without being listed.
+    """
+
+    def __missing__(self, worksheet):
+        base = partitioned_worksheet(worksheet)
+        if base is None:
+            raise KeyError(worksheet)
+        return self[base]
+
+
+# Column layout shared by every storage backend, one list per worksheet
+WORKSHEET_SCHEMAS = WorksheetSchemas({
+    "entry": [
+        "timestamp", "action", "asset", "type", "price", "stop", "atr",
+        "last_timestamp", "close_price", "current_stop", "current_atr",
+    ],
+    # Each trade event carries the idempotency key it was logged with,
+    # so a write sent twice is recognized (see DataBaseActions.known_event)
+    "raw_data": [
+        "timestamp", "action", "asset", "type", "price", "stop", "atr",
+        "event_key",
+    ],
+    "set": ["position", "drawdown", "risk", "amount"],
+    # Closed trades moved out of 'entry', with the row they held there
+    # and the date they were moved (see DataBaseActions.archive)
+    "entry_archive": [
+        "timestamp", "action", "asset", "type", "price", "stop", "atr",
+        "last_timestamp", "close_price", "current_stop", "current_atr",
+        "entry_row", "archived",
+    ],
+    # Catalog of the partitions of the partitioned worksheets, with
+    # the first and last date each of them covers
+    "partitions": ["partition", "worksheet", "start", "end"],
+})
+
+# Worksheets split by month of their first column: rows logged in
+# October 2026 go to 'raw_data_2026_10'. Rows logged before the split
+# stay in the worksheet itself, read along with the partitions.
+PARTITIONED_WORKSHEETS = ("raw_data",)
+
+# Worksheets only ever appended to, with their partitions, refreshed by
+# fetching the rows added since they were read (see read_worksheet).
+# The others, like 'entry' whose rows are rewritten in place, are read
+# in full.
+APPEND_ONLY_WORKSHEETS = ("raw_data", "entry_archive")
+
+# Columns telling a trade apart from the others, whatever its state
+TRADE_IDENTITY = ("timestamp", "asset", "type", "price")
+
+# Worksheets saved to a local BookSnapshot after each sync
+SNAPSHOT_WORKSHEETS = ("entry", "raw_data", "set")
+
+# Worksheets served from their snapshot at startup, while the remote
+# engine is reached in the background (see DataBaseActions.warm_start)
+STARTUP_WORKSHEETS = ("entry", "set")
+
+# Columns holding numbers, stored as floats in the cache (see RowStore)
+NUMERIC_COLUMNS = {
+    "price", "stop", "atr", "close_price", "current_stop", "current_atr",
+}
+
+
+def partitioned_worksheet(worksheet):
+    """
+    Returns the partitioned worksheet a partition belongs to, None if
+    the name is not one of a partition.
+
+    Example:
+        partitioned_worksheet("raw_data_2026_10") -> "raw_data"
+    """
+    match = re.fullmatch(r"(\w+?)_(\d{4})_(\d{2})", worksheet)
+    if match and match.group(1) in PARTITIONED_WORKSHEETS:
+        return match.group(1)
+    return None
+
+
+def partition_name(worksheet, timestamp):
+    """
+    Returns the partition of a worksheet holding the rows logged at a
+    'YYYY-MM-DD' timestamp, the current month if it cannot be read.
+
+    Example:
+        partition_name("raw_data", "2026-10-17") -> "raw_data_2026_10"
+    """
+    match = re.match(r"(\d{4})-(\d{2})", str(timestamp))
+    if match:
+        year, month = match.groups()
+    else:
+        year, month = datetime.datetime.now().strftime("%Y %m").split()
+    return f"{worksheet}_{year}_{month}"
+
+
+def catalog_partitions(values, worksheet=None, start=None, end=None):
+    """
+    Lists the partitions recorded in the 'partitions' catalog, oldest
+    first, optionally only those of one worksheet covering some of the
+    dates from start to end.
+
+    Args:
+        values (list): The catalog rows, headers included.
+        worksheet (str, optional): The partitioned worksheet.
+        start (str, optional): First 'YYYY-MM-DD' date needed.
+        end (str, optional): Last 'YYYY-MM-DD' date needed.
+
+    Returns:
+        list: The partition names, each listed once.
+    """
+    partitions = {}
+    for row in values[1:]:
+        name, base, first, last = pad_row("partitions", row)[:4]
+        if worksheet is not None and base != worksheet:
+            continue
+        if (start and last < start) or (end and first > end):
+            continue
+        partitions[name] = first
+    return sorted(partitions, key=partitions.get)
+
+
+def partition_bounds(partition):
+    """
+    Returns the first and last 'YYYY-MM-DD' dates of a partition.
+
+    Example:
+        partition_bounds("raw_data_2026_02") -> ("2026-02-01", "2026-02-28")
+    """
+    year, month = (int(part) for part in partition.rsplit("_", 2)[1:])
+    last = calendar.monthrange(year, month)[1]
+    return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last:02d}"
+
+
+def normal_cell(column, value):
+    """
+    Returns the text of a cell, numeric columns being written the same
+    way whatever engine they were read from ('1000.0' -> '1000').
+    """
+    text = format_cell(value)
+    if column in NUMERIC_COLUMNS and text:
+        try:
+            return format_cell(float(text.replace(",", "")))
+        except ValueError:
+            pass
+    return text
+
+
+def trade_key(row):
+    """
+    Returns the TRADE_IDENTITY cells of an 'entry' row as a string,
+    numbers written the same way whatever engine they came from.
+    """
+    columns = WORKSHEET_SCHEMAS["entry"]
+    return "|".join(
+        normal_cell(column, row[columns.index(column)])
+        for column in TRADE_IDENTITY
+    )
+
+
+def format_cell(value):
+    """
+    Converts a python value into the string representation a
+    worksheet cell would return when read back.
+
+    Args:
+        value: The value to convert.
+
+    Returns:
+        str: The cell text, empty for None values.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.15g}"
+    return str(value)
+
+
+def filter_rows(worksheet, values, asset=None, action=None):
+    """
+    Selects the rows of a worksheet matching an asset and/or action.
+
+    Args:
+        worksheet (str): The worksheet name, a key of WORKSHEET_SCHEMAS.
+        values (list): All rows of the worksheet, headers included.
+        asset (str, optional): The asset to match.
+        action (str, optional): The action to match.
+
+    Returns:
+        list: (row number, row values) tuples, with row values padded
+            to the full width of the worksheet.
+    """
+    columns = WORKSHEET_SCHEMAS[worksheet]
+    asset_column = columns.index("asset")
+    action_column = columns.index("action")
+    rows = []
+    for number, row in enumerate(values[1:], 2):
+        row = pad_row(worksheet, row)
+        if asset is not None and row[asset_column] != asset:
+            continue
+        if action is not None and row[action_column] != action:
+            continue
+        rows.append((number, row))
+    return rows
+
+
+def row_ranges(rows):
+    """
+    Groups row numbers into (start, end) ranges of consecutive rows.
+
+    Example:
+        row_ranges([2, 3, 4, 7, 9, 10]) -> [(2, 4), (7, 7), (9, 10)]
+    """
+    ranges = []
+    for row in sorted(set(rows)):
+        if ranges and ranges[-1][1] == row - 1:
+            ranges[-1] = (ranges[-1][0], row)
+        else:
+            ranges.append((row, row))
+    return ranges
+
+
+def row_range(row, data):
+    """
+    Returns the A1 notation range covering data written from
+    column A of the given row.
+    """
+    # Calculate the cell range (A to appropriate column letter)
+    return f"A{row}:{chr(65 + len(data) - 1)}{row}"
+
+
+class StorageBackend:
+    """
+    Interface shared by every storage engine used by DataBaseActions.
+
+    Worksheets are addressed by name and rows by their 1-based number,
+    with row 1 holding the headers, exactly like a Google Sheets
+    worksheet. Every method works on the worksheets declared in
+    WORKSHEET_SCHEMAS.
+
+    Attributes:
+        name (str): Short name of the engine, used in messages.
+        remote (bool): True when every call is a network round trip,
+            meaning reads are worth keeping in the worksheet cache.
+    """
+
+    name = None
+    remote = False
+
+    @classmethod
+    def open_book(cls, book, folder):
+        """
+        Starts the engine on the storage of a book.
+
+        Args:
+            book (str): The book name.
+            folder (str): The folder holding the local files of the book.
+        """
+        return cls()
+
+    def worksheet(self, worksheet):
+        """
+        Returns the engine's handle for a worksheet. Engines without
+        handles return the worksheet name.
+        """
+        return worksheet
+
+    def get_all_values(self, worksheet):
+        """
+        Returns every row of the worksheet, headers included.
+        """
+        raise NotImplementedError
+
+    def revision(self):
+        """
+        Returns a token changing whenever anything is written, so data
+        read at the same revision is known to be unchanged. Engines
+        that cannot tell return None.
+        """
+        return None
+
+    def get_rows(self, worksheet, start):
+        """
+        Returns the rows of the worksheet from the given row number to
+        the last one, an empty list if the worksheet is shorter.
+        """
+        return self.get_all_values(worksheet)[start - 1:]
+
+    def row_values(self, worksheet, row):
+        """
+        Returns the values stored in a single row.
+        """
+        raise NotImplementedError
+
+    def read_rows(self, worksheet, rows):
+        """
+        Returns the values of several rows, as a dict keyed by row
+        number. Rows past the end of the worksheet are left out.
+        """
+        values = {row: self.row_values(worksheet, row) for row in rows}
+        return {row: cells for row, cells in values.items() if cells}
+
+    def exclusive(self):
+        """
+        Returns a context manager keeping other sessions from writing
+        while it is open, so rows checked inside it cannot change before
+        they are rewritten. Engines without such a lock return one doing
+        nothing.
+        """
+        return contextlib.nullcontext()
+
+    def find_rows(self, worksheet, asset=None, action=None):
+        """
+        Returns a list of (row number, row values) tuples for the rows
+        matching the given asset and/or action.
+        """
+        raise NotImplementedError
+
+    def append_row(self, worksheet, data):
+        """
+        Appends a new row at the end of the worksheet.
+        """
+        raise NotImplementedError
+
+    def update_row(self, worksheet, row, data):
+        """
+        Overwrites the first len(data) columns of a row. None values
+        keep the existing cell content.
+        """
+        raise NotImplementedError
+
+    def append_rows(self, worksheet, rows):
+        """
+        Appends several rows at the end of the worksheet in one call.
+
+        Returns:
+            int: The row number of the first appended row, or None if
+                the engine cannot tell.
+        """
+        first = len(self.get_all_values(worksheet)) + 1
+        for data in rows:
+            self.append_row(worksheet, data)
+        return first
+
+    def delete_rows(self, worksheet, start, end):
+        """
+        Deletes rows start to end (inclusive), shifting the rows below
+        them up.
+        """
+        raise NotImplementedError
+
+    def delete_ranges(self, worksheet, ranges):
+        """
+        Deletes several (start, end) row ranges, numbered as they are
+        before any of them is deleted.
+        """
+        for start, end in sorted(ranges, reverse=True):
+            self.delete_rows(worksheet, start, end)
+
+    def move_rows(self, source, target, rows):
+        """
+        Moves rows to the end of another worksheet. Engines without
+        transactions append them to the target before deleting them
+        from the source, so a failure may leave a row in both, never
+        in neither.
+
+        Args:
+            source (str): The worksheet the rows are taken from.
+            target (str): The worksheet the rows are appended to.
+            rows (list): (row number in source, data to append) tuples.
+        """
+        self.append_rows(target, [data for _, data in rows])
+        self.delete_ranges(
+            source, row_ranges(number for number, _ in rows)
+        )
+
+    def commit(self, appends, updates, originals):
+        """
+        Applies a group of writes all together. Engines without
+        transactions undo the writes already applied when one of them
+        fails, then raise the error.
+
+        Args:
+            appends (dict): Worksheet name to the list of rows to append.
+            updates (dict): Worksheet name to the list of
+                (row number, data) tuples to rewrite.
+            originals (dict): Worksheet name to a {row number: values}
+                dict holding the rewritten rows as they were before,
+                used to undo the rewrites.
+        """
+        undo = []
+        try:
+            for worksheet, rows in appends.items():
+                first = self.append_rows(worksheet, rows)
+                if first is not None:
+                    undo.append(
+                        ("delete_rows", worksheet, first,
+                         first + len(rows) - 1)
+                    )
+            for worksheet, rows in updates.items():
+                self.batch_update(worksheet, rows)
+                previous = originals.get(worksheet, {})
+                undo.append((
+                    "batch_update", worksheet,
+                    [(row, previous[row]) for row, _ in rows
+                     if row in previous],
+                ))
+        except Exception:
+            for method, *args in reversed(undo):
+                try:
+                    getattr(self, method)(*args)
+                except Exception as e:
+                    print(f"Failed to undo {method} on {args[0]}: {e}")
+            raise
+
+    def batch_update(self, worksheet, updates):
+        """
+        Rewrites several rows in one call.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            updates (list): (row number, data) tuples, applied like
+                update_row.
+        """
+        for row, data in updates:
+            self.update_row(worksheet, row, data)
+
+
+class RequestScheduler:
+    """
+    Token bucket limiting the calls made to a rate-limited API, with
+    retries of the calls the API turned down.
+
+    The bucket holds up to a few seconds worth of the quota and refills
+    continuously, so calls are spread evenly at the quota instead of
+    bursting into it. Calls made from the main thread, where the user is
+    waiting for an answer, are served before calls made by background
+    threads such as the journal. Calls failing with 429 (quota exceeded)
+    or a 5xx server error are retried after a jittered exponential
+    delay, and a 429 empties the bucket so every caller slows down.
+
+    Attributes:
+        rate (float): Calls allowed per second.
+        burst (float): Maximum number of tokens held.
+        retries (int): Retries of a failing call before giving up.
+        tokens (float): Calls that can be made right away.
+        waiting (int): Main thread calls waiting for a token.
+    """
+
+    def __init__(self, quota=60, retries=5):
+        """
+        Args:
+            quota (int): Calls allowed per minute.
+            retries (int): Retries of a failing call before giving up.
+        """
+        self.rate = quota / 60
+        self.burst = max(1.0, quota / 6)
+        self.retries = retries
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self.condition = threading.Condition()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self):
+        """
+        Waits until a call can be made and takes its token.
+        """
+        interactive = in_foreground()
+        with self.condition:
+            if interactive:
+                self.waiting += 1
+            try:
+                while True:
+                    self.refill()
+                    if self.tokens >= 1 and (interactive or not self.waiting):
+                        self.tokens -= 1
+                        return
+                    delay = max((1 - self.tokens) / self.rate, 0.05)
+                    self.condition.wait(delay)
+            finally:
+                if interactive:
+                    self.waiting -= 1
+                    self.condition.notify_all()
+
+    def call(self, function, *args, idempotent=True, **kwargs):
+        """
+        Makes a call once a token is available, retrying it when the
+        API turns it down.
+
+        Args:
+            function (callable): The API call.
+            *args: Its positional arguments.
+            idempotent (bool): False for calls that must not be repeated
+                after a server error, since the server may have applied
+                them. Those are only retried after a 429.
+            **kwargs: Its keyword arguments.
+
+        Returns:
+            The result of the call.
+
+        Raises:
+            APIError: The last error, once every retry failed.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                return function(*args, **kwargs)
+            except APIError as e:
+                status = getattr(e.response, "status_code", None) or 0
+                throttled = status == 429
+                if attempt >= self.retries or not (
+                    throttled or (status >= 500 and idempotent)
+                ):
+                    raise
+                if throttled:
+                    with self.condition:
+                        self.refill()
+                        self.tokens = min(self.tokens, 0)
+            time.sleep(random.uniform(0, min(32, 2 ** attempt)))
+            attempt += 1
+
+
+class ClientPool:
     """
-    This class provides methods to interact with a Google Sheets spreadsheet.
-    It allows reading data from and writing data to specific worksheets
-    within the spreadsheet.
+    Authorized gspread clients shared by every spreadsheet opened in
+    the process.
+
+    The service account credentials are loaded once, so their access
+    token is refreshed once for every client, and up to
+    TRADING_BOOK_CLIENTS clients (each with its own HTTP session) are
+    handed out in turn, so books read concurrently do not queue on a
+    single connection. The quota being counted per service account,
+    every client goes through the same RequestScheduler.
+
+    The sessions keep their connections alive between calls, in a pool
+    of TRADING_BOOK_HTTP_POOL connections per host, ask for gzip
+    compressed responses (Google APIs only compress them for user
+    agents mentioning gzip) and give up on calls after
+    TRADING_BOOK_HTTP_TIMEOUT seconds. Every response is recorded by
+    METRICS as an 'http.<method>' operation with its duration and the
+    bytes received over the wire.
 
     Attributes:
         SCOPE (list): A list of scopes required for accessing Google Sheets
         and Google Drive.
+        size (int): Clients created at most.
+        clients (list): The clients created so far.
         CREDS (Credentials): Credentials object created from the service
-        account file.
-        SCOPED_CREDS (Credentials): Credentials object with specified scopes.
-        GSPREAD_CLIENT (gspread.Client): Authorized gspread client.
-        SHEET (gspread.Spreadsheet): The Google Sheets spreadsheet object.
+            account file, None until the first client is created.
+        SCOPED_CREDS (Credentials): Credentials object with specified
+            scopes.
+        scheduler (RequestScheduler): Paces every call to the Google
+            Sheets API to the TRADING_BOOK_QUOTA requests per minute.
+        connections (int): Connections kept alive per host and session.
+        timeout (tuple): Seconds to wait for a connection and for the
+            response.
+        gzip (bool): False to receive uncompressed responses, to compare
+            the bytes received with and without compression.
     """
 
+    SCOPE = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive.file",
+        "https://www.googleapis.com/auth/drive",
+    ]
+
     def __init__(self):
+        self.size = max(1, int(os.environ.get("TRADING_BOOK_CLIENTS", 4)))
+        self.clients = []
+        self.turn = 0
+        self.CREDS = None
+        self.SCOPED_CREDS = None
+        self.scheduler = RequestScheduler(
+            quota=int(os.environ.get("TRADING_BOOK_QUOTA", 60)),
+            retries=int(os.environ.get("TRADING_BOOK_RETRIES", 5)),
+        )
+        self.connections = max(
+            1, int(os.environ.get("TRADING_BOOK_HTTP_POOL", 10))
+        )
+        timeout = float(os.environ.get("TRADING_BOOK_HTTP_TIMEOUT", 30))
+        self.timeout = (min(10.0, timeout), timeout)
+        self.gzip = os.environ.get("TRADING_BOOK_HTTP_GZIP", "1") != "0"
+        self.lock = threading.Lock()
+
+    def client(self):
         """
-        Initializes the DataBaseActions class by setting up the necessary
-        Google API credentials and authorizing the gspread client to
-        access the specified spreadsheet.
+        Returns the next client of the pool, creating it if the pool is
+        not full yet.
         """
-        try:
-            self.SCOPE = [
-                "https://www.googleapis.com/auth/spreadsheets",
-                "https://www.googleapis.com/auth/drive.file",
-                "https://www.googleapis.com/auth/drive",
-            ]
-            self.CREDS = Credentials.from_service_account_file("creds.json")
-            self.SCOPED_CREDS = self.CREDS.with_scopes(self.SCOPE)
-            self.GSPREAD_CLIENT = gspread.authorize(self.SCOPED_CREDS)
-            self.SHEET = self.GSPREAD_CLIENT.open("trading_book")
-        except DefaultCredentialsError as e:
-            print(f"Failed to load credentials from service account file: {e}")
-        except GoogleAuthError as e:
-            print(f"Failed to authenticate with Google API: {e}")
-        except APIError as e:
-            print(f"Failed to authorize gspread client: {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred during initialization: {e}")
+        with self.lock:
+            if len(self.clients) < self.size:
+                if self.CREDS is None:
+                    self.CREDS = Credentials.from_service_account_file(
+                        "creds.json"
+                    )
+                    self.SCOPED_CREDS = self.CREDS.with_scopes(self.SCOPE)
+                client = gspread.authorize(
+                    self.SCOPED_CREDS, session=self.session()
+                )
+                client.set_timeout(self.timeout)
+                self.clients.append(client)
+            client = self.clients[self.turn % len(self.clients)]
+            self.turn += 1
+            return client
+
+    def session(self):
+        """
+        Returns a new authorized HTTP session, tuned as described above.
+        """
+        session = AuthorizedSession(self.SCOPED_CREDS)
+        # A connection dropped while idle is opened again once, and
+        # requests already sent are only repeated if idempotent, the
+        # API errors being retried by the RequestScheduler
+        adapter = HTTPAdapter(
+            pool_connections=self.connections,
+            pool_maxsize=self.connections,
+            max_retries=Retry(
+                total=2, connect=2, read=1, status=0, other=0,
+                raise_on_status=False,
+            ),
+        )
+        session.mount("https://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        if self.gzip:
+            session.headers["Accept-Encoding"] = "gzip"
+            session.headers["User-Agent"] = (
+                f"trading-book gspread/{gspread.__version__} (gzip)"
+            )
+        else:
+            session.headers["Accept-Encoding"] = "identity"
+        session.hooks["response"].append(self.measure)
+        return session
+
+    @staticmethod
+    def measure(response, *args, **kwargs):
+        """
+        Records a response, once read, with the bytes received over the
+        wire (compressed, when it was).
+        """
+        start = time.perf_counter()
+        response.content
+        METRICS.record(
+            f"http.{response.request.method.lower()}",
+            response.elapsed.total_seconds() + time.perf_counter() - start,
+            size=response.raw.tell() if response.raw is not None else 0,
+        )
+        return response
+
+
+SHEETS_CLIENTS = ClientPool()
+
+
+class GoogleSheetsBackend(StorageBackend):
+    """
+    Storage engine reading and writing a Google Sheets spreadsheet
+    through gspread.
+
+    Attributes:
+        SCOPE (list): A list of scopes required for accessing Google Sheets
+        and Google Drive.
+        CREDS (Credentials): Credentials object created from the service
+        account file.
+        SCOPED_CREDS (Credentials): Credentials object with specified scopes.
+        GSPREAD_CLIENT (gspread.Client): Authorized gspread client, taken
+            from the SHEETS_CLIENTS pool.
+        SHEET (gspread.Spreadsheet): The Google Sheets spreadsheet object.
+        scheduler (RequestScheduler): Paces every call to the Google
+            Sheets API, shared by every spreadsheet (see ClientPool).
+        headers (str): Location of the file recording the worksheets
+            whose header row was checked, None to check them each time.
+        checked (dict): Worksheet to the columns its header row was
+            checked against, see add_columns.
+    """
+
+    name = "sheets"
+    remote = True
+
+    def __init__(self, spreadsheet=DEFAULT_BOOK, folder=None):
+        """
+        Sets up the Google API credentials and opens the spreadsheet.
+
+        Args:
+            spreadsheet (str): The name of the spreadsheet to open.
+            folder (str, optional): The folder holding the local files
+                of the book, where the header checks are recorded.
+        """
+        self.SCOPE = SHEETS_CLIENTS.SCOPE
+        self.GSPREAD_CLIENT = SHEETS_CLIENTS.client()
+        self.CREDS = SHEETS_CLIENTS.CREDS
+        self.SCOPED_CREDS = SHEETS_CLIENTS.SCOPED_CREDS
+        self.scheduler = SHEETS_CLIENTS.scheduler
+        self.SHEET = self.scheduler.call(self.GSPREAD_CLIENT.open, spreadsheet)
+        self._worksheets = {}
+        self.headers = (
+            None if folder is None else os.path.join(folder, "headers.json")
+        )
+        self.checked = self.load_checked()
+
+    @classmethod
+    def open_book(cls, book, folder):
+        # Each book is a spreadsheet named after it
+        return cls(book, folder)
+
+    def worksheet(self, worksheet):
+        """
+        Returns the gspread Worksheet handle, fetching its metadata only
+        the first time it is requested.
+        """
+        if worksheet not in self._worksheets:
+            try:
+                handle = self.scheduler.call(self.SHEET.worksheet, worksheet)
+            except WorksheetNotFound:
+                handle = self.add_worksheet(worksheet)
+            else:
+                self.add_columns(handle, worksheet)
+            self._worksheets[worksheet] = handle
+        return self._worksheets[worksheet]
+
+    def add_columns(self, handle, worksheet):
+        """
+        Brings a worksheet set up before columns were added to its
+        schema up to date: widens it when it is too narrow, and writes
+        the header cells missing from its first row, however wide it is.
+
+        The header row is only read until it was found complete for the
+        current schema, which is then recorded in the book's folder, so
+        later sessions skip the read until columns are added again.
+        """
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        if handle.col_count < len(columns):
+            self.scheduler.call(
+                handle.add_cols, len(columns) - handle.col_count,
+                idempotent=False,
+            )
+        elif self.checked.get(worksheet) == columns:
+            return
+        header = self.scheduler.call(handle.row_values, 1)
+        header = header + [""] * (len(columns) - len(header))
+        if not all(header[i] for i in range(len(columns))):
+            self.scheduler.call(
+                handle.update, range_name=row_range(1, columns),
+                values=[[
+                    header[i] or column for i, column in enumerate(columns)
+                ]],
+            )
+        self.header_checked(worksheet)
+
+    def load_checked(self):
+        """
+        Returns the header checks recorded by earlier sessions, none if
+        they cannot be read.
+        """
+        if self.headers is None:
+            return {}
+        try:
+            with open(self.headers, encoding="utf-8") as file:
+                return dict(json.load(file))
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def header_checked(self, worksheet):
+        """
+        Records that the header row of a worksheet holds every column
+        of its schema, see add_columns.
+        """
+        self.checked[worksheet] = WORKSHEET_SCHEMAS[worksheet]
+        if self.headers is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.headers), exist_ok=True)
+            temporary = f"{self.headers}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(dict(self.checked), file)
+            os.replace(temporary, self.headers)
+        except OSError as e:
+            print(f"Failed to record the header check: {e}")
+
+    def add_worksheet(self, worksheet):
+        """
+        Creates a worksheet missing from the spreadsheet, such as one
+        added to WORKSHEET_SCHEMAS after the spreadsheet was set up,
+        with its header row.
+        """
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        handle = self.scheduler.call(
+            self.SHEET.add_worksheet, worksheet, rows=1,
+            cols=len(columns), idempotent=False,
+        )
+        self.scheduler.call(
+            handle.update, range_name=row_range(1, columns),
+            values=[columns],
+        )
+        self.header_checked(worksheet)
+        return handle
+
+    @METRICS.measured
+    def get_all_values(self, worksheet):
+        return self.scheduler.call(self.worksheet(worksheet).get_all_values)
+
+    @METRICS.measured
+    def revision(self):
+        # Drive modifiedTime, changed by any edit of the spreadsheet
+        return self.scheduler.call(self.SHEET.get_lastUpdateTime)
+
+    @METRICS.measured
+    def get_rows(self, worksheet, start):
+        last = chr(65 + len(WORKSHEET_SCHEMAS[worksheet]) - 1)
+        return [
+            list(row) for row in self.scheduler.call(
+                self.worksheet(worksheet).get, f"A{start}:{last}"
+            )
+        ]
+
+    @METRICS.measured
+    def row_values(self, worksheet, row):
+        return self.scheduler.call(self.worksheet(worksheet).row_values, row)
+
+    @METRICS.measured
+    def read_rows(self, worksheet, rows):
+        last = chr(65 + len(WORKSHEET_SCHEMAS[worksheet]) - 1)
+        ranges = self.scheduler.call(
+            self.worksheet(worksheet).batch_get,
+            [f"A{row}:{last}{row}" for row in rows],
+        )
+        return {
+            row: list(values[0])
+            for row, values in zip(rows, ranges) if values
+        }
+
+    def find_rows(self, worksheet, asset=None, action=None):
+        return filter_rows(
+            worksheet, self.get_all_values(worksheet), asset, action
+        )
+
+    @METRICS.measured
+    def append_row(self, worksheet, data):
+        self.scheduler.call(
+            self.worksheet(worksheet).append_row, data, idempotent=False
+        )
+
+    @METRICS.measured
+    def update_row(self, worksheet, row, data):
+        self.scheduler.call(
+            self.worksheet(worksheet).update,
+            range_name=row_range(row, data), values=[data],
+        )
+
+    @METRICS.measured
+    def append_rows(self, worksheet, rows):
+        # An append repeated after a server error could add rows twice
+        response = self.scheduler.call(
+            self.worksheet(worksheet).append_rows, rows, idempotent=False
+        )
+        updated = response.get("updates", {}).get("updatedRange", "")
+        first = re.search(r"![A-Z]+(\d+)", updated)
+        return int(first.group(1)) if first else None
+
+    @METRICS.measured
+    def delete_rows(self, worksheet, start, end):
+        self.scheduler.call(
+            self.worksheet(worksheet).delete_rows, start, end,
+            idempotent=False,
+        )
+
+    @METRICS.measured
+    def delete_ranges(self, worksheet, ranges):
+        # A single request, deleting the lowest ranges first so the
+        # numbers of the ranges above them still hold
+        sheet_id = self.worksheet(worksheet).id
+        self.scheduler.call(self.SHEET.batch_update, {"requests": [
+            {"deleteDimension": {"range": {
+                "sheetId": sheet_id, "dimension": "ROWS",
+                "startIndex": start - 1, "endIndex": end,
+            }}}
+            for start, end in sorted(ranges, reverse=True)
+        ]}, idempotent=False)
+
+    @METRICS.measured
+    def batch_update(self, worksheet, updates):
+        self.scheduler.call(self.worksheet(worksheet).batch_update, [
+            {"range": row_range(row, data), "values": [data]}
+            for row, data in updates
+        ])
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Local storage engine keeping every worksheet as a SQLite table,
+    with indexes on the asset and action columns so lookups of open
+    trades do not scan the whole book.
+
+    Attributes:
+        path (str): Location of the SQLite database file.
+        connection (sqlite3.Connection): Open connection to the database.
+    """
+
+    name = "sqlite"
+
+    # Default settings stored in the 'set' table of a brand new database
+    DEFAULT_SETTINGS = ["10", "0.2", "0.06", "1000"]
+
+    def __init__(self, path=None):
+        """
+        Opens (creating when needed) the SQLite database and its tables.
+
+        Args:
+            path (str, optional): Database file, defaults to
+                'trading_book.sqlite3' inside LOCAL_STATE_DIR.
+        """
+        if path is None:
+            os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+            path = os.path.join(LOCAL_STATE_DIR, "trading_book.sqlite3")
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.tables = set()
+        self.create_schema()
+
+    @classmethod
+    def open_book(cls, book, folder):
+        os.makedirs(folder, exist_ok=True)
+        return cls(os.path.join(folder, "trading_book.sqlite3"))
+
+    def create_schema(self):
+        """
+        Creates the worksheet tables and their indexes if missing, and
+        seeds the 'set' table with the default settings.
+        """
+        with self.connection:
+            for worksheet in WORKSHEET_SCHEMAS:
+                self._create(worksheet)
+            if not self.connection.execute('SELECT 1 FROM "set"').fetchone():
+                self.connection.execute(
+                    'INSERT INTO "set" VALUES (2, ?, ?, ?, ?)',
+                    self.DEFAULT_SETTINGS,
+                )
+
+    def _create(self, worksheet):
+        """
+        Creates the table of a worksheet and its indexes if missing,
+        the tables of partitions being created on their first use.
+        """
+        if worksheet in self.tables:
+            return
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        fields = ", ".join(f'"{column}" TEXT' for column in columns)
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{worksheet}" '
+            f"(row_number INTEGER PRIMARY KEY, {fields})"
+        )
+        # Tables made before columns were added to the schema
+        existing = {
+            row[1] for row in self.connection.execute(
+                f'PRAGMA table_info("{worksheet}")'
+            )
+        }
+        for column in columns:
+            if column not in existing:
+                self.connection.execute(
+                    f'ALTER TABLE "{worksheet}" ADD COLUMN "{column}" TEXT'
+                )
+        if "asset" in columns:
+            self.connection.execute(
+                f'CREATE INDEX IF NOT EXISTS "{worksheet}_asset" '
+                f'ON "{worksheet}" (asset, action)'
+            )
+            self.connection.execute(
+                f'CREATE INDEX IF NOT EXISTS "{worksheet}_action" '
+                f'ON "{worksheet}" (action)'
+            )
+        self.tables.add(worksheet)
+
+    def is_empty(self):
+        """
+        Returns True if no trade has been stored yet.
+        """
+        query = 'SELECT 1 FROM "{}" LIMIT 1'
+        return not any(
+            self.connection.execute(query.format(worksheet)).fetchone()
+            for worksheet in ("entry", "raw_data")
+        )
+
+    def seed_from(self, backend):
+        """
+        Copies every worksheet of another backend into this database,
+        replacing the local content.
+
+        Args:
+            backend (StorageBackend): The backend to copy from.
+        """
+        with self.connection:
+            for worksheet in WORKSHEET_SCHEMAS:
+                self._replace(worksheet, backend.get_all_values(worksheet))
+            for partition in catalog_partitions(
+                self.get_all_values("partitions")
+            ):
+                self._replace(partition, backend.get_all_values(partition))
+
+    def replace(self, worksheet, values):
+        """
+        Replaces the content of a worksheet table.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            values (list): All rows of the worksheet, headers included.
+        """
+        with self.connection:
+            self._replace(worksheet, values)
+
+    def _replace(self, worksheet, values):
+        self._create(worksheet)
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        self.connection.execute(f'DELETE FROM "{worksheet}"')
+        self.connection.executemany(
+            f'INSERT INTO "{worksheet}" VALUES '
+            f'(?, {", ".join("?" * len(columns))})',
+            [
+                [number] + self._pad(worksheet, row)
+                for number, row in enumerate(values[1:], 2)
+            ],
+        )
+
+    def _pad(self, worksheet, data):
+        """
+        Converts data into cell strings and pads it to the full width
+        of the worksheet.
+        """
+        width = len(WORKSHEET_SCHEMAS[worksheet])
+        cells = [format_cell(value) for value in data[:width]]
+        return cells + [""] * (width - len(cells))
+
+    def _select(self, worksheet, where="", args=()):
+        self._create(worksheet)
+        return [
+            list(row) for row in self.connection.execute(
+                f'SELECT * FROM "{worksheet}" {where} ORDER BY row_number',
+                args,
+            )
+        ]
+
+    @METRICS.measured
+    def get_all_values(self, worksheet):
+        rows = [row[1:] for row in self._select(worksheet)]
+        return [list(WORKSHEET_SCHEMAS[worksheet])] + rows
+
+    @METRICS.measured
+    def get_rows(self, worksheet, start):
+        if start <= 1:
+            return self.get_all_values(worksheet)
+        rows = self._select(worksheet, "WHERE row_number >= ?", (start,))
+        return [row[1:] for row in rows]
+
+    @METRICS.measured
+    def row_values(self, worksheet, row):
+        if row == 1:
+            return list(WORKSHEET_SCHEMAS[worksheet])
+        rows = self._select(worksheet, "WHERE row_number = ?", (row,))
+        return rows[0][1:] if rows else []
+
+    @METRICS.measured
+    def read_rows(self, worksheet, rows):
+        marks = ", ".join("?" * len(rows))
+        selected = self._select(
+            worksheet, f"WHERE row_number IN ({marks})", tuple(rows)
+        )
+        return {row[0]: row[1:] for row in selected}
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        # Takes the database write lock until the end of the block
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            if self.connection.in_transaction:
+                self.connection.rollback()
+            raise
+        if self.connection.in_transaction:
+            self.connection.commit()
+
+    @METRICS.measured
+    def find_rows(self, worksheet, asset=None, action=None):
+        conditions, args = [], []
+        if asset is not None:
+            conditions.append("asset = ?")
+            args.append(asset)
+        if action is not None:
+            conditions.append("action = ?")
+            args.append(action)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return [
+            (row[0], row[1:])
+            for row in self._select(worksheet, where, args)
+        ]
+
+    def _insert(self, worksheet, data):
+        self._create(worksheet)
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        self.connection.execute(
+            f'INSERT INTO "{worksheet}" VALUES ('
+            f'(SELECT COALESCE(MAX(row_number), 1) + 1 FROM "{worksheet}"),'
+            f' {", ".join("?" * len(columns))})',
+            self._pad(worksheet, data),
+        )
+
+    def _update(self, worksheet, row, data):
+        self._create(worksheet)
+        columns = WORKSHEET_SCHEMAS[worksheet][:len(data)]
+        assignments = ", ".join(
+            f'"{column}" = COALESCE(?, "{column}")' for column in columns
+        )
+        cells = [None if value is None else format_cell(value)
+                 for value in data]
+        cursor = self.connection.execute(
+            f'UPDATE "{worksheet}" SET {assignments} '
+            "WHERE row_number = ?",
+            cells + [row],
+        )
+        if cursor.rowcount == 0:
+            width = len(WORKSHEET_SCHEMAS[worksheet])
+            self.connection.execute(
+                f'INSERT INTO "{worksheet}" VALUES '
+                f'(?, {", ".join("?" * width)})',
+                [row] + self._pad(worksheet, data),
+            )
+
+    @METRICS.measured
+    def append_row(self, worksheet, data):
+        self.append_rows(worksheet, [data])
+
+    @METRICS.measured
+    def update_row(self, worksheet, row, data):
+        self.batch_update(worksheet, [(row, data)])
+
+    @METRICS.measured
+    def append_rows(self, worksheet, rows):
+        with self.connection:
+            self._create(worksheet)
+            first = self.connection.execute(
+                f'SELECT COALESCE(MAX(row_number), 1) + 1 FROM "{worksheet}"'
+            ).fetchone()[0]
+            for data in rows:
+                self._insert(worksheet, data)
+        return first
+
+    @METRICS.measured
+    def batch_update(self, worksheet, updates):
+        with self.connection:
+            for row, data in updates:
+                self._update(worksheet, row, data)
+
+    def _delete(self, worksheet, start, end):
+        self._create(worksheet)
+        self.connection.execute(
+            f'DELETE FROM "{worksheet}" WHERE row_number BETWEEN ? AND ?',
+            (start, end),
+        )
+        # Shift the rows below up, through negative numbers so the
+        # primary key never collides
+        self.connection.execute(
+            f'UPDATE "{worksheet}" SET row_number = -(row_number - ?) '
+            "WHERE row_number > ?",
+            (end - start + 1, end),
+        )
+        self.connection.execute(
+            f'UPDATE "{worksheet}" SET row_number = -row_number '
+            "WHERE row_number < 0"
+        )
+
+    @METRICS.measured
+    def delete_rows(self, worksheet, start, end):
+        with self.connection:
+            self._delete(worksheet, start, end)
+
+    @METRICS.measured
+    def delete_ranges(self, worksheet, ranges):
+        with self.connection:
+            for start, end in sorted(ranges, reverse=True):
+                self._delete(worksheet, start, end)
+
+    @METRICS.measured
+    def move_rows(self, source, target, rows):
+        # A single SQLite transaction, rows are never left in both
+        with self.connection:
+            for _, data in rows:
+                self._insert(target, data)
+            ranges = row_ranges(number for number, _ in rows)
+            for start, end in sorted(ranges, reverse=True):
+                self._delete(source, start, end)
+
+    @METRICS.measured
+    def commit(self, appends, updates, originals):
+        # A single SQLite transaction, rolled back as a whole on error
+        with self.connection:
+            for worksheet, rows in appends.items():
+                for data in rows:
+                    self._insert(worksheet, data)
+            for worksheet, rows in updates.items():
+                for row, data in rows:
+                    self._update(worksheet, row, data)
+
+
+# Storage engines that can be selected at startup
+STORAGE_BACKENDS = {
+    GoogleSheetsBackend.name: GoogleSheetsBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def pad_row(worksheet, row):
+    """
+    Returns a row padded with empty cells to the full width of the
+    worksheet.
+    """
+    return row + [""] * (len(WORKSHEET_SCHEMAS[worksheet]) - len(row))
+
+
+def cells_match(first, second):
+    """
+    Compares two cells, numbers being equal when they hold the same
+    value however they are written ('1000' and '1000.0').
+
+    Returns:
+        bool: True if the cells hold the same value.
+    """
+    first, second = format_cell(first), format_cell(second)
+    if first == second:
+        return True
+    try:
+        return float(first.replace(",", "")) == float(second.replace(",", ""))
+    except ValueError:
+        return False
+
+
+def rows_match(first, second):
+    """
+    Compares two rows cell by cell, see cells_match.
+
+    Returns:
+        bool: True if the rows hold the same values.
+    """
+    return len(first) == len(second) and all(map(cells_match, first, second))
+
+
+class RowStore:
+    """
+    Column oriented storage for the rows of a cached worksheet, taking
+    a fraction of the memory of a list of lists of strings.
+
+    Numeric columns are held as floats in array('d'), NaN standing for
+    an empty cell. Every other column is held in array('I') as indexes
+    into a string table, so each distinct text (asset, action, date...)
+    is kept once and can be searched without comparing strings. Cells
+    that do not read back the same once stored as a float, like the
+    headers, are kept as text in the overrides dict.
+
+    Reading a row (store[i], slicing, iterating) rebuilds it as a list
+    of cell strings, like the rows returned by the storage engines.
+
+    Attributes:
+        width (int): Number of columns of the worksheet.
+        numeric (list): True for the columns stored as floats.
+        columns (list): One array per column.
+        strings (list): The string table, text by index.
+        codes (dict): The string table, index by text.
+        overrides (dict): (row index, column) to the text of the cells
+            of numeric columns that are not stored as floats.
+        mapped (bool): True while the columns are read-only views on a
+            memory-mapped snapshot, see BookSnapshot. The columns, the
+            strings and the codes are then read from the file as they
+            are used (see SnapshotColumns, SnapshotStrings).
+    """
+
+    def __init__(self, worksheet, rows=()):
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        self.width = len(columns)
+        self.numeric = [column in NUMERIC_COLUMNS for column in columns]
+        self.columns = [
+            array("d") if numeric else array("I") for numeric in self.numeric
+        ]
+        self.strings = [""]
+        self.codes = {"": 0}
+        self.overrides = {}
+        self.mapped = False
+        self.extend(rows)
+
+    def __len__(self):
+        if self.mapped:
+            # Known without checking a column block
+            return self.columns.rows
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        return self.row(index)
+
+    def __setitem__(self, index, row):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        self.store(index, row)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def code(self, text):
+        """
+        Returns the index of a text in the string table, adding it.
+        """
+        code = self.codes.get(text)
+        if code is None:
+            code = self.codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+
+    def store(self, index, row):
+        """
+        Writes a row at an index, appending it when the index is the
+        length of the store.
+        """
+        if self.mapped:
+            # Copy the snapshot columns into memory before the first write
+            self.columns = [
+                array(column.format, column.tobytes())
+                for column in self.columns
+            ]
+            self.mapped = False
+        cells = [format_cell(value) for value in row[:self.width]]
+        cells += [""] * (self.width - len(cells))
+        append = index == len(self)
+        for column, text in enumerate(cells):
+            if self.numeric[column]:
+                value = math.nan
+                self.overrides.pop((index, column), None)
+                if text:
+                    try:
+                        value = float(text)
+                    except ValueError:
+                        pass
+                    if value != value or format_cell(value) != text:
+                        value = math.nan
+                        self.overrides[(index, column)] = text
+            else:
+                value = self.code(text)
+            if append:
+                self.columns[column].append(value)
+            else:
+                self.columns[column][index] = value
+
+    def append(self, row):
+        self.store(len(self), row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def cell(self, index, column):
+        """
+        Returns the text of a cell.
+        """
+        value = self.columns[column][index]
+        if not self.numeric[column]:
+            return self.strings[value]
+        if value != value:
+            return self.overrides.get((index, column), "")
+        return format_cell(value)
+
+    def row(self, index):
+        """
+        Returns the row at an index as a list of cell strings.
+        """
+        return [self.cell(index, column) for column in range(self.width)]
+
+    def head(self, stop):
+        """
+        Returns a new store holding the first rows, up to stop. Both
+        stores share the string table.
+        """
+        store = RowStore.__new__(RowStore)
+        store.width = self.width
+        store.numeric = self.numeric
+        if self.mapped:
+            store.columns = self.columns.head(stop)
+        else:
+            store.columns = [column[:stop] for column in self.columns]
+        store.strings = self.strings
+        store.codes = self.codes
+        store.overrides = {
+            key: text for key, text in self.overrides.items()
+            if key[0] < stop
+        }
+        store.mapped = self.mapped
+        return store
+
+    def matching(self, column, text):
+        """
+        Returns the indexes of the rows whose cell in a text column
+        holds the given text.
+        """
+        code = self.codes.get(text)
+        if code is None:
+            return []
+        return [
+            index for index, value in enumerate(self.columns[column])
+            if value == code
+        ]
+
+
+class SnapshotError(ValueError):
+    """
+    Raised when a snapshot file is missing, damaged or was written by
+    an incompatible version.
+    """
+
+
+class BookSnapshot:
+    """
+    Binary snapshot of a worksheet held in a RowStore, written to disk
+    after each sync of a remote worksheet and memory-mapped on the next
+    start, so the rows known from the last session are available
+    without reading the whole worksheet again.
+
+    File layout, little or big endian as the machine writing it:
+
+        header      magic, version, byte order, width, row count,
+                    string count, string table and metadata offsets,
+                    time of the last full read, CRC32 of the string
+                    table and of the metadata
+        directory   typecode, CRC32 and offset of each column block
+        checksum    CRC32 of the header and directory
+        columns     one block per column, the raw array('d') or
+                    array('I') content, aligned on 8 bytes
+        strings     string count + 1 offsets (uint32) into the
+                    UTF-8 text of the string table
+        metadata    JSON: the last row as read, the overrides and the
+                    engine revision the rows were read at
+
+    Only the header, the directory and the metadata are checked when
+    the file is opened. Column blocks are used in place through
+    memoryviews on the mapped file, each checked against its CRC32 the
+    first time it is used (see SnapshotColumns), and the strings are
+    decoded as they are needed (see SnapshotStrings).
+    """
+
+    MAGIC = b"TBSNAP"
+    VERSION = 3
+    HEADER = struct.Struct("=6sHcxHIIQQQdII")
+    COLUMN = struct.Struct("=cxxxIQ")
+    CHECKSUM = struct.Struct("=I")
+
+    @staticmethod
+    def align(offset):
+        return (offset + 7) & ~7
+
+    @classmethod
+    def write(cls, path, store, boundary, loaded, revision=None):
+        """
+        Writes a store to a snapshot file, replacing it atomically.
+
+        Args:
+            path (str): Location of the snapshot file.
+            store (RowStore): The rows to save.
+            boundary (list): The last row as read from the engine.
+            loaded (float): time.time() of the last full read.
+            revision (str, optional): The engine revision the rows were
+                read at.
+        """
+        byteorder = b"L" if sys.byteorder == "little" else b"B"
+        directory_size = cls.COLUMN.size * store.width
+        start = offset = cls.align(
+            cls.HEADER.size + directory_size + cls.CHECKSUM.size
+        )
+        blocks, directory = [], b""
+        for column in store.columns:
+            data = column.tobytes()
+            directory += cls.COLUMN.pack(
+                column_type(column), zlib.crc32(data), offset
+            )
+            blocks.append((offset, data))
+            offset = cls.align(offset + len(data))
+
+        texts = [text.encode("utf-8") for text in store.strings]
+        offsets, position = array("I", [0]), 0
+        for text in texts:
+            position += len(text)
+            offsets.append(position)
+        strings = offsets.tobytes() + b"".join(texts)
+        strings_offset = offset
+        meta = json.dumps({
+            "boundary": boundary,
+            "overrides": [
+                [index, column, text]
+                for (index, column), text in store.overrides.items()
+            ],
+            "revision": revision,
+        }).encode("utf-8")
+        meta_offset = cls.align(strings_offset + len(strings))
+
+        body = bytearray(meta_offset + len(meta) - start)
+        for block_offset, data in blocks:
+            body[block_offset - start:block_offset - start + len(data)] = data
+        position = strings_offset - start
+        body[position:position + len(strings)] = strings
+        body[meta_offset - start:] = meta
+
+        header = cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, byteorder, store.width, len(store),
+            len(texts), strings_offset, meta_offset, len(meta), loaded,
+            zlib.crc32(strings), zlib.crc32(meta),
+        ) + directory
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(header + cls.CHECKSUM.pack(zlib.crc32(header)))
+            file.seek(start)
+            file.write(body)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def read(cls, path, worksheet):
+        """
+        Opens a snapshot file through mmap.
+
+        Args:
+            path (str): Location of the snapshot file.
+            worksheet (str): The worksheet the snapshot holds.
+
+        Returns:
+            tuple: The RowStore, its columns mapped from the file, the
+                last row as read from the engine, the time.time() of
+                the last full read and the engine revision the rows
+                were read at (None if unknown).
+
+        Raises:
+            SnapshotError: If the file cannot be used.
+        """
+        try:
+            with open(path, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SnapshotError(f"cannot open {path}: {e}")
+        try:
+            (
+                magic, version, byteorder, width, rows, count,
+                strings_offset, meta_offset, meta_length, loaded,
+                strings_checksum, meta_checksum,
+            ) = cls.HEADER.unpack_from(buffer)
+        except struct.error:
+            raise SnapshotError(f"{path} is truncated")
+        expected = b"L" if sys.byteorder == "little" else b"B"
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise SnapshotError(f"{path} is not a version {cls.VERSION} "
+                                "snapshot")
+        if byteorder != expected:
+            raise SnapshotError(f"{path} was written on another platform")
+        store = RowStore(worksheet)
+        if width != store.width:
+            raise SnapshotError(f"{path} does not match the worksheet")
+        end = cls.HEADER.size + cls.COLUMN.size * width
+        (checksum,) = cls.CHECKSUM.unpack_from(buffer, end)
+        if zlib.crc32(buffer[:end]) != checksum:
+            raise SnapshotError(f"{path} header checksum mismatch")
+        if meta_offset + meta_length > len(buffer):
+            raise SnapshotError(f"{path} is truncated")
+        view = memoryview(buffer)
+        meta = view[meta_offset:meta_offset + meta_length]
+        if zlib.crc32(meta) != meta_checksum:
+            raise SnapshotError(f"{path} metadata checksum mismatch")
+        meta = json.loads(bytes(meta))
+
+        blocks, checksums = [], []
+        for column in range(width):
+            typecode, checksum, offset = cls.COLUMN.unpack_from(
+                buffer, cls.HEADER.size + cls.COLUMN.size * column
+            )
+            typecode = typecode.decode("ascii")
+            size = array(typecode).itemsize * rows
+            if offset + size > strings_offset:
+                raise SnapshotError(f"{path} is truncated")
+            blocks.append(view[offset:offset + size].cast(typecode))
+            checksums.append(checksum)
+        if strings_offset + 4 * (count + 1) > meta_offset:
+            raise SnapshotError(f"{path} is truncated")
+        strings = SnapshotStrings(
+            path, buffer, strings_offset, count, strings_checksum
+        )
+
+        store.columns = SnapshotColumns(path, blocks, checksums)
+        store.strings = strings
+        store.codes = SnapshotCodes(strings)
+        store.overrides = {
+            (index, column): text
+            for index, column, text in meta["overrides"]
+        }
+        store.mapped = True
+        # Keeps the mapping open as long as the store uses it
+        store.buffer = buffer
+        return store, meta["boundary"], loaded, meta.get("revision")
+
+
+class SnapshotColumns:
+    """
+    The column blocks of a BookSnapshot, used in place as RowStore
+    columns. Each block is checked against its CRC32 the first time
+    it is used, so columns a session never reads are never checked.
+
+    Attributes:
+        path (str): Location of the snapshot file.
+        blocks (list): One memoryview per column, on the whole block.
+        checksums (list): The CRC32 of each block, None once checked.
+            Shared with the copies made by head.
+        views (list): The blocks, limited to the rows of the store.
+        rows (int): Number of rows of the store.
+    """
+
+    def __init__(self, path, blocks, checksums, stop=None):
+        self.path = path
+        self.blocks = blocks
+        self.checksums = checksums
+        self.views = [block[:stop] for block in blocks]
+        self.rows = len(self.views[0])
+
+    def __len__(self):
+        return len(self.views)
+
+    def __getitem__(self, index):
+        if self.checksums[index] is not None:
+            self.check(index)
+        return self.views[index]
+
+    def __iter__(self):
+        for index in range(len(self.views)):
+            yield self[index]
+
+    def check(self, index):
+        """
+        Checks a column block against its CRC32, once.
+
+        Raises:
+            SnapshotError: If the block is damaged.
+        """
+        if self.checksums[index] is None:
+            return
+        if zlib.crc32(self.blocks[index]) != self.checksums[index]:
+            raise SnapshotError(
+                f"{self.path} checksum mismatch in column {index}"
+            )
+        self.checksums[index] = None
+
+    def head(self, stop):
+        """
+        Returns the columns limited to their first rows, up to stop.
+        """
+        return SnapshotColumns(self.path, self.blocks, self.checksums, stop)
+
+
+class SnapshotStrings:
+    """
+    The string table of a BookSnapshot, used in place as the strings
+    of a RowStore. Each text is decoded the first time it is read, the
+    whole table being checked against its CRC32 before the first one.
+    Texts added since are kept in memory.
+
+    Attributes:
+        path (str): Location of the snapshot file.
+        buffer (mmap.mmap): The mapped snapshot file.
+        offsets (memoryview): Start of each text, count + 1 of them.
+        base (int): Position in the file of the first text.
+        count (int): Number of texts in the file.
+        checksum (int): The CRC32 of the table, None once checked.
+        decoded (dict): Index to the texts decoded so far.
+        added (list): The texts added since the file was read.
+    """
+
+    def __init__(self, path, buffer, offset, count, checksum):
+        self.path = path
+        self.buffer = buffer
+        self.base = offset + 4 * (count + 1)
+        self.offsets = memoryview(buffer)[offset:self.base].cast("I")
+        self.count = count
+        self.checksum = checksum
+        self.decoded = {}
+        self.added = []
+
+    def __len__(self):
+        return self.count + len(self.added)
+
+    def __getitem__(self, code):
+        if code >= self.count:
+            return self.added[code - self.count]
+        text = self.decoded.get(code)
+        if text is None:
+            self.check()
+            start, end = self.offsets[code], self.offsets[code + 1]
+            text = self.decoded[code] = self.buffer[
+                self.base + start:self.base + end
+            ].decode("utf-8")
+        return text
+
+    def __iter__(self):
+        for code in range(len(self)):
+            yield self[code]
+
+    def append(self, text):
+        self.added.append(text)
+
+    def check(self):
+        """
+        Checks the string table against its CRC32, once.
+
+        Raises:
+            SnapshotError: If the table is damaged.
+        """
+        if self.checksum is None:
+            return
+        end = self.base + self.offsets[self.count]
+        if end > len(self.buffer) or zlib.crc32(
+            memoryview(self.buffer)[self.base - 4 * (self.count + 1):end]
+        ) != self.checksum:
+            raise SnapshotError(f"{self.path} string table checksum mismatch")
+        self.checksum = None
+
+    def find(self, text):
+        """
+        Returns the index of a text of the file, None if it is not one
+        of them, searching the UTF-8 text without decoding it.
+        """
+        self.check()
+        if not text:
+            # The first text of a RowStore is always the empty one
+            return 0 if self.count else None
+        encoded = text.encode("utf-8")
+        end = self.base + self.offsets[self.count]
+        position = self.buffer.find(encoded, self.base, end)
+        while position != -1:
+            start = position - self.base
+            code = bisect.bisect_right(self.offsets, start) - 1
+            if (
+                code < self.count
+                and self.offsets[code] == start
+                and self.offsets[code + 1] == start + len(encoded)
+            ):
+                return code
+            position = self.buffer.find(encoded, position + 1, end)
+        return None
+
+
+class SnapshotCodes(dict):
+    """
+    Text to index map of the string table of a BookSnapshot, the texts
+    of the file being found in its string table when first looked up
+    (see SnapshotStrings.find).
+    """
+
+    def __init__(self, strings):
+        super().__init__()
+        self.strings = strings
+
+    def get(self, text, default=None):
+        code = super().get(text)
+        if code is None:
+            code = self.strings.find(text)
+            if code is None:
+                return default
+            self[text] = code
+        return code
+
+
+def column_type(column):
+    """
+    Returns the array typecode of a RowStore column, as bytes.
+    """
+    code = column.typecode if isinstance(column, array) else column.format
+    return code.encode("ascii")
+
+
+class HistoryError(ValueError):
+    """
+    Raised when a chunk of a HistoryArchive is damaged.
+    """
+
+
+class HistoryArchive:
+    """
+    Local archive of the rows of an append-only worksheet, such as the
+    trade events of 'raw_data' or the closed trades of 'entry_archive',
+    kept as independently compressed chunks so the whole history of a
+    book takes a few megabytes and a sync only writes the chunks it
+    completes.
+
+    Files, in the 'history' folder of the book's state folder:
+
+        <worksheet>.chunks  the full chunks of chunk_rows rows, one
+                            after the other, each a CHUNK header (magic,
+                            length, CRC32) and the zlib compressed JSON
+                            list of its rows
+        <worksheet>.index   JSON: offset, length, first row, row count
+                            and first and last date of each chunk, the
+                            rows of each source worksheet archived, and
+                            the last rows, fewer than a chunk, as one
+                            more chunk encoded in base64
+
+    The chunks file is only ever appended to, and the index replaced
+    atomically once the chunks it lists are on disk, so bytes left past
+    the last chunk listed by an interrupted sync are overwritten by the
+    next one.
+
+    Attributes:
+        path (str): Location of the files, without their extension.
+        worksheet (str): The worksheet archived.
+        index (dict): The index, as saved.
+    """
+
+    MAGIC = b"TBCH"
+    VERSION = 1
+    CHUNK = struct.Struct("=4sII")
+
+    def __init__(self, folder, worksheet):
+        """
+        Loads the index of the archive of a worksheet, or starts an
+        empty archive of chunks of TRADING_BOOK_HISTORY_CHUNK rows.
+
+        Args:
+            folder (str): The folder of the archive files.
+            worksheet (str): The worksheet archived.
+        """
+        self.path = os.path.join(folder, worksheet)
+        self.worksheet = worksheet
+        try:
+            with open(self.path + ".index", encoding="utf-8") as file:
+                self.index = json.load(file)
+            if self.index.get("version") != self.VERSION:
+                raise ValueError(self.index.get("version"))
+        except (OSError, ValueError):
+            self.clear()
+
+    def clear(self):
+        """
+        Empties the archive, the files being rewritten on the next sync.
+        """
+        self.index = {
+            "version": self.VERSION,
+            "chunk_rows": max(1, int(
+                os.environ.get("TRADING_BOOK_HISTORY_CHUNK", 10000)
+            )),
+            "chunks": [],
+            "tail": None,
+            "rows": 0,
+            "sources": {},
+            "complete": [],
+        }
+
+    @classmethod
+    def pack(cls, rows):
+        """
+        Returns the bytes of a chunk holding the given rows.
+        """
+        data = zlib.compress(
+            json.dumps(rows, separators=(",", ":")).encode("utf-8"), 9
+        )
+        return cls.CHUNK.pack(cls.MAGIC, len(data), zlib.crc32(data)) + data
+
+    @classmethod
+    def unpack(cls, chunk):
+        """
+        Returns the rows of a chunk.
+
+        Raises:
+            HistoryError: If the chunk is damaged.
+        """
+        try:
+            magic, length, checksum = cls.CHUNK.unpack_from(chunk)
+        except struct.error:
+            raise HistoryError("truncated chunk")
+        data = chunk[cls.CHUNK.size:cls.CHUNK.size + length]
+        if magic != cls.MAGIC or len(data) != length:
+            raise HistoryError("truncated chunk")
+        if zlib.crc32(data) != checksum:
+            raise HistoryError("chunk checksum mismatch")
+        return json.loads(zlib.decompress(data))
+
+    @staticmethod
+    def bounds(rows):
+        """
+        Returns the first and last 'YYYY-MM-DD' dates of some rows,
+        taken from their first cell.
+        """
+        dates = [str(row[0])[:10] for row in rows if row and row[0]]
+        return (min(dates), max(dates)) if dates else ("", "")
+
+    def tail(self):
+        """
+        Returns the last rows, not part of a full chunk yet.
+        """
+        if not self.index["tail"]:
+            return []
+        return self.unpack(base64.b64decode(self.index["tail"]["chunk"]))
+
+    def extend(self, rows, sources=None, complete=()):
+        """
+        Appends rows to the archive, compressing every full chunk they
+        complete, then saves the index.
+
+        Args:
+            rows (list): The rows to append.
+            sources (dict, optional): Rows archived from each source
+                worksheet, recorded in the index.
+            complete (iterable): Source worksheets no more rows will be
+                added to.
+        """
+        index = self.index
+        pending = self.tail() + [list(row) for row in rows]
+        size = index["chunk_rows"]
+        chunks = index["chunks"]
+        first = index["rows"] - len(self.tail())
+        end = chunks[-1][0] + chunks[-1][1] if chunks else 0
+        if len(pending) >= size:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            mode = "r+b" if os.path.exists(self.path + ".chunks") else "wb"
+            with open(self.path + ".chunks", mode) as file:
+                # Drops what an interrupted sync wrote past the index
+                file.truncate(end)
+                file.seek(end)
+                while len(pending) >= size:
+                    block, pending = pending[:size], pending[size:]
+                    data = self.pack(block)
+                    file.write(data)
+                    chunks.append([end, len(data), first, len(block),
+                                   *self.bounds(block)])
+                    end += len(data)
+                    first += len(block)
+                file.flush()
+                os.fsync(file.fileno())
+        index["tail"] = {
+            "chunk": base64.b64encode(self.pack(pending)).decode("ascii"),
+            "first": first,
+            "rows": len(pending),
+            "dates": self.bounds(pending),
+        } if pending else None
+        index["rows"] = first + len(pending)
+        index["sources"].update(sources or {})
+        index["complete"] = sorted(set(index["complete"]) | set(complete))
+        self.save()
+
+    def save(self):
+        """
+        Replaces the index atomically.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary = self.path + ".index.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path + ".index")
+
+    def sync(self, database, sources, complete=()):
+        """
+        Appends the rows added to the source worksheets since the last
+        sync. Sources in 'complete' are not read again once archived.
+        If a source lost rows, the archive is rebuilt from scratch.
+
+        Args:
+            database (DataBaseActions): The database to read from.
+            sources (list): The worksheets holding the rows, oldest
+                first.
+            complete (iterable): The sources no more rows will be
+                added to.
+
+        Returns:
+            int: The number of rows archived.
+        """
+        known = self.index["sources"]
+        if any(source not in sources for source in known):
+            self.clear()
+            known = self.index["sources"]
+        rows, archived = [], {}
+        for source in sources:
+            if source in self.index["complete"]:
+                continue
+            values = database.get_all_values(source)[1:]
+            if len(values) < known.get(source, 0):
+                self.clear()
+                return self.sync(database, sources, complete)
+            rows.extend(values[known.get(source, 0):])
+            archived[source] = len(values)
+        if rows or set(complete) - set(self.index["complete"]):
+            self.extend(rows, archived, [
+                source for source in complete if source in archived
+                or source in self.index["complete"]
+            ])
+        return len(rows)
+
+
+class CachedWorksheet:
+    """
+    A worksheet held in the DataBaseActions cache.
+
+    For worksheets with asset and action columns, an index of the open
+    rows (asset to row number) is built the first time it is needed and
+    kept up to date by our own writes, so the open row of an asset is
+    found without scanning the worksheet.
+
+    Attributes:
+        name (str): The name of the worksheet.
+        handle: The storage engine handle of the worksheet
+            (a gspread.Worksheet for Google Sheets).
+        values (RowStore): All rows of the worksheet, headers included.
+        positions (dict): Asset to the row number of its open row,
+            None until first built.
+        rows (int): Number of rows read from the storage engine, the
+            watermark from which the next read only fetches new rows.
+        boundary (list): The last row read from the storage engine,
+            as it was read.
+        loaded (float): time.monotonic() of the last full read.
+        revision (str): The engine revision the rows were read at, None
+            if unknown.
+        seen (float): time.monotonic() when the revision was recorded.
+        settled (bool): True once the rows were read again, unchanged,
+            long enough after the revision was recorded for an unchanged
+            revision to be trusted (see DataBaseActions.fetch).
+        events (list): For worksheets with an 'event_key' column, the
+            number of rows indexed and the string table codes of their
+            keys, None until first built.
+    """
+
+    def __init__(self, name, handle, values, boundary=None):
+        self.name = name
+        self.handle = handle
+        if not isinstance(values, RowStore):
+            values = RowStore(name, values)
+        self.values = values
+        self.positions = None
+        self.rows = len(values)
+        if boundary is None and values:
+            boundary = list(values[-1])
+        self.boundary = boundary
+        self.loaded = time.monotonic()
+        self.revision = None
+        self.seen = self.loaded
+        self.settled = False
+        self.events = None
+
+    def size(self):
+        """
+        Returns the number of cells held, used to cap the cache memory.
+        """
+        return len(self.values) * self.values.width or 1
+
+    def open_positions(self):
+        """
+        Returns the asset to row number index of the open rows,
+        building it on first use.
+        """
+        if self.positions is None:
+            columns = WORKSHEET_SCHEMAS[self.name]
+            asset, action = columns.index("asset"), columns.index("action")
+            self.positions = {}
+            for index in self.values.matching(action, "open"):
+                if index:
+                    self.positions.setdefault(
+                        self.values.cell(index, asset), index + 1
+                    )
+        return self.positions
+
+    def open_row(self, asset):
+        """
+        Returns the (row number, row values) of the open row of an asset,
+        or None if the asset has no open row.
+        """
+        number = self.open_positions().get(asset)
+        if number is None:
+            return None
+        return number, pad_row(self.name, self.values[number - 1])
+
+    def index_row(self, number):
+        """
+        Refreshes the open rows index after a row has been written.
+        """
+        if self.positions is None:
+            return
+        columns = WORKSHEET_SCHEMAS[self.name]
+        row = pad_row(self.name, self.values[number - 1])
+        asset = row[columns.index("asset")]
+        if row[columns.index("action")] == "open":
+            self.positions.setdefault(asset, number)
+        elif self.positions.get(asset) == number:
+            del self.positions[asset]
+
+    def append(self, data):
+        """
+        Applies an appended row to the cached values.
+
+        Returns:
+            int: The row number of the appended row.
+        """
+        self.values.append(data)
+        self.index_row(len(self.values))
+        return len(self.values)
+
+    def update(self, row, data):
+        """
+        Applies a row rewrite to the cached values. None values keep
+        the existing cell content.
+        """
+        while len(self.values) < row:
+            self.values.append([])
+        cells = self.values[row - 1]
+        for i, value in enumerate(data[:len(cells)]):
+            if value is not None:
+                cells[i] = value
+        self.values[row - 1] = cells
+        self.index_row(row)
+
+    def has_event(self, key):
+        """
+        Returns True if a row holds the given idempotency key, the keys
+        of the rows appended since the last call being indexed first.
+        """
+        if self.events is None or self.events[0] > len(self.values):
+            self.events = [0, set()]
+        column = WORKSHEET_SCHEMAS[self.name].index("event_key")
+        indexed, codes = self.events
+        codes.update(self.values.columns[column][indexed:])
+        self.events[0] = len(self.values)
+        code = self.values.codes.get(key)
+        return code is not None and code in codes
+
+    def find(self, asset=None, action=None):
+        """
+        Same as filter_rows on the cached values, matching the asset
+        and action through the string table instead of reading every
+        row.
+        """
+        columns = WORKSHEET_SCHEMAS[self.name]
+        indexes = None
+        for column, text in (("asset", asset), ("action", action)):
+            if text is not None:
+                found = self.values.matching(columns.index(column), text)
+                indexes = found if indexes is None else sorted(
+                    set(indexes) & set(found)
+                )
+        if indexes is None:
+            indexes = range(len(self.values))
+        return [
+            (index + 1, self.values[index]) for index in indexes if index
+        ]
+
+
+def merge_row(existing, data):
+    """
+    Overlays data on an existing row write, keeping the existing value
+    wherever data holds None.
+
+    Args:
+        existing (list): The values already waiting to be written.
+        data (list): The newer values.
+
+    Returns:
+        list: The merged values.
+    """
+    merged = list(existing) + [None] * (len(data) - len(existing))
+    for i, value in enumerate(data):
+        if value is not None:
+            merged[i] = value
+    return merged
+
+
+class WriteQueue:
+    """
+    Gathers pending writes so they can be sent to the storage engine
+    as one append_rows call per worksheet and one batch_update call per
+    worksheet for row rewrites.
+
+    A rewrite of a row that is still waiting to be appended is merged
+    into the append, and several rewrites of the same row are merged
+    into one.
+
+    Attributes:
+        flush (callable): Called when the queue asks to be flushed.
+        held (bool): While True, automatic flushes are not triggered.
+        size (int): Number of pending writes triggering a flush.
+        interval (float): Seconds after the first pending write at which
+            a flush is triggered by a timer.
+        appends (dict): Worksheet name to a list of [row number, data]
+            pairs, the row number being None when it is unknown.
+        updates (dict): Worksheet name to a {row number: data} dict.
+    """
+
+    def __init__(self, flush, size=50, interval=5.0):
+        self.flush = flush
+        self.size = size
+        self.interval = interval
+        self.appends = {}
+        self.updates = {}
+        self.held = False
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def __len__(self):
+        with self.lock:
+            return (
+                sum(len(rows) for rows in self.appends.values())
+                + sum(len(rows) for rows in self.updates.values())
+            )
+
+    def pending(self, worksheet=None):
+        """
+        Returns True if writes are waiting for the given worksheet, or
+        for any worksheet when none is given.
+        """
+        with self.lock:
+            if worksheet is None:
+                return len(self) > 0
+            return bool(
+                self.appends.get(worksheet) or self.updates.get(worksheet)
+            )
+
+    def add_append(self, worksheet, data, row=None):
+        """
+        Queues a row to append.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            data (list): The row to append.
+            row (int, optional): The row number the append will land on,
+                when known.
+        """
+        with self.lock:
+            self.appends.setdefault(worksheet, []).append([row, list(data)])
+        self.schedule()
+
+    def add_update(self, worksheet, row, data):
+        """
+        Queues a row rewrite, merging it with any pending write of the
+        same row.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            row (int): The row number to rewrite.
+            data (list): The data to write.
+        """
+        with self.lock:
+            for pending in self.appends.get(worksheet, []):
+                if pending[0] == row:
+                    pending[1] = merge_row(pending[1], data)
+                    return
+            updates = self.updates.setdefault(worksheet, {})
+            updates[row] = merge_row(updates.get(row, []), data)
+        self.schedule()
+
+    def schedule(self):
+        """
+        Flushes the queue once it reaches its size threshold, otherwise
+        makes sure a timer will flush it after the configured interval.
+        """
+        if self.held:
+            return
+        if len(self) >= self.size:
+            self.flush()
+            return
+        with self.lock:
+            if self.timer is None and self.interval:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def drain(self):
+        """
+        Empties the queue.
+
+        Returns:
+            tuple: The pending appends and updates, in the same layout
+                as the appends and updates attributes.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            appends, updates = self.appends, self.updates
+            self.appends, self.updates = {}, {}
+            return appends, updates
+
+    def restore(self, appends, updates):
+        """
+        Puts writes that failed to be flushed back at the front of the
+        queue, ahead of anything queued meanwhile.
+        """
+        with self.lock:
+            for worksheet, rows in appends.items():
+                self.appends[worksheet] = (
+                    rows + self.appends.get(worksheet, [])
+                )
+            for worksheet, rows in updates.items():
+                newer = self.updates.get(worksheet, {})
+                for row, data in newer.items():
+                    rows[row] = merge_row(rows.get(row, []), data)
+                self.updates[worksheet] = rows
+
+
+class WriteJournal:
+    """
+    Local append-only journal of the writes waiting to reach a remote
+    storage engine. Each record is fsync'd to disk before its writes are
+    considered saved, then a background thread applies the records in
+    order and marks each one as acknowledged once the engine accepted
+    it. Records still unacknowledged when the program stops are applied
+    on the next start.
+
+    Every session writes a journal file of its own in the journal
+    folder, kept locked while the session runs, so sessions sharing the
+    state folder never acknowledge or compact each other's records. The
+    files left unlocked by sessions that ended are taken over at
+    startup: their pending records are copied to the new session's file
+    before they are deleted.
+
+    Attributes:
+        folder (str): Folder holding the journal file of each session.
+        path (str): Location of the journal file of this session.
+        apply (callable): Applies one record to its storage engine,
+            raising an error if it could not.
+        records (deque): Unacknowledged records, oldest first.
+        callbacks (dict): Record id to the callable to run once the
+            record is acknowledged, see append.
+        apply_lock (threading.Lock): Held while a record is applied, so
+            readers never see it half-way between pending and done.
+    """
+
+    def __init__(self, folder, apply):
+        """
+        Creates the journal file of the session, takes over the records
+        left by the sessions that ended, and starts the background
+        thread applying them.
+
+        Args:
+            folder (str): Folder holding the journal file of each
+                session.
+            apply (callable): Applies one record to its storage engine.
+        """
+        self.folder = folder
+        self.apply = apply
+        self.records = deque()
+        self.callbacks = {}
+        self.next_id = 1
+        self.condition = threading.Condition()
+        self.apply_lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(
+            folder, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.log"
+        )
+        # Kept open and locked until the program stops, telling the
+        # other sessions this file is still in use
+        self.lock = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.lock, fcntl.LOCK_EX)
+        self.load()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def load(self):
+        """
+        Takes over the unacknowledged records of the journal files of
+        the sessions that ended, oldest file first.
+        """
+        # Left by versions sharing one journal between every session
+        shared = os.path.join(os.path.dirname(self.folder), "journal.log")
+        paths = [shared] if os.path.exists(shared) else []
+        paths += [
+            os.path.join(self.folder, name)
+            for name in os.listdir(self.folder)
+            if name.endswith(".log")
+            and os.path.join(self.folder, name) != self.path
+        ]
+        for path in sorted(paths, key=self.modified):
+            self.take_over(path)
+        if self.records:
+            print(
+                f"Sending {len(self.records)} saved write(s) left "
+                "from the last session..."
+            )
+
+    @staticmethod
+    def modified(path):
+        """
+        Returns the modification time of a file, 0 if it is gone.
+        """
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    def take_over(self, path):
+        """
+        Copies the unacknowledged records of another session's journal
+        file to this session's file, then deletes it. Files still
+        locked by a running session are left alone. Without file locks
+        (outside POSIX) every other file is taken over.
+        """
+        try:
+            file = open(path, encoding="utf-8")
+        except OSError:
+            return
+        with file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+                try:
+                    if os.stat(path).st_ino != os.fstat(file.fileno()).st_ino:
+                        # Taken over by a session starting at the same time
+                        return
+                except FileNotFoundError:
+                    return
+            for record in self.unacknowledged(file):
+                # Rows may have changed remotely since it was written
+                record = dict(record, id=self.next_id, replayed=True)
+                self.write_line(record)
+                self.next_id += 1
+                self.records.append(record)
+            # A crash before this line sends the records twice, which the
+            # idempotency keys of their trade events make harmless
+            os.remove(path)
+
+    @staticmethod
+    def unacknowledged(file):
+        """
+        Returns the records of a journal file that were never
+        acknowledged, oldest first.
+        """
+        records, acknowledged = {}, set()
+        for line in file:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn last line left by a crash in the middle
+                # of a write, that record was never saved
+                continue
+            if "ack" in item:
+                acknowledged.add(item["ack"])
+            else:
+                records[item["id"]] = item
+        return [
+            records[record_id] for record_id in sorted(records)
+            if record_id not in acknowledged
+        ]
+
+    def write_line(self, item):
+        """
+        Appends one line to the journal file and forces it to disk.
+        """
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(item) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def append(self, record, done=None):
+        """
+        Saves a record to the journal and hands it to the background
+        thread.
+
+        Args:
+            record (dict): The writes to apply, JSON serializable.
+            done (callable, optional): Called from the background thread
+                once the record is acknowledged. Not called if the
+                program stops first.
+
+        Returns:
+            int: The id given to the record.
+        """
+        with self.condition:
+            record = dict(record, id=self.next_id)
+            self.write_line(record)
+            self.next_id += 1
+            if done is not None:
+                self.callbacks[record["id"]] = done
+            self.records.append(record)
+            self.condition.notify_all()
+        return record["id"]
+
+    def pending(self, engine=None):
+        """
+        Returns the unacknowledged records, optionally only those
+        addressed to the given engine ('backend' or 'mirror').
+        """
+        with self.condition:
+            return [
+                record for record in self.records
+                if engine is None or record["engine"] == engine
+            ]
+
+    def wait(self, timeout=None):
+        """
+        Waits until every record has been acknowledged.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the journal is fully acknowledged.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.records, timeout
+            )
+
+    def compact(self):
+        """
+        Empties the journal file once every record is acknowledged.
+        """
+        with self.condition:
+            if not self.records:
+                open(self.path, "w").close()
+
+    def run(self):
+        """
+        Background loop applying the records in order. A record that
+        fails is retried, with a growing delay, before moving on, and
+        flagged as retried since the failed attempt may have reached
+        the engine.
+        """
+        delay = 1
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.records)
+                record = self.records[0]
+            with self.apply_lock:
+                try:
+                    self.apply(record)
+                except Exception as e:
+                    error = e
+                    record["retried"] = True
+                else:
+                    error = None
+                    self.write_line({"ack": record["id"]})
+                    with self.condition:
+                        self.records.popleft()
+                        done = self.callbacks.pop(record["id"], None)
+                        self.condition.notify_all()
+                    if done is not None:
+                        done()
+            if error is None:
+                delay = 1
+                self.compact()
+                continue
+            if delay == 1:
+                print(
+                    "Failed to send saved writes, they will be retried "
+                    f"in the background: {error}"
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+class WriteConflict(Exception):
+    """
+    Raised when saved writes no longer fit the remote worksheet, because
+    the rows they were based on changed there in the meantime.
+    """
+
+
+class AssetBusy(Exception):
+    """
+    Raised when the lock of an asset could not be taken in time,
+    because another session keeps saving a trade of that asset.
+    """
+
+
+class AssetLocks:
+    """
+    Per-asset locks, so the trades of one asset are validated and
+    committed one at a time, in the order they were confirmed, while
+    trades of different assets go ahead in parallel.
+
+    Each asset has a reentrant lock shared by the threads of this
+    program, and a lock file in the given folder shared with the other
+    programs using the same state folder. Both are held from the
+    validation of a trade until its writes are committed. The lock
+    file can be kept longer (see keep), until the writes reached the
+    remote engine where the other programs read them, while the
+    threads of this program, which see its own writes, go ahead.
+
+    Attributes:
+        folder (str): Folder holding the lock files.
+        timeout (float): Seconds to wait for a lock before giving up.
+    """
+
+    def __init__(self, folder, timeout=30):
+        """
+        Args:
+            folder (str): Folder holding the lock files.
+            timeout (float, optional): Seconds to wait for a lock.
+        """
+        self.folder = folder
+        self.timeout = timeout
+        self.guard = threading.Lock()
+        # Per asset: [reentrant lock, hold depth, open lock file,
+        # number of keeps]
+        self.locks = {}
+        # The assets held by each thread
+        self.owned = threading.local()
+
+    def state(self, asset):
+        """
+        Returns the lock state of an asset, creating it on first use.
+        """
+        with self.guard:
+            return self.locks.setdefault(
+                asset, [threading.RLock(), 0, None, 0]
+            )
+
+    def held(self):
+        """
+        Returns the assets whose lock the calling thread holds.
+        """
+        return sorted(getattr(self.owned, "assets", ()))
+
+    def path(self, asset):
+        """
+        Returns the lock file of an asset, its name kept to safe
+        characters.
+        """
+        name = re.sub(r"[^a-z0-9_.-]", "_", asset)
+        return os.path.join(self.folder, f"{name}.lock")
+
+    def acquire(self, asset):
+        """
+        Takes the lock of an asset, the lock file included the first
+        time the calling thread takes it, unless this program still
+        keeps it.
+
+        Raises:
+            AssetBusy: If the lock could not be taken in time.
+        """
+        state = self.state(asset)
+        deadline = time.monotonic() + self.timeout
+        if not state[0].acquire(timeout=self.timeout):
+            raise AssetBusy(f"asset '{asset}' is busy, try again")
+        with self.guard:
+            # A lock file kept for writes on their way is still ours
+            reused = state[2] is not None or fcntl is None
+            if reused:
+                state[1] += 1
+        if not reused:
+            try:
+                file = self.lock_file(asset, deadline)
+            except BaseException:
+                state[0].release()
+                raise
+            with self.guard:
+                state[2] = file
+                state[1] += 1
+        if not hasattr(self.owned, "assets"):
+            self.owned.assets = set()
+        self.owned.assets.add(asset)
+
+    def lock_file(self, asset, deadline):
+        """
+        Opens and locks the lock file of an asset, polling until the
+        deadline while another program holds it.
+
+        Returns:
+            file: The open lock file, locked.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        file = open(self.path(asset), "a")
+        while True:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return file
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    file.close()
+                    raise AssetBusy(
+                        f"asset '{asset}' is being saved by another "
+                        "session, try again"
+                    )
+                time.sleep(0.05)
+            except OSError:
+                file.close()
+                raise
+
+    def release(self, asset):
+        """
+        Releases the lock of an asset taken by the calling thread, and
+        its lock file once the outermost hold ends.
+        """
+        state = self.state(asset)
+        with self.guard:
+            state[1] -= 1
+            if state[1] == 0:
+                self.owned.assets.discard(asset)
+                self.unlock_file(state)
+        state[0].release()
+
+    def keep(self, assets):
+        """
+        Keeps the lock files of assets the calling thread holds past
+        their release, until drop is called with the same assets.
+        """
+        with self.guard:
+            for asset in assets:
+                self.locks[asset][3] += 1
+
+    def drop(self, assets):
+        """
+        Ends a keep of the lock files of assets, releasing those no
+        longer held or kept.
+        """
+        with self.guard:
+            for asset in assets:
+                state = self.locks[asset]
+                state[3] -= 1
+                if state[1] == 0:
+                    self.unlock_file(state)
+
+    @staticmethod
+    def unlock_file(state):
+        """
+        Unlocks and closes the lock file of an asset once it is neither
+        held nor kept. Called with the guard held.
+        """
+        if state[1] == 0 and state[3] == 0 and state[2] is not None:
+            fcntl.flock(state[2], fcntl.LOCK_UN)
+            state[2].close()
+            state[2] = None
+
+    @contextlib.contextmanager
+    def hold(self, *assets):
+        """
+        Holds the locks of the given assets, taken in sorted order so
+        two sessions locking the same assets cannot deadlock.
+
+        Raises:
+            AssetBusy: If one of the locks could not be taken in time,
+                none of them is held then.
+        """
+        taken = []
+        try:
+            for asset in sorted({asset.lower() for asset in assets}):
+                self.acquire(asset)
+                taken.append(asset)
+            yield
+        finally:
+            for asset in reversed(taken):
+                self.release(asset)
+
+
+class DataBaseActions:
+    """
+    This class provides methods to read data from and write data to the
+    'entry', 'raw_data' and 'set' worksheets, whatever storage engine
+    is holding them.
+
+    The engine is chosen at startup through the TRADING_BOOK_BACKEND
+    environment variable ('sheets' by default, or 'sqlite'). When the
+    local SQLite engine is used, TRADING_BOOK_MIRROR=sheets keeps the
+    Google Sheets spreadsheet updated as a mirror of every write.
+
+    Worksheets read from a remote engine are kept in a write-through
+    cache: our own writes update the cached values in place, entries
+    expire after TRADING_BOOK_CACHE_TTL seconds and the least recently
+    used worksheets are evicted once TRADING_BOOK_CACHE_SIZE cells
+    are held, a worksheet larger than that not being cached at all.
+    An expired worksheet of APPEND_ONLY_WORKSHEETS is refreshed by
+    fetching only the rows added after the last one read, unless that
+    row changed, the worksheet shrank, or TRADING_BOOK_FULL_SYNC
+    seconds went by since it was last read in full. Nothing is read at
+    all while the spreadsheet revision is unchanged, once a read made
+    TRADING_BOOK_REVISION_GRACE seconds after it was recorded found the
+    same rows (see fetch and probe). The snapshot
+    worksheets are also saved as a BookSnapshot after each sync, and
+    the snapshots are opened on the next start as the starting point
+    of the tail sync.
+
+    Rows appended to a worksheet of PARTITIONED_WORKSHEETS go to the
+    partition of their month, recorded in the 'partitions' catalog, so
+    appends and the reads of a range of dates (see known_event and
+    TradeLog.rebuild) only touch the partitions needed however long
+    the history gets.
+
+    Writes are gathered in a WriteQueue and sent in batches at the end
+    of each command, once TRADING_BOOK_FLUSH_SIZE writes are pending or
+    TRADING_BOOK_FLUSH_INTERVAL seconds after the first pending write,
+    whichever comes first. Flushed writes bound for Google Sheets (or
+    the mirror) are first saved to a local WriteJournal, then sent in
+    the background, so no confirmed trade is lost to a network error.
+
+    A remote engine is backed by a local SQLite replica holding the
+    last content read from it plus our own writes. When the remote
+    engine cannot be reached, at startup or later on, the program goes
+    offline: reads are served by the replica and writes keep going to
+    the journal. Once the remote engine accepts writes again, each
+    offline write is moved onto the rows it was based on, or rejected
+    to 'conflicts.log' if those rows changed remotely in the meantime.
+
+    Attributes:
+        backend (StorageBackend): The storage engine serving reads
+            and writes, the replica while offline.
+        primary (StorageBackend): The remote engine, None until it
+            could be started.
+        replica (StorageBackend): Local copy of the remote engine,
+            None for local engines.
+        offline (bool): True while reads are served by the replica.
+        mirror (StorageBackend): Optional engine receiving a copy of
+            every write, None when no mirror is configured.
+        cache (TTLCache): Cached worksheets, keyed by worksheet name.
+        synced (dict): The last copy read of each remote worksheet,
+            kept after it left the cache for the next tail sync.
+        snapshots (str): Folder of the worksheet snapshots, None for
+            local engines.
+        queue (WriteQueue): Writes waiting to be flushed.
+        journal (WriteJournal): Flushed writes waiting to reach a
+            remote engine, None when no remote engine is used.
+        locks (AssetLocks): Locks serializing the trades of each asset
+            across threads and sessions.
+        archive_interval (float): Seconds between two scheduled runs of
+            archive(), 0 to only archive on demand.
+        archive_batch (int): Closed trades moved per archive() batch.
+        known_partitions (set): Partitions recorded in the catalog, None
+            until it is read.
+        dedup_days (float): Days of trade events searched for an
+            idempotency key already logged, see known_event.
+        book (str): The book held, the name of its spreadsheet.
+        state_dir (str): Folder of the local files of the book.
+    """
+
+    # Prefix of the operations recorded by CommandMetrics
+    name = "db"
+
+    def __init__(self, backend=None, mirror=None, book=DEFAULT_BOOK):
+        """
+        Initializes the DataBaseActions class by starting the selected
+        storage engine and, if configured, its mirror.
+
+        Args:
+            backend (str, optional): Name of the storage engine, defaults
+                to the TRADING_BOOK_BACKEND environment variable.
+            mirror (str, optional): Name of the mirror engine, defaults
+                to the TRADING_BOOK_MIRROR environment variable.
+            book (str, optional): The book to open, see Books.
+        """
+        backend = backend or os.environ.get("TRADING_BOOK_BACKEND", "sheets")
+        mirror = mirror or os.environ.get("TRADING_BOOK_MIRROR")
+        self.book = book
+        self.state_dir = book_state_dir(book)
+        self.backend_name = backend
+        self.backend = None
+        self.primary = None
+        self.replica = None
+        self.offline = False
+        # Set by the journal thread once the cache no longer matches
+        # the remote engine, handled by the next read
+        self.reload = False
+        # Worksheets served from their snapshots during a warm start,
+        # None unless the program is starting that way
+        self.warm = None
+        self.connect_lock = threading.Lock()
+        self.mirror = None
+        self.cache = TTLCache(
+            maxsize=int(os.environ.get("TRADING_BOOK_CACHE_SIZE", 500000)),
+            ttl=float(os.environ.get("TRADING_BOOK_CACHE_TTL", 60)),
+            getsizeof=CachedWorksheet.size,
+        )
+        self.cache_lock = threading.RLock()
+        self.synced = {}
+        self.full_sync = float(os.environ.get("TRADING_BOOK_FULL_SYNC", 600))
+        # Last revision probed, as (engine, time, revision), see probe()
+        self.probed = None
+        self.probe_window = float(
+            os.environ.get("TRADING_BOOK_PROBE_WINDOW", 2)
+        )
+        self.revision_grace = float(
+            os.environ.get("TRADING_BOOK_REVISION_GRACE", 30)
+        )
+        self.snapshots = None
+        self.queue = WriteQueue(
+            self.flush,
+            size=int(os.environ.get("TRADING_BOOK_FLUSH_SIZE", 50)),
+            interval=float(os.environ.get("TRADING_BOOK_FLUSH_INTERVAL", 5)),
+        )
+        self.flush_lock = threading.RLock()
+        self.journal = None
+        self.locks = AssetLocks(
+            os.path.join(self.state_dir, "locks"),
+            timeout=float(os.environ.get("TRADING_BOOK_LOCK_WAIT", 30)),
+        )
+        self.archive_interval = float(
+            os.environ.get("TRADING_BOOK_ARCHIVE_INTERVAL", 86400)
+        )
+        self.archive_batch = int(
+            os.environ.get("TRADING_BOOK_ARCHIVE_BATCH", 500)
+        )
+        # Partitions recorded in the catalog, read on the first write
+        self.known_partitions = None
+        self.dedup_days = float(
+            os.environ.get("TRADING_BOOK_DEDUP_DAYS", 7)
+        )
+        # Idempotency keys read by the journal thread, see logged_keys()
+        self.logged = {}
+
+        # Worksheets read by the running command, see begin_work()
+        self.work = None
+
+        # Transaction state, see begin()
+        self.depth = 0
+        self.pinned = None
+        self.originals = {}
+        self.rollback_only = False
+
+        remote = getattr(STORAGE_BACKENDS.get(backend), "remote", False)
+        if remote:
+            self.replica = self.start_replica()
+            self.open_snapshots()
+        if remote and self.replica is not None and all(
+            self.intact(worksheet) for worksheet in STARTUP_WORKSHEETS
+        ):
+            # Served from the snapshots until the remote engine is
+            # reached in the background, see warm_start()
+            self.backend = self.replica
+            self.offline = True
+            self.warm = {}
+        else:
+            self.backend = self.start_backend(backend)
+        if remote and self.warm is None:
+            self.primary = self.backend
+            if self.backend is None and self.replica is not None:
+                self.backend = self.replica
+                self.offline = True
+                print(red(
+                    "Working offline from the local copy, saved trades "
+                    "will be sent once the spreadsheet can be reached."
+                ))
+        if mirror and mirror != backend:
+            self.mirror = self.start_backend(mirror)
+
+        # A brand new local database starts from the mirror content
+        if (
+            isinstance(self.backend, SQLiteBackend)
+            and self.mirror is not None
+            and self.backend.is_empty()
+        ):
+            try:
+                self.backend.seed_from(self.mirror)
+            except Exception as e:
+                print(f"Failed to copy the mirror into the database: {e}")
+
+        if self.mirror is not None or remote:
+            try:
+                os.makedirs(self.state_dir, exist_ok=True)
+                self.journal = WriteJournal(
+                    os.path.join(self.state_dir, "journals"),
+                    self.apply_record,
+                )
+            except OSError as e:
+                print(f"Failed to open the local journal: {e}")
+        if self.warm is not None:
+            self.warm_start()
+        atexit.register(self.close)
+
+    def start_backend(self, name):
+        """
+        Starts a storage engine by name.
+
+        Args:
+            name (str): The engine name, a key of STORAGE_BACKENDS.
+
+        Returns:
+            StorageBackend: The started engine, or None if an error occurs.
+        """
+        try:
+            return STORAGE_BACKENDS[name].open_book(self.book, self.state_dir)
+        except KeyError:
+            print(
+                f"Unknown storage backend '{name}', valid options are: "
+                f"{', '.join(STORAGE_BACKENDS)}"
+            )
+        except DefaultCredentialsError as e:
+            print(f"Failed to load credentials from service account file: {e}")
+        except GoogleAuthError as e:
+            print(f"Failed to authenticate with Google API: {e}")
+        except APIError as e:
+            print(f"Failed to authorize gspread client: {e}")
+        except sqlite3.Error as e:
+            print(f"Failed to open the local database: {e}")
+        except Exception as e:
+            print(f"An unexpected error occurred during initialization: {e}")
+        return None
+
+    def start_replica(self):
+        """
+        Opens the local replica of the remote engine.
+
+        Returns:
+            SQLiteBackend: The replica, or None if an error occurs.
+        """
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            return SQLiteBackend(
+                os.path.join(self.state_dir, "replica.sqlite3")
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Failed to open the local copy: {e}")
+            return None
+
+    def open_snapshots(self):
+        """
+        Opens the snapshots saved by the last session as the last known
+        copy of the snapshot worksheets, so the first read only fetches
+        the rows added since.
+        """
+        self.snapshots = os.path.join(self.state_dir, "snapshots")
+        try:
+            names = sorted(os.listdir(self.snapshots))
+        except OSError:
+            names = []
+        for name in names:
+            worksheet = name[:-len(".snapshot")]
+            if not name.endswith(".snapshot") or not self.snapshotted(
+                worksheet
+            ):
+                continue
+            path = os.path.join(self.snapshots, name)
+            try:
+                store, boundary, loaded, revision = BookSnapshot.read(
+                    path, worksheet
+                )
+            except SnapshotError as e:
+                print(f"Ignoring the local snapshot: {e}")
+                continue
+            # The boundary is known, the rows are left unread for now
+            entry = CachedWorksheet(worksheet, None, store, boundary)
+            entry.loaded = time.monotonic() - max(0, time.time() - loaded)
+            entry.revision = revision
+            self.synced[worksheet] = entry
+
+    def intact(self, worksheet):
+        """
+        Returns True if a worksheet was opened from its snapshot and
+        the snapshot is undamaged, checking it in full since it is
+        about to be served as it is (see warm_start). A damaged
+        snapshot is set aside.
+        """
+        entry = self.synced.get(worksheet)
+        if entry is None:
+            return False
+        store = entry.values
+        try:
+            for column in range(store.width):
+                store.columns.check(column)
+            store.strings.check()
+        except SnapshotError as e:
+            print(f"Ignoring the local snapshot: {e}")
+            del self.synced[worksheet]
+            return False
+        return True
+
+    def warm_start(self):
+        """
+        Serves the STARTUP_WORKSHEETS from their snapshots, so the
+        program can show them right away, and starts the background
+        thread reaching the remote engine (see refresh_startup).
+        """
+        lock = self.journal.apply_lock if self.journal else (
+            contextlib.nullcontext()
+        )
+        with lock:
+            for worksheet in STARTUP_WORKSHEETS:
+                self.warm[worksheet] = self.synced[worksheet]
+                if self.journal is not None:
+                    # Writes of the last session not sent yet
+                    self.apply_pending(self.warm[worksheet])
+        with self.cache_lock:
+            for worksheet, entry in self.warm.items():
+                self.cache_entry(worksheet, entry)
+        threading.Thread(target=self.refresh_startup, daemon=True).start()
+
+    def refresh_startup(self):
+        """
+        Reaches the remote engine after a warm start, then swaps the
+        worksheets served from their snapshots for fresh copies, only
+        fetching the rows added since they were saved. Called from a
+        background thread.
+        """
+        fresh = {}
+        try:
+            engine = self.connect()
+            revision = engine.revision()
+            lock = self.journal.apply_lock if self.journal else (
+                contextlib.nullcontext()
+            )
+            with lock:
+                for worksheet, entry in self.warm.items():
+                    entry = self.fetch(worksheet, engine, revision)
+                    self.apply_pending(entry)
+                    fresh[worksheet] = entry
+        except Exception as e:
+            print(red(
+                f"Failed to reach the spreadsheet ({e}), working offline "
+                "from the local copy."
+            ))
+            self.warm = None
+            return
+        with self.cache_lock:
+            for worksheet in list(self.cache):
+                # Read from the local copy while starting
+                if worksheet not in fresh:
+                    self.cache.pop(worksheet, None)
+            for worksheet, entry in fresh.items():
+                self.synced[worksheet] = entry
+                # Kept if our own writes are not in the fresh copy yet
+                if (
+                    self.cache.get(worksheet) is self.warm[worksheet]
+                    and not self.queue.pending(worksheet)
+                    and not (self.pinned and worksheet in self.pinned)
+                ):
+                    self.cache_entry(worksheet, entry)
+            self.backend = engine
+            self.offline = False
+            self.warm = None
+        for worksheet, entry in fresh.items():
+            try:
+                self.replica.replace(worksheet, entry.values)
+            except sqlite3.Error as e:
+                print(f"Failed to update the local copy: {e}")
+
+    def save_snapshot(self, entry):
+        """
+        Saves the rows of a worksheet read from the remote engine to
+        its snapshot file.
+
+        Args:
+            entry (CachedWorksheet): The worksheet, as just fetched.
+        """
+        if self.snapshots is None or not self.snapshotted(entry.name):
+            return
+        try:
+            os.makedirs(self.snapshots, exist_ok=True)
+            BookSnapshot.write(
+                os.path.join(self.snapshots, f"{entry.name}.snapshot"),
+                entry.values.head(entry.rows),
+                entry.boundary,
+                time.time() - (time.monotonic() - entry.loaded),
+                entry.revision,
+            )
+        except OSError as e:
+            print(f"Failed to save the local snapshot: {e}")
+
+    def snapshotted(self, worksheet):
+        """
+        Returns True if a worksheet is saved to a snapshot, the
+        partitions of a snapshot worksheet included.
+        """
+        base = partitioned_worksheet(worksheet) or worksheet
+        return base in SNAPSHOT_WORKSHEETS
+
+    def go_offline(self, error):
+        """
+        Switches reads to the replica after the remote engine failed.
+
+        Args:
+            error (Exception): The error raised by the remote engine.
+        """
+        with self.cache_lock:
+            self.backend = self.replica
+            self.offline = True
+            self.invalidate()
+        print(red(
+            f"Failed to reach the spreadsheet ({error}), working offline "
+            "from the local copy."
+        ))
+
+    def go_online(self):
+        """
+        Drops the cached worksheets once the journal thread reported
+        they no longer match the remote engine, switching reads back
+        to it if the program was offline.
+        """
+        with self.cache_lock:
+            if not self.reload:
+                return
+            self.reload = False
+            if self.offline and self.primary is not None:
+                self.backend = self.primary
+                self.offline = False
+                if self.warm is None:
+                    print(green("Connection to the spreadsheet restored."))
+            self.invalidate()
+
+    def lookup(self, worksheet):
+        """
+        Returns the cached worksheet without loading it, None if it is
+        not cached. Worksheets pinned by an open transaction are served
+        first, then the ones the running command already read, since
+        they cannot expire.
+        """
+        with self.cache_lock:
+            if self.pinned is not None and worksheet in self.pinned:
+                return self.pinned[worksheet]
+            if self.work is not None and worksheet in self.work:
+                return self.work[worksheet]
+            return self.cache.get(worksheet)
+
+    def cached(self, worksheet):
+        """
+        Returns the cached copy of a worksheet, loading it from the
+        storage engine on a cache miss.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+
+        Returns:
+            CachedWorksheet: The cached worksheet.
+        """
+        with self.cache_lock:
+            self.go_online()
+            entry = self.lookup(worksheet)
+            if entry is None:
+                # Pending writes must land before the worksheet is fetched
+                if self.queue.pending(worksheet) and self.pinned is None:
+                    self.flush()
+                entry = self.load(worksheet)
+                self.cache_entry(worksheet, entry)
+            if self.pinned is not None:
+                self.pinned[worksheet] = entry
+            if self.work is not None:
+                self.work[worksheet] = entry
+            return entry
+
+    def cache_entry(self, worksheet, entry):
+        """
+        Stores a worksheet in the cache. A worksheet holding more cells
+        than the whole cache, which the cache would refuse, is left out
+        of it instead: it is read again each time it is needed, once per
+        command at most (see begin_work).
+        """
+        if entry.size() > self.cache.maxsize:
+            self.cache.pop(worksheet, None)
+            return
+        self.cache[worksheet] = entry
+
+    def load(self, worksheet):
+        """
+        Fetches a worksheet from the storage engine, with the journaled
+        writes that have not reached the engine yet applied on top.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+
+        Returns:
+            CachedWorksheet: The loaded worksheet.
+        """
+        if self.journal is None or not self.backend.remote:
+            return CachedWorksheet(
+                worksheet,
+                self.backend.worksheet(worksheet),
+                self.backend.get_all_values(worksheet),
+            )
+        with self.journal.apply_lock:
+            try:
+                entry = self.fetch(worksheet)
+            except Exception as e:
+                if self.replica is None:
+                    raise
+                self.go_offline(e)
+                return CachedWorksheet(
+                    worksheet, worksheet,
+                    self.replica.get_all_values(worksheet),
+                )
+            self.apply_pending(entry)
+        if self.replica is not None:
+            try:
+                self.replica.replace(worksheet, entry.values)
+            except sqlite3.Error as e:
+                print(f"Failed to update the local copy: {e}")
+        self.synced[worksheet] = entry
+        return entry
+
+    def apply_pending(self, entry):
+        """
+        Applies the journaled writes that have not reached the remote
+        engine yet to a worksheet just fetched from it. Called with the
+        journal's apply_lock held.
+
+        Args:
+            entry (CachedWorksheet): The worksheet.
+        """
+        for record in self.journal.pending("backend"):
+            for data in record["appends"].get(entry.name, []):
+                entry.append(data)
+            for row, data in record["updates"].get(entry.name, []):
+                entry.update(row, data)
+
+    def fetch(self, worksheet, engine=None, revision=None):
+        """
+        Reads a worksheet from the remote engine. When an append-only
+        worksheet was read before, only the rows from the last one read
+        onwards are fetched, and the last row read is checked to be
+        unchanged.
+        Nothing is read when the engine revision is still the one the
+        worksheet was last read at, and that revision is settled.
+
+        Google Drive updates the revision lazily, to the second, so a
+        write made around a read may leave it unchanged. A revision is
+        only settled once the rows were read again, unchanged, at least
+        revision_grace seconds after it was recorded.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            engine (StorageBackend, optional): The engine to read from,
+                the current one by default.
+            revision (str, optional): The engine revision, probed first
+                when not given (see probe).
+
+        Returns:
+            CachedWorksheet: The worksheet as the engine holds it.
+        """
+        engine = engine or self.backend
+        if revision is None:
+            revision = self.probe(engine)
+        entry, changed = self.read_worksheet(worksheet, engine, revision)
+        now = time.monotonic()
+        if changed or entry.revision != revision:
+            entry.revision = revision
+            entry.seen = now
+            entry.settled = False
+            self.save_snapshot(entry)
+        elif now - entry.seen >= self.revision_grace:
+            entry.settled = True
+        return entry
+
+    def probe(self, engine):
+        """
+        Returns the revision of an engine (see StorageBackend.revision),
+        one probe being shared by the worksheets read within
+        TRADING_BOOK_PROBE_WINDOW seconds of each other, such as the
+        ones a command reads one after the other.
+        """
+        now = time.monotonic()
+        probed = self.probed
+        if (
+            probed is not None
+            and probed[0] is engine
+            and now - probed[1] < self.probe_window
+        ):
+            return probed[2]
+        revision = engine.revision()
+        self.probed = (engine, now, revision)
+        return revision
+
+    def read_worksheet(self, worksheet, engine, revision=None):
+        """
+        Reads the rows of a worksheet for fetch().
+
+        Returns:
+            tuple: The CachedWorksheet as the engine holds it, and True
+                if rows were read, False if the known ones were kept.
+        """
+        handle = engine.worksheet(worksheet)
+        try:
+            known = self.read_known(worksheet, engine, handle, revision)
+        except SnapshotError as e:
+            # First use of a damaged snapshot, read in full instead
+            print(f"Ignoring the local snapshot: {e}")
+            self.synced.pop(worksheet, None)
+            known = None
+        if known is not None:
+            return known
+        entry = CachedWorksheet(
+            worksheet, handle, engine.get_all_values(worksheet)
+        )
+        previous = self.synced.get(worksheet)
+        if previous is not None and list(previous.values) == list(
+            entry.values
+        ):
+            # Read in full but unchanged, the revision can still settle
+            entry.revision = previous.revision
+            entry.seen = previous.seen
+            entry.settled = previous.settled
+            return entry, False
+        return entry, True
+
+    def read_known(self, worksheet, engine, handle, revision):
+        """
+        Reads a worksheet for read_worksheet from the copy last read,
+        when it can be trusted, or fetching only the rows added since.
+
+        Returns:
+            tuple: Same as read_worksheet, None if it must be read in
+                full.
+
+        Raises:
+            SnapshotError: If the copy last read comes from a damaged
+                snapshot.
+        """
+        previous = self.synced.get(worksheet)
+        if (
+            previous is not None
+            and revision is not None
+            and previous.revision == revision
+            and previous.settled
+        ):
+            # Nothing was written anywhere in the spreadsheet since
+            return self.kept(previous, handle), False
+        if (
+            previous is not None
+            and previous.rows
+            and (partitioned_worksheet(worksheet) or worksheet)
+            in APPEND_ONLY_WORKSHEETS
+            and time.monotonic() - previous.loaded < self.full_sync
+        ):
+            tail = engine.get_rows(worksheet, previous.rows)
+            first = pad_row(worksheet, tail[0]) if tail else None
+            if first and any(
+                rows_match(first, pad_row(worksheet, row)) for row in (
+                    previous.boundary, previous.values[previous.rows - 1]
+                )
+            ):
+                if len(tail) == 1 and rows_match(first, pad_row(
+                    worksheet, previous.values[previous.rows - 1]
+                )):
+                    # Nothing new, the known rows are kept as they are
+                    entry = self.kept(previous, handle)
+                    entry.boundary = first
+                    return entry, False
+                values = previous.values.head(previous.rows - 1)
+                values.extend(tail)
+                entry = CachedWorksheet(worksheet, handle, values)
+                entry.loaded = previous.loaded
+                return entry, True
+        return None
+
+    @staticmethod
+    def kept(previous, handle):
+        """
+        Returns a copy of the rows last read from a worksheet, when the
+        engine still holds them.
+        """
+        entry = CachedWorksheet(
+            previous.name, handle, previous.values.head(previous.rows)
+        )
+        entry.boundary = previous.boundary
+        entry.loaded = previous.loaded
+        entry.revision = previous.revision
+        entry.seen = previous.seen
+        entry.settled = previous.settled
+        return entry
+
+    def use_cache(self):
+        """
+        Returns True if reads should be served from the cache: always
+        for remote engines, and during a transaction or a unit of work
+        so their own pending writes are visible.
+        """
+        return (
+            self.backend.remote
+            or self.pinned is not None
+            or self.work is not None
+        )
+
+    def invalidate(self, worksheet=None):
+        """
+        Drops a worksheet from the cache so the next read fetches it
+        again, or the whole cache when no worksheet is given.
+
+        Args:
+            worksheet (str, optional): The name of the worksheet.
+        """
+        with self.cache_lock:
+            if worksheet is None:
+                self.cache.clear()
+                self.synced.clear()
+                if self.work is not None:
+                    self.work.clear()
+            else:
+                self.cache.pop(worksheet, None)
+                self.synced.pop(worksheet, None)
+                if self.work is not None:
+                    self.work.pop(worksheet, None)
+
+    def refresh(self, worksheet):
+        """
+        Expires the cached copy of a worksheet, so the next read picks
+        up what other sessions wrote since it was read. The next read
+        is a full one, the revision and the last row read being left
+        aside, as the revision can lag behind the last writes and rows
+        may have been rewritten anywhere.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+        """
+        with self.cache_lock:
+            if self.pinned is None or worksheet not in self.pinned:
+                self.cache.pop(worksheet, None)
+                if self.work is not None:
+                    self.work.pop(worksheet, None)
+                self.synced.pop(worksheet, None)
+
+    def settle(self):
+        """
+        Waits until the journaled writes reached the remote engine, so
+        other sessions can read them, unless the program is offline.
+        Gives up after the lock wait (see AssetLocks).
+
+        Returns:
+            bool: True if no journaled write is left.
+        """
+        if self.journal is None or self.offline:
+            return self.journal is None
+        return self.journal.wait(self.locks.timeout)
+
+    def update_cache(self, worksheet, method, *args):
+        """
+        Applies one of our own writes to the cached worksheet, if it
+        is currently cached.
+
+        Args:
+            worksheet (str): The name of the worksheet written to.
+            method (str): The CachedWorksheet method to apply.
+            *args: The arguments of the write.
+
+        Returns:
+            The result of the CachedWorksheet method, None if the
+            worksheet is not cached.
+        """
+        with self.cache_lock:
+            entry = self.lookup(worksheet)
+            if entry is not None:
+                return getattr(entry, method)(*args)
+
+    @METRICS.measured
+    def get_all_values(self, worksheet):
+        """
+        Reads every row of the specified worksheet.
+
+        Args:
+            worksheet (str): The name of the worksheet to read from.
+
+        Returns:
+            list: All rows of the worksheet, headers included, or
+                an empty list if an error occurs.
+        """
+        try:
+            self.go_online()
+            if not self.use_cache():
+                if self.queue.pending(worksheet):
+                    self.flush()
+                return self.backend.get_all_values(worksheet)
+            return list(self.cached(worksheet).values)
+        except APIError as e:
+            print(f"Failed to read from worksheet {worksheet}: {e}")
+        except Exception as e:
+            print(
+                f"An unexpected error occurred while reading the"
+                f" worksheet {worksheet}: {e}"
+            )
+        return []
+
+    @METRICS.measured
+    def find_rows(self, worksheet, asset=None, action=None):
+        """
+        Finds the rows of a worksheet matching an asset and/or action.
+
+        Args:
+            worksheet (str): The name of the worksheet to search.
+            asset (str, optional): The asset to match.
+            action (str, optional): The action to match.
+
+        Returns:
+            list: (row number, row values) tuples, or an empty list
+                if an error occurs.
+        """
+        try:
+            self.go_online()
+            if not self.use_cache():
+                if self.queue.pending(worksheet):
+                    self.flush()
+                return self.backend.find_rows(worksheet, asset, action)
+            entry = self.cached(worksheet)
+            if action == "open":
+                # Served from the open rows index instead of a scan
+                if asset is not None:
+                    return [row for row in [entry.open_row(asset)] if row]
+                return [
+                    entry.open_row(open_asset) for open_asset, _ in sorted(
+                        entry.open_positions().items(),
+                        key=lambda position: position[1],
+                    )
+                ]
+            return entry.find(asset, action)
+        except Exception as e:
+            print(f"Failed to search worksheet {worksheet}: {e}")
+            return []
+
+    def open_position(self, worksheet, asset):
+        """
+        Finds the open row of an asset.
+
+        Args:
+            worksheet (str): The name of the worksheet to search.
+            asset (str): The asset to look for.
+
+        Returns:
+            tuple: The (row number, row values) of the open row, or
+                None if the asset has no open row.
+        """
+        rows = self.find_rows(worksheet, asset=asset, action="open")
+        return rows[0] if rows else None
+
+    def read(self, worksheet):
+        """
+        Reads the last row of data from the specified worksheet.
+
+        Args:
+            worksheet (str): The name of the worksheet to read from.
+
+        Returns:
+            list: The last row of data from the worksheet, or
+                None if an error occurs.
+        """
+        data = self.get_all_values(worksheet)
+        return data[-1] if data else None
+
+    @METRICS.measured
+    def append(self, worksheet, data):
+        """
+        Queues a new row of data to be appended to the specified
+        worksheet.
+
+        Args:
+            worksheet (str): The name of the worksheet to write to.
+            data (list): The data to append as a new row in the worksheet.
+        """
+        if worksheet in PARTITIONED_WORKSHEETS:
+            worksheet = self.partition(worksheet, data[0])
+        if self.pinned is not None or self.work is not None:
+            self.cached(worksheet)
+        row = self.update_cache(worksheet, "append", data)
+        self.queue.add_append(worksheet, data, row)
+
+    def partition(self, worksheet, timestamp):
+        """
+        Returns the partition of a partitioned worksheet a row logged at
+        the given timestamp goes to, recording it in the 'partitions'
+        catalog the first time it is written to.
+
+        Args:
+            worksheet (str): The partitioned worksheet.
+            timestamp (str): The 'YYYY-MM-DD' timestamp of the row.
+
+        Returns:
+            str: The name of the partition.
+        """
+        name = partition_name(worksheet, timestamp)
+        if self.known_partitions is None:
+            catalog = self.get_all_values("partitions")
+            if not catalog:
+                # Not read, the partition may be recorded twice
+                return self.record_partition(worksheet, name)
+            self.known_partitions = set(catalog_partitions(catalog))
+        if name not in self.known_partitions:
+            self.record_partition(worksheet, name)
+            self.known_partitions.add(name)
+        return name
+
+    def record_partition(self, worksheet, name):
+        """
+        Queues the catalog row of a new partition, see partition().
+        """
+        self.append("partitions", [name, worksheet, *partition_bounds(name)])
+        return name
+
+    @METRICS.measured
+    def known_event(self, key):
+        """
+        Returns True if a trade event carrying the given idempotency key
+        was logged in the last dedup_days days, so an entry submitted
+        again, such as a bulk import run twice, is not logged twice.
+
+        The keys of each recent 'raw_data' partition are indexed once
+        it is read (see CachedWorksheet.has_event), then only the rows
+        appended to it since.
+
+        Args:
+            key (str): The idempotency key of the event.
+
+        Returns:
+            bool: True if the event is already logged.
+        """
+        start = (
+            datetime.date.today() - datetime.timedelta(days=self.dedup_days)
+        ).isoformat()
+        try:
+            partitions = catalog_partitions(
+                self.get_all_values("partitions"), "raw_data", start
+            )
+            return any(
+                self.cached(partition).has_event(key)
+                for partition in partitions
+            )
+        except Exception as e:
+            print(f"Failed to search the logged trade events: {e}")
+            return False
+
+    @METRICS.measured
+    def rewrite_target_row(self, worksheet_name, data, row, expected=None):
+        """
+        Close/update database write, queued until the next flush.
+
+        The write is conditional: when it is sent, the row must still
+        hold what it held when it was read, or the write is rebased on
+        the fresh row (see reconcile).
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            data (list): The data to write.
+            row (int): The row to update.
+            expected (list, optional): The row values the write is based
+                on, taken from the cache when not given.
+        """
+        if self.pinned is not None or self.work is not None:
+            entry = self.cached(worksheet_name)
+        else:
+            entry = self.lookup(worksheet_name)
+        originals = self.originals.setdefault(worksheet_name, {})
+        if row not in originals:
+            # Keep the row as it was before the write, to undo it and to
+            # check nobody else changed it in the meantime
+            if entry is not None and row <= len(entry.values):
+                originals[row] = list(entry.values[row - 1])
+            elif expected is not None:
+                originals[row] = list(expected)
+        self.update_cache(worksheet_name, "update", row, data)
+        self.queue.add_update(worksheet_name, row, data)
+
+    @METRICS.measured
+    def flush(self, atomic=False):
+        """
+        Sends every pending write to the storage engine, using one
+        append_rows call per worksheet for new rows and one batch_update
+        call per worksheet for row rewrites.
+
+        Writes to a remote engine are saved to the local journal, which
+        sends them in the background, so a flush returns as soon as the
+        writes are safe on disk. Writes to a local engine that fail are
+        put back in the queue to be retried on the next flush. Nothing
+        is sent while a transaction is open, unless the transaction
+        itself is committing.
+
+        Args:
+            atomic (bool): If True, the writes are committed all together
+                or not at all, and are dropped if the commit fails.
+
+        Returns:
+            bool: True if every pending write was saved.
+        """
+        with self.flush_lock:
+            if self.pinned is not None and not atomic:
+                return False
+            appends, updates = self.queue.drain()
+            originals, self.originals = self.originals, {}
+            appends = {
+                worksheet: [data for _, data in rows]
+                for worksheet, rows in appends.items()
+            }
+            updates = {
+                worksheet: sorted(rows.items())
+                for worksheet, rows in updates.items()
+            }
+            if not appends and not updates:
+                return True
+            if self.backend.remote or self.offline:
+                saved = self.journal_writes(
+                    "backend", appends, updates, originals
+                )
+                if saved:
+                    self.replicate(appends, updates)
+                return saved
+            if atomic:
+                return self.commit_writes(appends, updates, originals)
+            saved_appends, saved_updates = {}, {}
+            failed_appends, failed_updates = {}, {}
+            conflicts = False
+
+            for worksheet, data in appends.items():
+                try:
+                    self.backend.append_rows(worksheet, data)
+                except Exception as e:
+                    print(
+                        "An unexpected error occurred while writing to "
+                        f"the worksheet {worksheet}: {e}"
+                    )
+                    failed_appends[worksheet] = [[None, row] for row in data]
+                    continue
+                saved_appends[worksheet] = data
+
+            for worksheet, data in updates.items():
+                try:
+                    with self.backend.exclusive():
+                        checked, _ = self.reconcile(
+                            self.backend, {worksheet: data}, originals
+                        )
+                        data = checked.get(worksheet, [])
+                        self.backend.batch_update(worksheet, data)
+                except WriteConflict as e:
+                    print(ERROR(f"\nRows not saved, {e}"))
+                    self.reload = True
+                    conflicts = True
+                    continue
+                except Exception as e:
+                    print(f"Failed to update rows {[r for r, _ in data]} in "
+                          f"worksheet '{worksheet}': {e}"
+                          )
+                    failed_updates[worksheet] = dict(data)
+                    continue
+                saved_updates[worksheet] = data
+
+            self.mirror_writes(saved_appends, saved_updates, originals)
+            if failed_appends or failed_updates:
+                self.queue.restore(failed_appends, failed_updates)
+                return False
+            return not conflicts
+
+    def commit_writes(self, appends, updates, originals):
+        """
+        Commits drained writes all together through the local storage
+        engine.
+
+        Args:
+            appends (dict): Worksheet name to the list of rows to append.
+            updates (dict): Worksheet name to the list of
+                (row number, data) tuples to rewrite.
+            originals (dict): Worksheet name to the rows rewritten, as
+                they were before.
+
+        Returns:
+            bool: True if the writes were committed, False if none of
+                them were.
+        """
+        try:
+            with self.backend.exclusive():
+                updates, originals = self.reconcile(
+                    self.backend, updates, originals
+                )
+                self.backend.commit(appends, updates, originals)
+        except Exception as e:
+            print(ERROR(f"\nFailed to commit, nothing was saved: {e}"))
+            for worksheet in set(appends) | set(updates):
+                self.invalidate(worksheet)
+            return False
+        self.mirror_writes(appends, updates, originals)
+        return True
+
+    def journal_writes(self, engine, appends, updates, originals):
+        """
+        Saves writes to the local journal, to be applied in the
+        background on the remote engine as one atomic commit. The lock
+        files of the assets held while they are saved are kept until
+        they reach the backend engine, so other sessions validate their
+        trades against them (see AssetLocks.keep).
+
+        Args:
+            engine (str): 'backend' or 'mirror', the engine to write to.
+            appends (dict): Worksheet name to the list of rows to append.
+            updates (dict): Worksheet name to the list of
+                (row number, data) tuples to rewrite.
+            originals (dict): Worksheet name to the rows rewritten, as
+                they were before.
+
+        Returns:
+            bool: True if the writes are safe in the journal.
+        """
+        originals = {
+            worksheet: sorted(rows.items())
+            for worksheet, rows in originals.items()
+        }
+        assets = self.locks.held() if engine == "backend" else []
+        self.locks.keep(assets)
+        try:
+            self.journal.append({
+                "engine": engine,
+                "appends": appends,
+                "updates": updates,
+                "originals": originals,
+                "offline": engine == "backend" and self.offline,
+            }, done=lambda: self.locks.drop(assets))
+        except (OSError, TypeError, ValueError) as e:
+            self.locks.drop(assets)
+            print(ERROR(f"\nFailed to save to the journal, nothing was "
+                        f"saved: {e}"))
+            if engine == "backend":
+                for worksheet in set(appends) | set(updates):
+                    self.invalidate(worksheet)
+            return False
+        return True
+
+    def mirror_writes(self, appends, updates, originals):
+        """
+        Journals writes already saved by the local engine so they are
+        repeated on the mirror engine, if one is configured.
+        """
+        if self.mirror is not None and (appends or updates):
+            self.journal_writes("mirror", appends, updates, originals)
+
+    def mirror_moves(self, source, target, rows):
+        """
+        Journals rows moved by the local engine so they are moved on
+        the mirror engine too, if one is configured.
+
+        Args:
+            source (str): The worksheet the rows were taken from.
+            target (str): The worksheet the rows were appended to.
+            rows (list): (row number in source, data appended) tuples.
+        """
+        if self.mirror is None or self.journal is None:
+            return
+        try:
+            self.journal.append({
+                "engine": "mirror",
+                "appends": {},
+                "updates": {},
+                "originals": {},
+                "moves": [[source, target, rows]],
+            })
+        except (OSError, TypeError, ValueError) as e:
+            print(ERROR(f"\nFailed to save to the journal, the mirror "
+                        f"will keep the moved rows: {e}"))
+
+    def replicate(self, appends, updates):
+        """
+        Repeats journaled writes on the replica, so it can serve them
+        if the program goes offline.
+        """
+        if self.replica is None:
+            return
+        try:
+            self.replica.commit(appends, updates, {})
+        except sqlite3.Error as e:
+            print(f"Failed to update the local copy: {e}")
+
+    def apply_record(self, record):
+        """
+        Applies one journal record to its storage engine, all its
+        writes together. Called from the journal's background thread.
+
+        Row rewrites are checked against the rows they were based on
+        first (see reconcile). Records opening a position, written
+        offline or left from an earlier session are also checked for
+        positions opened twice, as the asset locks kept for a record
+        end with the program that wrote it, and trades written offline
+        were only checked against the local copy.
+        Records that conflict are set aside in 'conflicts.log' instead
+        of retried. Records an earlier attempt may have applied are
+        skipped if their trade events are logged already (see applied).
+
+        Args:
+            record (dict): The record, as saved by journal_writes.
+        """
+        if record["engine"] == "mirror":
+            engine = self.mirror
+        else:
+            engine = self.connect()
+        if engine is None:
+            return
+        appends = record["appends"]
+        if (
+            record.get("replayed") or record.get("retried")
+        ) and self.applied(engine, appends):
+            return
+        updates = record["updates"]
+        originals = {
+            worksheet: {row: values for row, values in rows}
+            for worksheet, rows in record["originals"].items()
+        }
+        if record["engine"] == "backend":
+            action = WORKSHEET_SCHEMAS["entry"].index("action")
+            checked = (
+                record.get("offline") or record.get("replayed") or any(
+                    format_cell(data[action]) == "open"
+                    for data in appends.get("entry", [])
+                )
+            )
+            try:
+                updates, originals = self.reconcile(
+                    engine, updates, originals,
+                    appends if checked else None,
+                )
+            except WriteConflict as e:
+                self.reject(record, e)
+                self.reload = True
+                return
+        engine.commit(appends, updates, originals)
+        for source, target, rows in record.get("moves", []):
+            # Rows already moved by an earlier attempt are not moved twice
+            if self.unchanged(engine, source, rows):
+                engine.move_rows(source, target, [tuple(r) for r in rows])
+        if self.offline:
+            self.reload = True
+
+    def applied(self, engine, appends):
+        """
+        Returns True if a journal record was applied by an earlier
+        attempt whose answer was lost. The writes of a record being
+        committed together, finding the idempotency key of one of its
+        trade events on the engine means the whole record went through.
+
+        Args:
+            engine (StorageBackend): The engine about to be written.
+            appends (dict): Worksheet name to the rows to append.
+        """
+        for worksheet, rows in appends.items():
+            columns = WORKSHEET_SCHEMAS[worksheet]
+            if "event_key" not in columns:
+                continue
+            column = columns.index("event_key")
+            keys = self.logged_keys(engine, worksheet)
+            if any(
+                pad_row(worksheet, list(data))[column] in keys
+                for data in rows
+            ):
+                return True
+        return False
+
+    def logged_keys(self, engine, worksheet):
+        """
+        Returns the idempotency keys of the trade events logged to a
+        worksheet of an engine. The worksheet is read in full the first
+        time, then only the rows added since, trade events never being
+        deleted. Called from the journal's background thread.
+        """
+        read, keys = self.logged.setdefault((engine, worksheet), [1, set()])
+        column = WORKSHEET_SCHEMAS[worksheet].index("event_key")
+        rows = engine.get_rows(worksheet, read + 1)
+        for row in rows:
+            key = pad_row(worksheet, list(row))[column]
+            if key:
+                keys.add(key)
+        self.logged[(engine, worksheet)][0] = read + len(rows)
+        return keys
+
+    def connect(self):
+        """
+        Returns the remote engine, starting it first if it could not be
+        started earlier. Called from the journal's background thread.
+
+        Returns:
+            StorageBackend: The engine journal records are applied to,
+                None if there is none.
+
+        Raises:
+            Exception: Any error raised while starting the engine, so
+                the journal retries the record later.
+        """
+        if self.replica is None:
+            return self.backend
+        with self.connect_lock:
+            if self.primary is None:
+                self.primary = STORAGE_BACKENDS[self.backend_name].open_book(
+                    self.book, self.state_dir
+                )
+        return self.primary
+
+    def reconcile(self, engine, updates, originals, appends=None):
+        """
+        Compare-and-swap check of row rewrites: each rewritten row is
+        read back and must still hold the values the rewrite was based
+        on. When it does not, the worksheet is read again and the
+        rewrite is rebased on it (see rebase).
+
+        When appends are given, for writes made offline or left from an
+        earlier session, the positions they open must not be open yet.
+
+        Args:
+            engine (StorageBackend): The engine about to be written.
+            updates (dict): Worksheet name to the (row number, data)
+                tuples to rewrite.
+            originals (dict): Worksheet name to {row number: values the
+                rewrite was based on}.
+            appends (dict, optional): Worksheet name to rows to append.
+
+        Returns:
+            tuple: The rewrites to make and the rows they replace, as
+                they are now, in the same shapes as the arguments.
+
+        Raises:
+            WriteConflict: If a rewrite cannot be rebased, or a position
+                would be opened twice.
+        """
+        checked, replaced = {}, {}
+        for worksheet in set(updates) | set(appends or {}):
+            based = originals.get(worksheet, {})
+            rewrites = updates.get(worksheet, [])
+            current = engine.read_rows(
+                worksheet, [row for row, _ in rewrites if row in based]
+            ) if based else {}
+            values = None
+            moved, kept = [], {}
+            for row, data in rewrites:
+                base = based.get(row)
+                if base is None:
+                    # Nothing is known about the row, it is written as is
+                    moved.append((row, data))
+                    continue
+                base = pad_row(worksheet, list(base))
+                now = current.get(row)
+                if now is None or row in kept or not rows_match(
+                    pad_row(worksheet, list(now)), base
+                ):
+                    if values is None:
+                        values = engine.get_all_values(worksheet)
+                    row, data = self.rebase(worksheet, values, row, base,
+                                            data, kept)
+                    now = values[row - 1]
+                    self.reload = True
+                moved.append((row, data))
+                kept[row] = pad_row(worksheet, list(now))
+            if moved:
+                checked[worksheet] = sorted(moved)
+                replaced[worksheet] = kept
+            if not appends or worksheet != "entry":
+                continue
+            if values is None:
+                values = engine.get_all_values(worksheet)
+            columns = WORKSHEET_SCHEMAS[worksheet]
+            asset = columns.index("asset")
+            action = columns.index("action")
+            still_open = {
+                cells[asset] for number, cells in
+                filter_rows(worksheet, values, action="open")
+                if number not in kept
+            }
+            for data in appends.get(worksheet, []):
+                cells = pad_row(worksheet, [format_cell(v) for v in data])
+                if cells[action] == "open" and cells[asset] in still_open:
+                    raise WriteConflict(
+                        f"{cells[asset]} is already open on the spreadsheet"
+                    )
+        return checked, replaced
+
+    def rebase(self, worksheet, values, row, base, data, taken):
+        """
+        Finds where a rewrite goes once the row it was based on changed.
+
+        If the row it was based on only moved, the rewrite follows it.
+        Otherwise it goes to the row holding the same trade (same
+        timestamp, asset, type and price, or the same row number for
+        worksheets without trades), as long as its action did not change:
+        the cells the rewrite changes are written over the fresh row,
+        the others keep what the other session wrote.
+
+        Args:
+            worksheet (str): The name of the worksheet.
+            values (list): The worksheet rows as they are now.
+            row (int): The row number the rewrite was aimed at.
+            base (list): The row values the rewrite was based on.
+            data (list): The rewrite.
+            taken (dict): Row numbers already rewritten, to skip.
+
+        Returns:
+            tuple: The row number and data to write.
+
+        Raises:
+            WriteConflict: If the trade is gone, or was closed (or
+                reopened) by another session.
+        """
+        rows = [
+            (number, pad_row(worksheet, list(cells)))
+            for number, cells in enumerate(values[1:], 2)
+            if number not in taken
+        ]
+        for number, cells in rows:
+            if rows_match(cells, base):
+                return number, data
+
+        columns = WORKSHEET_SCHEMAS[worksheet]
+        identity = [columns.index(c) for c in TRADE_IDENTITY if c in columns]
+        same_trade = sorted(
+            (number != row, number, cells) for number, cells in rows
+            if all(cells_match(cells[i], base[i]) for i in identity)
+            and (identity or number == row)
+        )
+        if not same_trade:
+            raise WriteConflict(
+                f"the trade in row {row} of worksheet '{worksheet}' is "
+                "gone from the spreadsheet"
+            )
+        _, number, cells = same_trade[0]
+        if "action" in columns:
+            action = columns.index("action")
+            if not cells_match(cells[action], base[action]):
+                raise WriteConflict(
+                    f"the trade in row {row} of worksheet '{worksheet}' "
+                    f"was marked '{cells[action]}' by another session"
+                )
+        # Our changes go on top of the fresh row, the cells we did not
+        # change keep what the other session wrote
+        return number, [
+            None if value is None or cells_match(value, old) else value
+            for value, old in zip(data, base)
+        ]
+
+    def reject(self, record, error):
+        """
+        Sets aside a journal record that conflicts with the remote
+        engine, so it can be reviewed and entered again by hand.
+
+        Args:
+            record (dict): The record, as saved by journal_writes.
+            error (WriteConflict): The conflict found.
+        """
+        path = os.path.join(self.state_dir, "conflicts.log")
+        try:
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(dict(record, error=str(error))) + "\n")
+        except OSError as e:
+            print(f"Failed to save the conflicting writes: {e}")
+        print(ERROR(
+            f"\nSaved writes were not sent, {error}. They are kept "
+            f"in {path}."
+        ))
+
+    def close(self):
+        """
+        Flushes the pending writes and gives the journal a few seconds
+        to send them before the program stops. Whatever is left is sent
+        on the next start.
+        """
+        self.flush()
+        if self.journal is None:
+            return
+        timeout = float(os.environ.get("TRADING_BOOK_EXIT_WAIT", 10))
+        if not self.journal.wait(timeout):
+            print(
+                f"{len(self.journal.pending())} saved write(s) could not be "
+                "sent yet, they will be sent on the next start."
+            )
+
+    @METRICS.measured
+    def archive(self, quiet=False):
+        """
+        Moves the closed trades of 'entry' to 'entry_archive', in
+        batches of archive_batch rows, so the rows read and scanned to
+        find the open positions stay proportional to them rather than
+        to every trade ever made. Each archived row keeps the number it
+        had in 'entry' and the date it was archived, see history().
+
+        Archiving needs the storage engine to be reachable and every
+        journaled write to have reached it, as the rows below the
+        archived ones move up.
+
+        Args:
+            quiet (bool): If True, nothing is printed when archiving
+                cannot run yet, as for the scheduled runs.
+
+        Returns:
+            int: The number of trades archived, or None if archiving
+                could not run.
+        """
+        if self.pinned is not None:
+            return None
+        archived = 0
+        # Archiving sessions are kept apart like the trades of one asset
+        with self.flush_lock, self.locks.hold("*archive*"):
+            if not self.flush() or self.offline or (
+                self.backend.remote and not self.settle()
+            ):
+                if not quiet:
+                    print(
+                        "Closed trades not archived, saved writes are "
+                        "still waiting to be sent."
+                    )
+                return None
+            date = datetime.datetime.now().strftime("%Y-%m-%d")
+            try:
+                while True:
+                    with self.backend.exclusive():
+                        closed = self.closed_rows()
+                        # Earlier batches of this run took rows above
+                        # these, keep the numbers they had at its start
+                        moved = [
+                            (number, row + [number + archived, date])
+                            for number, row in closed
+                        ]
+                        if moved:
+                            self.backend.move_rows(
+                                "entry", "entry_archive", moved
+                            )
+                            self.mirror_moves(
+                                "entry", "entry_archive", moved
+                            )
+                    if not closed:
+                        break
+                    archived += len(closed)
+                    self.invalidate("entry")
+                    self.invalidate("entry_archive")
+            except Exception as e:
+                print(f"Failed to archive closed trades: {e}")
+                self.invalidate("entry")
+                self.invalidate("entry_archive")
+                return None
+        self.archived_now()
+        return archived
+
+    def closed_rows(self):
+        """
+        Reads the next batch of closed trades to archive from the
+        storage engine, checking they still sit on the rows read just
+        before they are moved.
+
+        Returns:
+            list: (row number, row values) tuples, empty when nothing
+                is left to archive or the rows moved in the meantime.
+        """
+        values = self.backend.get_all_values("entry")
+        closed = filter_rows("entry", values, action="close")
+        closed = closed[:self.archive_batch]
+        if self.backend.remote and not self.unchanged(
+            self.backend, "entry", closed
+        ):
+            # Rows moved, another session is archiving or deleting
+            return []
+        return closed
+
+    def unchanged(self, engine, worksheet, rows):
+        """
+        Checks rows of a remote engine still hold the given values,
+        reading them back in one call. Local engines are checked inside
+        their own transaction instead.
+
+        Args:
+            engine (StorageBackend): The engine holding the rows.
+            worksheet (str): The name of the worksheet.
+            rows (list): (row number, row values) tuples, extra values
+                past the worksheet width being ignored.
+
+        Returns:
+            bool: True if every row still holds its values.
+        """
+        if not engine.remote or not rows:
+            return True
+        width = len(WORKSHEET_SCHEMAS[worksheet])
+        current = engine.read_rows(worksheet, [number for number, _ in rows])
+        return all(
+            rows_match(
+                pad_row(worksheet, current.get(number, [])),
+                pad_row(worksheet, list(values[:width])),
+            )
+            for number, values in rows
+        )
+
+    def archive_due(self):
+        """
+        Returns True if the scheduled archive() is due, the last run of
+        any session being recorded in the state folder. The run is
+        postponed while the remote engine is not reached yet, as after
+        a warm start, or saved writes are waiting to be sent to it.
+        """
+        if self.archive_interval <= 0 or self.offline:
+            return False
+        if self.journal is not None and self.journal.pending("backend"):
+            return False
+        path = os.path.join(self.state_dir, "archived")
+        try:
+            last = os.path.getmtime(path)
+        except OSError:
+            return True
+        return time.time() - last >= self.archive_interval
+
+    def archived_now(self):
+        """
+        Records that archive() just ran, see archive_due().
+        """
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(os.path.join(self.state_dir, "archived"), "w"):
+                pass
+        except OSError as e:
+            print(f"Failed to record the archive date: {e}")
+
+    def local_history(self, worksheet):
+        """
+        Returns the HistoryArchive of a worksheet of the book.
+        """
+        return HistoryArchive(
+            os.path.join(self.state_dir, "history"), worksheet
+        )
+
+    @METRICS.measured
+    def save_history(self):
+        """
+        Adds the trade events and the closed trades logged since the
+        last run to their local HistoryArchive, the events of past
+        months not being read again.
+
+        Returns:
+            dict: Worksheet to the number of rows added.
+        """
+        today = datetime.date.today().isoformat()
+        partitions = catalog_partitions(
+            self.get_all_values("partitions"), "raw_data"
+        )
+        added = {}
+        try:
+            added["raw_data"] = self.local_history("raw_data").sync(
+                self, ["raw_data"] + partitions, ["raw_data"] + [
+                    name for name in partitions
+                    if partition_bounds(name)[1] < today
+                ],
+            )
+            added["entry_archive"] = self.local_history(
+                "entry_archive"
+            ).sync(self, ["entry_archive"])
+        except (OSError, HistoryError) as e:
+            print(f"Failed to save the local history: {e}")
+        return added
+
+    def history(self, asset=None):
+        """
+        Returns every trade of an asset, or of the whole book, whether
+        it was archived or not, oldest first.
+
+        Returns:
+            list: (row values, location) tuples. The row values hold
+                the 'entry' columns and the location tells where the
+                trade is stored, with the 'entry' row it had for the
+                archived ones.
+        """
+        width = len(WORKSHEET_SCHEMAS["entry"])
+        identity = [
+            WORKSHEET_SCHEMAS["entry"].index(column)
+            for column in TRADE_IDENTITY
+        ]
+        trades = {}
+        for number, row in self.find_rows("entry_archive", asset=asset):
+            key = tuple(format_cell(row[index]) for index in identity)
+            location = f"archive row {number} (entry row {row[width]})"
+            # A row archived twice after a failed move is shown once
+            trades.setdefault(key, (row[:width], location))
+        for number, row in self.find_rows("entry", asset=asset):
+            key = tuple(format_cell(row[index]) for index in identity)
+            trades.pop(key, None)
+            trades[key] = (row, f"entry row {number}")
+        return sorted(trades.values(), key=lambda trade: trade[0][0])
+
+    def transaction(self):
+        """
+        Returns a Transaction grouping the writes made while it is
+        open, to commit them all together or not at all.
+        """
+        return Transaction(self)
+
+    def unit_of_work(self):
+        """
+        Returns a UnitOfWork spanning one command.
+        """
+        return UnitOfWork(self)
+
+    def begin_work(self):
+        """
+        Starts the unit of work of a command: writes queued before it
+        are flushed, then each worksheet the command reads is kept for
+        the rest of it, without expiring, and its writes are held in the
+        queue until end_work(). Worksheets read again on purpose (see
+        refresh) are still fetched.
+        """
+        self.flush()
+        with self.cache_lock:
+            self.work = {}
+        self.queue.held = True
+
+    def end_work(self, commit=True):
+        """
+        Ends the unit of work of a command.
+
+        Args:
+            commit (bool): If True, the writes the command made outside
+                of its transactions are committed together, otherwise
+                they are dropped along with the worksheets they were
+                applied to.
+
+        Returns:
+            bool: True if the writes were committed.
+        """
+        with self.cache_lock:
+            work, self.work = self.work or {}, None
+        self.queue.held = self.pinned is not None
+        if commit:
+            return self.flush(atomic=True)
+        self.queue.drain()
+        for worksheet in work:
+            self.invalidate(worksheet)
+        # Partitions recorded by the dropped writes are not recorded
+        self.known_partitions = None
+        return False
+
+    def begin(self):
+        """
+        Opens a transaction. Writes queued before it are flushed first,
+        the worksheets read during it are pinned in the cache and
+        automatic flushes are held until it ends. Transactions can be
+        nested, only the outermost one commits.
+        """
+        self.flush_lock.acquire()
+        self.depth += 1
+        if self.depth == 1:
+            self.flush()
+            self.pinned = {}
+            self.originals = {}
+            self.rollback_only = False
+            self.queue.held = True
+
+    def end(self):
+        """
+        Closes the outermost transaction, releasing the pinned
+        worksheets and the automatic flushes.
+        """
+        self.pinned = None
+        self.originals = {}
+        # A command's unit of work keeps holding its writes
+        self.queue.held = self.work is not None
+
+    def commit(self):
+        """
+        Commits the writes of the current transaction.
+
+        Returns:
+            bool: True if the writes were committed (or will be, by an
+                enclosing transaction), False if none of them were.
+        """
+        try:
+            self.depth -= 1
+            if self.depth > 0:
+                return not self.rollback_only
+            if self.rollback_only:
+                self.discard()
+                return False
+            committed = self.flush(atomic=True)
+            self.end()
+            return committed
+        finally:
+            self.flush_lock.release()
+
+    def rollback(self):
+        """
+        Drops the writes of the current transaction and the cached
+        worksheets they were applied to.
+        """
+        try:
+            self.depth -= 1
+            if self.depth > 0:
+                self.rollback_only = True
+            else:
+                self.discard()
+        finally:
+            self.flush_lock.release()
+
+    def discard(self):
+        """
+        Empties the queue and the worksheets pinned by the outermost
+        transaction, then closes it.
+        """
+        self.queue.drain()
+        for worksheet in self.pinned:
+            self.invalidate(worksheet)
+        # Partitions recorded by the dropped writes are not recorded
+        self.known_partitions = None
+        self.end()
+
+
+class Transaction:
+    """
+    Context manager grouping the writes made through DataBaseActions
+    while it is open, so they are committed together at the end, or
+    dropped if an error is raised.
+
+    Attributes:
+        database (DataBaseActions): The database written to.
+        committed (bool): True once the writes have been committed.
+
+    Example:
+        with DB.transaction() as transaction:
+            DB.append("raw_data", row)
+            DB.append("entry", row)
+        if not transaction.committed:
+            ...
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.committed = False
+
+    def __enter__(self):
+        self.database.begin()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.committed = self.database.commit()
+        else:
+            self.database.rollback()
+        return False
+
+
+class UnitOfWork:
+    """
+    Context manager spanning one command, so each worksheet it reads is
+    fetched at most once and the writes it makes outside of its
+    transactions are committed together when it ends, or dropped if
+    it fails.
+
+    Transactions opened by the command, such as saving a trade under
+    its asset lock, still commit when they end.
+
+    Attributes:
+        database (DataBaseActions): The database used by the command.
+        committed (bool): True once the writes have been committed.
+
+    Example:
+        with DB.unit_of_work():
+            input_validate.multi_menu_call()
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.committed = False
+
+    def __enter__(self):
+        self.database.begin_work()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # Leaving the program through 'exit' keeps the command's writes
+        if exc_type is None or issubclass(exc_type, SystemExit):
+            self.committed = self.database.end_work()
+        else:
+            self.database.end_work(commit=False)
+        return False
+
+
+class TradeLog:
+    """
+    Rebuilds the trades from the open, update and close events logged
+    to 'raw_data' and its partitions, as the 'entry' rows they make.
+
+    The events are replayed in blocks of 'every' events. After each
+    block a checkpoint is saved to the 'checkpoints' folder of the
+    state folder, with the hash of the block, the date of its last
+    event, the positions as they stood after it and the trades it
+    closed. A rebuild only replays the events from the first block
+    that changed, and worksheets of past months already replayed are
+    not read again.
+
+    Attributes:
+        database (DataBaseActions): The database the events are read
+            from.
+        folder (str): Location of the checkpoints, one file per
+            worksheet of events.
+        every (int): Events replayed between two checkpoints.
+    """
+
+    name = "replay"
+
+    def __init__(self, database):
+        """
+        Args:
+            database (DataBaseActions): The database to read from.
+        """
+        self.database = database
+        self.folder = os.path.join(database.state_dir, "checkpoints")
+        self.every = max(
+            1, int(os.environ.get("TRADING_BOOK_CHECKPOINT_EVERY", 500))
+        )
+
+    def path(self, source):
+        """
+        Returns the location of the checkpoints of a worksheet.
+        """
+        return os.path.join(self.folder, f"{source}.json")
+
+    def checkpoints(self, source):
+        """
+        Loads the checkpoints of a worksheet, none when they were saved
+        for blocks of another size or cannot be read.
+
+        Returns:
+            dict: 'blocks', a list of [hash, last date, positions,
+                closed trades] checkpoints, and 'complete', True when
+                no more events can be logged to the worksheet.
+        """
+        try:
+            with open(self.path(source), encoding="utf-8") as file:
+                saved = json.load(file)
+            if saved.get("every") == self.every:
+                return saved
+        except (OSError, ValueError):
+            pass
+        return {"every": self.every, "blocks": [], "complete": False}
+
+    def save(self, source, saved):
+        """
+        Saves the checkpoints of a worksheet.
+        """
+        temporary = self.path(source) + ".tmp"
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(saved, file)
+            os.replace(temporary, self.path(source))
+        except OSError as e:
+            print(f"Failed to save the replay checkpoints: {e}")
+
+    def events(self, source):
+        """
+        Reads the events logged to a worksheet, their cells written the
+        same way whatever engine they came from.
+        """
+        return [
+            [
+                normal_cell(column, cell) for column, cell in zip(
+                    WORKSHEET_SCHEMAS[source], pad_row(source, list(row))
+                )
+            ]
+            for row in self.database.get_all_values(source)[1:]
+        ]
+
+    @METRICS.measured
+    def rebuild(self, until=None, full=False, touched=None, problems=None):
+        """
+        Replays the logged events, from the checkpoints when they still
+        match the events.
+
+        Args:
+            until (str, optional): Last 'YYYY-MM-DD' date replayed, to
+                rebuild the trades as they stood on that day.
+            full (bool): If True, every event is replayed again.
+            touched (dict, optional): Updated with the trade key to the
+                'entry' row of every trade changed by the events that
+                were replayed.
+            problems (list, optional): Extended with the events that
+                could not be applied.
+
+        Returns:
+            tuple: The positions, as the asset to the 'entry' row of
+                its last trade, and every closed trade, oldest first.
+        """
+        database = self.database
+        touched = {} if touched is None else touched
+        problems = [] if problems is None else problems
+        today = datetime.date.today().isoformat()
+        catalog = database.get_all_values("partitions")
+        sources = ["raw_data"] + catalog_partitions(
+            catalog, "raw_data", end=until
+        )
+        positions, history = {}, []
+        replaying = full
+
+        for source in sources:
+            known = self.checkpoints(source)
+            blocks = known["blocks"]
+            if (
+                known["complete"] and not replaying
+                and (until is None or not blocks or blocks[-1][1] <= until)
+            ):
+                if blocks:
+                    positions = blocks[-1][2]
+                for *_, closed in blocks:
+                    history.extend(closed)
+                continue
+            events = self.events(source)
+            verified, stopped = [], False
+            for number, start in enumerate(
+                range(0, len(events), self.every)
+            ):
+                block = events[start:start + self.every]
+                if until is not None and block[-1][0] > until:
+                    # The day asked for ends inside this block
+                    block = [event for event in block if event[0] <= until]
+                    positions, closed = self.replay(
+                        block, positions, touched, problems
+                    )
+                    history.extend(closed)
+                    stopped = True
+                    break
+                digest = hashlib.sha1(
+                    json.dumps(block).encode("utf-8")
+                ).hexdigest()
+                if (
+                    not replaying
+                    and number < len(blocks)
+                    and blocks[number][0] == digest
+                ):
+                    positions, closed = blocks[number][2:]
+                else:
+                    replaying = True
+                    positions, closed = self.replay(
+                        block, positions, touched, problems
+                    )
+                history.extend(closed)
+                verified.append([digest, block[-1][0], positions, closed])
+            if stopped:
+                break
+            complete = (
+                source == "raw_data" or partition_bounds(source)[1] < today
+            )
+            if verified != blocks or complete != known["complete"]:
+                self.save(source, {
+                    "every": self.every,
+                    "blocks": verified,
+                    "complete": complete,
+                })
+        return positions, history
+
+    def as_of(self, date):
+        """
+        Returns the trades as they stood at the end of a day.
+
+        Args:
+            date (str): The 'YYYY-MM-DD' day.
+
+        Returns:
+            tuple: The 'entry' rows of the trades open on that day, and
+                of the trades closed by then, oldest first.
+        """
+        positions, history = self.rebuild(until=date)
+        open_trades = sorted(
+            (row for row in positions.values() if row[1] == "open"),
+            key=lambda row: row[0],
+        )
+        return open_trades, history
+
+    @staticmethod
+    def replay(events, positions, touched, problems):
+        """
+        Applies a block of events to the positions.
+
+        Args:
+            events (list): The 'raw_data' rows of the block.
+            positions (dict): Asset to the 'entry' row of its last trade,
+                as they stood before the block. Left unchanged.
+            touched (dict): Updated with the trade key to the 'entry'
+                row of every trade the events changed.
+            problems (list): Extended with the events that could not
+                be applied.
+
+        Returns:
+            tuple: The positions after the block, and the trades it
+                closed.
+        """
+        positions = {
+            asset: list(row) for asset, row in positions.items()
+        }
+        closed = []
+        for timestamp, action, asset, type, price, stop, atr, _ in events:
+            current = positions.get(asset)
+            is_open = current is not None and current[1] == "open"
+            if action == "open":
+                if is_open:
+                    problems.append((
+                        asset, f"opened again on {timestamp} while open",
+                        None,
+                    ))
+                row = [
+                    timestamp, "open", asset, type, price, stop, atr,
+                    timestamp, "", stop, atr,
+                ]
+            elif action in ("update", "close") and is_open:
+                row = list(current)
+                row[7], row[9], row[10] = timestamp, stop, atr
+                if action == "close":
+                    row[1], row[8] = "close", price
+                    closed.append(row)
+            else:
+                problems.append((
+                    asset, f"{action} on {timestamp} without an open trade",
+                    None,
+                ))
+                continue
+            positions[asset] = row
+            touched[trade_key(row)] = row
+        return positions, closed
+
+
+class ConsistencyChecker:
+    """
+    Checks the 'entry' worksheet against the trade events logged to
+    'raw_data' and its partitions, by replaying the events into the
+    rows 'entry' should hold (see TradeLog).
+
+    Only the events from the first block changed since the last
+    checkpoint are replayed, the trades they touched being compared
+    with 'entry' along with the open trades and the trades found
+    divergent by the last run, saved to 'consistency.json' in the
+    state folder.
+
+    Attributes:
+        database (DataBaseActions): The database checked.
+        path (str): Location of the saved state.
+        state (dict): The date of the last run and the trades found
+            divergent.
+        interval (float): Seconds between two scheduled runs, 0 to only
+            check on demand.
+    """
+
+    name = "verify"
+
+    def __init__(self, database):
+        """
+        Loads the state saved by the last run.
+
+        Args:
+            database (DataBaseActions): The database to check.
+        """
+        self.database = database
+        self.path = os.path.join(database.state_dir, "consistency.json")
+        self.interval = float(
+            os.environ.get("TRADING_BOOK_VERIFY_INTERVAL", 86400)
+        )
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                self.state = json.load(file)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def due(self):
+        """
+        Returns True if the scheduled run is due.
+        """
+        if self.interval <= 0:
+            return False
+        return time.time() - self.state.get("verified", 0) >= self.interval
 
-    def read(self, worksheet):
+    @METRICS.measured
+    def run(self, full=False, repair=False):
         """
-        Reads the last row of data from the specified worksheet.
+        Checks 'entry' against the events logged since the last run.
 
         Args:
-            worksheet (str): The name of the worksheet to read from.
+            full (bool): If True, every worksheet of events is read and
+                replayed again, not only from the first changed block.
+            repair (bool): If True, the divergent 'entry' rows are
+                rewritten, and the missing ones appended, in a single
+                transaction.
 
         Returns:
-            list: The last row of data from the worksheet, or
-                None if an error occurs.
+            list: (asset, problem, entry row number or None) tuples,
+                one per divergence found.
         """
-        try:
-            worksheet = self.SHEET.worksheet(worksheet)
-            data = worksheet.get_all_values()
-            data_row = data[-1]
+        database = self.database
+        touched, problems = {}, []
+        positions, _ = TradeLog(database).rebuild(
+            full=full, touched=touched, problems=problems
+        )
 
-            return data_row
-        except APIError as e:
-            print(f"Failed to read from worksheet {worksheet}: {e}")
-            return None
-        except Exception as e:
-            print(
-                f"An unexpected error occurred while reading the"
-                f" worksheet {worksheet}: {e}"
-            )
-            return None
+        # Trades found divergent before are checked until they agree, and
+        # open trades every run, as their rows are the ones still written
+        for key, expected in self.state.get("divergent", {}).items():
+            touched.setdefault(key, expected)
+        for row in positions.values():
+            if row[1] == "open":
+                touched.setdefault(trade_key(row), row)
+        divergent, fixes = self.compare(positions, touched, problems)
+        if repair and fixes:
+            with database.transaction() as transaction:
+                for _, row, expected, current in fixes:
+                    if row is None:
+                        database.append("entry", expected)
+                    else:
+                        database.rewrite_target_row(
+                            "entry", expected, row, current
+                        )
+            if transaction.committed:
+                for key, *_ in fixes:
+                    divergent.pop(key, None)
+        self.save({"verified": time.time(), "divergent": divergent})
+        return problems
 
-    def append(self, worksheet, data):
+    def compare(self, positions, touched, problems):
         """
-        Appends a new row of data to the specified worksheet.
+        Compares the trades changed by the replayed events with the
+        rows 'entry' holds, closed trades being looked up in the archive
+        when they left 'entry', and checks every open row of 'entry' is
+        the last trade of its asset.
 
         Args:
-            worksheet (str): The name of the worksheet to write to.
-            data (list): The data to append as a new row in the worksheet.
+            positions (dict): Asset to the 'entry' row of its last trade,
+                after every event.
+            touched (dict): Trade key to the 'entry' row expected.
+            problems (list): Extended with the divergences found.
+
+        Returns:
+            tuple: The divergent trades, as a trade key to expected row
+                dict, and the (trade key, entry row number or None,
+                expected row, current row) writes that would repair
+                them.
+        """
+        width = len(WORKSHEET_SCHEMAS["entry"])
+        rows = {}
+        for number, row in enumerate(
+            self.database.get_all_values("entry")[1:], 2
+        ):
+            row = pad_row("entry", list(row))[:width]
+            rows.setdefault(trade_key(row), (number, row))
+        archived = None
+        divergent, fixes = {}, []
+
+        for key, expected in touched.items():
+            number, current = rows.get(key, (None, None))
+            if current is None and expected[1] == "close":
+                if archived is None:
+                    archived = {
+                        trade_key(row): row[:width]
+                        for _, row in self.database.find_rows(
+                            "entry_archive"
+                        )
+                    }
+                if key in archived:
+                    current = archived[key]
+            if current is None:
+                problems.append((expected[2], "missing from entry", None))
+            elif not rows_match(current, expected):
+                columns = [
+                    column for column, first, second in zip(
+                        WORKSHEET_SCHEMAS["entry"], current, expected
+                    )
+                    if not cells_match(first, second)
+                ]
+                problems.append((
+                    expected[2], f"differs in {', '.join(columns)}", number,
+                ))
+            else:
+                continue
+            divergent[key] = expected
+            # Archived rows are not rewritten
+            if current is None or number is not None:
+                fixes.append((key, number, expected, current))
+
+        for key, (number, row) in rows.items():
+            last = positions.get(row[2])
+            if row[1] == "open" and (
+                last is None or trade_key(last) != key
+            ):
+                problems.append((
+                    row[2], "open in entry without its events", number,
+                ))
+        return divergent, fixes
+
+    def save(self, state):
+        """
+        Saves the state of this run for the next one.
         """
+        self.state = state
+        temporary = self.path + ".tmp"
         try:
-            worksheet = self.SHEET.worksheet(worksheet)
-            worksheet.append_row(data)
-        except APIError as e:
-            print(f"Failed to write to worksheet {worksheet}: {e}")
-        except Exception as e:
-            print(
-                "An unexpected error occurred while writing to "
-                f"the worksheet {worksheet}: {e}"
-            )
+            os.makedirs(self.database.state_dir, exist_ok=True)
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(state, file)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Failed to save the consistency check: {e}")
 
-    def rewrite_target_row(self, worksheet_name, data, row):
-        """
-        Close/update database write.
 
-        Args:
-            worksheet (str): The name of the worksheet.
-            data (list): The data to write.
-            row (int): The row to update.
-        """
-        worksheet = DB.SHEET.worksheet(worksheet_name)
+class Books:
+    """
+    The trading books addressed by the process, one per strategy or
+    trader, each a spreadsheet held by a DataBaseActions of its own
+    with its own caches, journal and local files (see book_state_dir),
+    while the Google API clients are shared (see ClientPool).
 
-        try:
-            # Read the existing row data
-            existing_row_data = worksheet.row_values(row)
+    Attributes:
+        names (list): The books of the desk, from TRADING_BOOK_BOOKS,
+            a comma separated list of spreadsheet names.
+        opened (dict): Book name to its DataBaseActions, the default
+            book being served by DB.
+    """
+
+    def __init__(self):
+        names = os.environ.get("TRADING_BOOK_BOOKS", DEFAULT_BOOK)
+        self.names = [
+            name.strip() for name in names.split(",") if name.strip()
+        ] or [DEFAULT_BOOK]
+        self.opened = {}
+        self.lock = threading.Lock()
+
+    def open(self, book):
+        """
+        Returns the DataBaseActions of a book, opening it on first use.
+        """
+        if book == DEFAULT_BOOK:
+            return DB
+        with self.lock:
+            if book not in self.opened:
+                self.opened[book] = DataBaseActions(book=book)
+            return self.opened[book]
+
+    def fan_out(self, function, books=None):
+        """
+        Calls a function on several books concurrently, each call being
+        counted as part of the current command.
 
-            # Ensure the row data has enough columns to append the new data
-            while len(existing_row_data) < len(data):
-                existing_row_data.append('')
+        Args:
+            function (callable): Called with the DataBaseActions of
+                each book.
+            books (list, optional): The books, all of the desk by
+                default.
 
-            # Update the existing row data with new data
-            for i, value in enumerate(data):
-                existing_row_data[i] = value
+        Returns:
+            list: (book, result, error) tuples in the order of the books,
+                error being the exception raised, or None.
+        """
+        books = books or self.names
+        command = METRICS.tag()
 
-            # Update the row in the worksheet
-            # Calculate the cell range (A to appropriate column letter)
-            cell_range = f'A{row}:{chr(65 + len(data) - 1)}{row}'
-            worksheet.update(range_name=cell_range, values=[existing_row_data])
+        def call(book):
+            FOREGROUND.command = command
+            try:
+                return book, function(self.open(book)), None
+            except Exception as e:
+                return book, None, e
+            finally:
+                FOREGROUND.command = None
 
-        except Exception as e:
-            print(f"Failed to update row {row} in "
-                  f"worksheet '{worksheet_name}': {e}"
-                  )
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(books), thread_name_prefix="book"
+        ) as executor:
+            return list(executor.map(call, books))
 
 
 # Styling
@@ -266,6 +5540,7 @@ QUESTION = styles.apply_style("cyan")
 SUCCESS = styles.apply_style("green_background")
 ERROR = styles.apply_style("error")
 DB = DataBaseActions()
+BOOKS = Books()
 
 
 # General usage functions and atributes
@@ -302,7 +5577,8 @@ def get_input(prompt):
     """
     # Display the prompt to the user, formatted with a question style
 
-    user_input = input(QUESTION(f"{prompt}"))
+    with METRICS.waiting():
+        user_input = input(QUESTION(f"{prompt}"))
     input_data = str(user_input.strip().lower()).split()
 
     # Return the input after stripping whitespace and converting to lowercase
@@ -1794,6 +7070,8 @@ class MainMenu:
             "help": self.menu_help,
             "entry": self.menu_entry,
             "set": self.menu_set,
+            "stats": self.menu_stats,
+            "archive": self.menu_archive,
             "cancel": self.navigate_away,
             "back": self.navigate_away,
         }
@@ -1834,7 +7112,7 @@ class MainMenu:
             # Handle simple commands that do not require additional arguments
             # or context
 
-            if cmd in ["exit", "check"]:
+            if cmd in ["exit", "check", "stats", "archive"]:
                 return function(child_command)
             # Handle the 'help' command with optional child_command or context
 
@@ -1903,19 +7181,48 @@ class MainMenu:
         """
         Initializes an Entry instance and starts the entry loop.
         """
-        Entry(child_command).entry_loop()
+        with METRICS.command("entry"):
+            Entry(child_command).entry_loop()
 
     def menu_set(self, child_command=None):
         """
         Managing settings call
         """
-        Set(child_command).set_loop()
+        with METRICS.command("set"):
+            Set(child_command).set_loop()
 
     def menu_check(self, child_command=None):
         """
         Check all trades active and curent stats of the trading strategy
         """
-        Check().list_open_orders()
+        with METRICS.command("check"):
+            if child_command and "verify" in child_command:
+                Check().verify(
+                    full="full" in child_command,
+                    repair="repair" in child_command,
+                )
+            elif child_command and "books" in child_command:
+                Check().list_books()
+            elif child_command and "asof" in child_command:
+                dates = [word for word in child_command if word != "asof"]
+                Check().as_of(dates[0] if dates else None)
+            else:
+                Check().list_open_orders()
+
+    def menu_stats(self, child_command=None):
+        """
+        Shows the storage operations made during the session, or saves
+        them to a file with 'stats dump'.
+        """
+        Stats(child_command).stats_loop()
+
+    def menu_archive(self, child_command=None):
+        """
+        Moves the closed trades to the archive, or shows the trades of
+        an asset with 'archive history <asset>'.
+        """
+        with METRICS.command("archive"):
+            Archive(child_command).archive_loop()
 
     def exit_program(self, leave=None):
         """
@@ -2005,6 +7312,48 @@ class MainMenu:
         return list(cls().command.keys())
 
 
+def setting_value(setting):
+    """
+    Returns the value of a data setting stored as 'key:value', None
+    when it has no value yet.
+    """
+    return setting.split(":", 1)[1] if setting else None
+
+
+class Trade:
+    """
+    A trade entered by the user, parsed once from the 'key:value'
+    strings of the entry data settings.
+
+    Attributes:
+        action (str): open, close or update.
+        asset (str): The asset traded.
+        type (str): long or short.
+        price (float): The trade price.
+        stop (float): The stop price.
+        atr (float): The average true range.
+    """
+    __slots__ = ("action", "asset", "type", "price", "stop", "atr")
+
+    def __init__(self, action, asset, type, price, stop, atr):
+        self.action = action
+        self.asset = asset
+        self.type = type
+        self.price = price
+        self.stop = stop
+        self.atr = atr
+
+    @classmethod
+    def from_settings(cls, data_settings):
+        """
+        Builds a trade from complete entry data settings.
+        """
+        action, asset, type, price, stop, atr = (
+            setting_value(data_settings[key][1]) for key in cls.__slots__
+        )
+        return cls(action, asset, type, float(price), float(stop), float(atr))
+
+
 class Entry:
     """
     Class to handle trade entries.
@@ -2032,6 +7381,9 @@ class Entry:
         }
         self.cmd = "entry"
         self.bulk_mode_status = False
+        self.bulk_report = []
+        # Idempotency key of the trade event, a new one when None
+        self.event_key = None
 
     def key_validator(self):
         """
@@ -2126,7 +7478,21 @@ class Entry:
 
         if not key_none:
             if silent:
-                self.confirm_data(silent=silent)
+                # Bulk entries are validated against the open orders as
+                # they stand after the previous entries of the batch
+                action, asset = (
+                    setting_value(self.data_settings[k][1])
+                    for k in ("action", "asset")
+                )
+                try:
+                    self.validate_asset_name(asset, action)
+                except ValueError as e:
+                    self.bulk_report.append((False, " ".join(
+                        delete_none_values(self.data_settings, 1)
+                        + [f"({str(e).strip()})"]
+                    )))
+                else:
+                    self.confirm_data(silent=silent)
             else:
                 if self.confirm_data():
                     Check().list_open_orders(silent=True)
@@ -2210,6 +7576,16 @@ class Entry:
 
         This method is called when the 'bulk' action is selected.
         It allows the user to import multiple tradeentries in bulk.
+
+        Every entry is validated first, against the open orders as they
+        would be after the previous entries of the batch. The valid
+        entries are then committed together in a single transaction, so
+        either all of them are saved or none of them is.
+
+        Each entry is logged with an idempotency key, its "key" field or
+        else one derived from the file itself (see bulk_key), and
+        entries whose key was already logged are skipped, so importing
+        the same file again, on any day, does not save its trades twice.
         """
         print(TITLE("\nHey, you selected bulk-mode import!"))
         print(green(italic("\nTips:")))
@@ -2228,27 +7604,106 @@ class Entry:
             reformated_data = self.clean_data_import(str(data_import))
             bulk_data = json.loads(reformated_data)
 
-            print("\nBulk import report:")
+            self.bulk_report = []
 
-            for entry_data in bulk_data:
-                self.input = [
-                    f"{key}:{value}" for key, value in entry_data.items()
-                ]
-
-                self.data_settings = {
-                    "action": ("open/close/update/bulk", None),
-                    "asset": ("any", None),
-                    "type": ("long/short", None),
-                    "price": ("#.########", None),
-                    "stop": ("#.########", None),
-                    "atr": ("#.####%", None),
-                }
+            # Every asset of the batch stays locked until it is committed
+            assets = [
+                str(entry_data["asset"]) for entry_data in bulk_data
+                if isinstance(entry_data, dict) and "asset" in entry_data
+            ]
+            with METRICS.command("bulk"), DB.locks.hold(*assets):
+                DB.refresh(self.cmd)
+                with DB.transaction() as transaction:
+                    for position, entry_data in enumerate(bulk_data):
+                        self.bulk_entry(
+                            entry_data, self.bulk_key(position, entry_data)
+                        )
 
-                self.entry_loop(silent=True)
+            self.print_bulk_report(transaction.committed)
 
             # Calculation.start()
         except json.JSONDecodeError as e:
             print(ERROR(f"\nInvalid JSON format: {e}"))
+        except AssetBusy as e:
+            print(ERROR(f"\nBulk import not saved, {e}"))
+
+    def bulk_key(self, position, entry_data):
+        """
+        Returns the idempotency key of a bulk import entry without a
+        "key" field, derived from the worksheet imported to, the
+        position of the entry in the file and its content only, so the
+        same file imported again gives the same keys.
+
+        Args:
+            position (int): The position of the entry in the file.
+            entry_data (dict): The entry, as imported from JSON.
+        """
+        return hashlib.sha1(json.dumps(
+            [self.cmd, position, entry_data], sort_keys=True,
+        ).encode("utf-8")).hexdigest()[:16]
+
+    def bulk_entry(self, entry_data, event_key):
+        """
+        Validates and stages one entry of a bulk import, adding it to
+        the bulk report.
+
+        Args:
+            entry_data (dict): The entry, as imported from JSON.
+            event_key (str): Idempotency key of the entry, unless it
+                has its own "key" field.
+        """
+        entry_data = dict(entry_data)
+        event_key = str(entry_data.pop("key", None) or event_key)
+        if DB.known_event(event_key):
+            self.bulk_report.append((None, " ".join(
+                str(value) for value in entry_data.values()
+            )))
+            return
+
+        self.input = [
+            f"{key}:{value}" for key, value in entry_data.items()
+        ]
+
+        self.data_settings = {
+            "action": ("open/close/update/bulk", None),
+            "asset": ("any", None),
+            "type": ("long/short", None),
+            "price": ("#.########", None),
+            "stop": ("#.########", None),
+            "atr": ("#.####%", None),
+        }
+
+        staged = len(self.bulk_report)
+        self.event_key = event_key
+        try:
+            self.entry_loop(silent=True)
+        finally:
+            self.event_key = None
+
+        # Entries left incomplete never reach the report
+        if len(self.bulk_report) == staged:
+            self.bulk_report.append((False, " ".join(
+                delete_none_values(self.data_settings, 1)
+            )))
+
+    def print_bulk_report(self, committed):
+        """
+        Print the outcome of each entry of a bulk import.
+
+        Args:
+            committed (bool): True if the valid entries were committed.
+        """
+        print("\nBulk import report:")
+
+        for valid, entry in self.bulk_report:
+            if valid is None:
+                print(SUCCESS(f"Entry already saved: {entry}"))
+            elif valid and committed:
+                print(SUCCESS(f"Entry saved: {entry}"))
+            elif valid:
+                print(ERROR(f"Entry not saved, batch rolled back: {entry}"))
+            else:
+                print(ERROR(f"Entry failed: {entry}"))
 
     def clean_data_import(self, data_import):
         """
@@ -2304,8 +7759,18 @@ class Entry:
             confirmation = True
 
         if confirmation:
-            self.save_data()
             if not silent:
+                try:
+                    committed = self.save_locked()
+                except (AssetBusy, ValueError) as e:
+                    print(ERROR(f"\nTrade not saved, {str(e).strip()}"))
+                    return False
+                if not committed:
+                    print(ERROR(
+                        "\nTrade not saved:\nentry "
+                        f"{action} {asset} {type} {price} {stop} {atr}"
+                    ))
+                    return False
                 print(
                     SUCCESS(
                         "\nTrade stored with user input:\nentry "
@@ -2313,11 +7778,11 @@ class Entry:
                     )
                 )
             else:
-                # Used for bulk mode report
-                print(SUCCESS(
-                    f"Entry saved: {action} {asset} {type}"
-                    f" {price} {stop} {atr}"
-                    )
+                # Bulk entries are saved under the locks taken by
+                # bulk_mode, the report is printed once committed
+                self.save_data()
+                self.bulk_report.append(
+                    (True, f"{action} {asset} {type} {price} {stop} {atr}")
                 )
         else:
             if not silent:
@@ -2347,15 +7812,12 @@ class Entry:
             list: A list containing the formatted data ready
                 for database writing.
                 The list includes the current timestamp, action,
-                asset, type, price, stop, and atr values.
+                asset, type, price, stop, and atr values, the raw data
+                also holding the idempotency key of the trade event.
         """
-        action, asset, type, price, stop, atr = (
-            self.data_settings[k][1].split(':')[1] for k in self.data_settings
-        )
-
-        price = float(price)
-        stop = float(stop)
-        atr = float(atr)
+        trade = Trade.from_settings(self.data_settings)
+        action, asset, type = trade.action, trade.asset, trade.type
+        price, stop, atr = trade.price, trade.stop, trade.atr
 
         # Get the current time
         current_time = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -2368,6 +7830,7 @@ class Entry:
                 price,
                 stop,
                 atr,
+                self.event_key or uuid.uuid4().hex,
             ]
 
         # Format the data
@@ -2414,6 +7877,35 @@ class Entry:
         # Append data to the self.cmd worksheet with the specific structure
         self.save_to_cmd_worksheet(formatted_data)
 
+    def save_locked(self):
+        """
+        Saves the trade while holding the lock of its asset.
+
+        The open orders are validated again under the lock, against
+        the rows other sessions wrote since they were last read. The
+        prompt is back once the trade is committed to the journal,
+        without waiting for the remote engine, but other sessions only
+        get the lock once the trade reached it, so they never validate
+        against rows missing it (see DataBaseActions.journal_writes).
+
+        Returns:
+            bool: True if the trade was committed.
+
+        Raises:
+            AssetBusy: If the asset lock could not be taken in time.
+            ValueError: If the trade no longer fits the open orders.
+        """
+        action, asset = (
+            setting_value(self.data_settings[key][1])
+            for key in ("action", "asset")
+        )
+        with DB.locks.hold(asset):
+            DB.refresh(self.cmd)
+            self.validate_asset_name(asset, action)
+            with DB.transaction() as transaction:
+                self.save_data()
+        return transaction.committed
+
     def save_to_cmd_worksheet(self, formatted_data):
         """
         Save data to the worksheet specified by self.cmd
@@ -2427,7 +7919,6 @@ class Entry:
         'open' action for the same asset,
         in the next 7 columns.
         """
-        worksheet = DB.SHEET.worksheet(self.cmd)
         action, asset = formatted_data[1], formatted_data[2]
 
         if action == "open":
@@ -2441,53 +7932,49 @@ class Entry:
                                  formatted_data[6],
                                  formatted_data[7],
                                  None,
-                                 formatted_data[4],
-                                 formatted_data[6]
+                                 formatted_data[9],
+                                 formatted_data[10]
                                  ]
-            worksheet.append_row(composed_new_data)
+            DB.append(self.cmd, composed_new_data)
 
         else:
-            # Find the row where the 'open' action for
+            # Look up the row where the 'open' action for
             # the same asset was recorded
-            cells = worksheet.findall(asset)
-            for cell in cells:
-                action_cell = worksheet.cell(cell.row, cell.col - 1)
-                if action_cell.value == "open":
-                    row_number = cell.row
-                    row_data = worksheet.row_values(row_number)
-                    if action == "close":
-                        composed_new_data = [
-                                row_data[0],  # First timestamp
-                                formatted_data[1],  # Action (e.g., 'close')
-                                row_data[2],  # Asset (e.g., 'btc')
-                                row_data[3],  # Type (e.g., 'short')
-                                row_data[4],  # Price
-                                row_data[5],  # Stop
-                                row_data[6],  # Initial ATR
-                                formatted_data[0],  # Second timestamp
-                                formatted_data[3],  # New price
-                                formatted_data[4],  # New stop
-                                formatted_data[5]  # New ATR
-                            ]
-                    else:
-                        composed_new_data = [
-                                row_data[0],  # First timestamp
-                                row_data[1],  # Action (e.g., 'update')
-                                row_data[2],  # Asset (e.g., 'btc')
-                                row_data[3],  # Type (e.g., 'short')
-                                row_data[4],  # Price
-                                row_data[5],  # Stop
-                                row_data[6],  # Initial ATR
-                                formatted_data[0],  # Second timestamp
-                                None,  # New price
-                                formatted_data[4],  # New stop
-                                formatted_data[5]  # New ATR
-                            ]
-
-                    DB.rewrite_target_row(
-                        self.cmd, composed_new_data, row_number
-                        )
-                    break
+            open_row = DB.open_position(self.cmd, asset)
+            if open_row:
+                row_number, row_data = open_row
+                if action == "close":
+                    composed_new_data = [
+                            row_data[0],  # First timestamp
+                            formatted_data[1],  # Action (e.g., 'close')
+                            row_data[2],  # Asset (e.g., 'btc')
+                            row_data[3],  # Type (e.g., 'short')
+                            row_data[4],  # Price
+                            row_data[5],  # Stop
+                            row_data[6],  # Initial ATR
+                            formatted_data[0],  # Second timestamp
+                            formatted_data[3],  # New price
+                            formatted_data[4],  # New stop
+                            formatted_data[5]  # New ATR
+                        ]
+                else:
+                    composed_new_data = [
+                            row_data[0],  # First timestamp
+                            row_data[1],  # Action (e.g., 'update')
+                            row_data[2],  # Asset (e.g., 'btc')
+                            row_data[3],  # Type (e.g., 'short')
+                            row_data[4],  # Price
+                            row_data[5],  # Stop
+                            row_data[6],  # Initial ATR
+                            formatted_data[0],  # Second timestamp
+                            None,  # New price
+                            formatted_data[4],  # New stop
+                            formatted_data[5]  # New ATR
+                        ]
+
+                DB.rewrite_target_row(
+                    self.cmd, composed_new_data, row_number, row_data
+                    )
 
     def validate_asset_name(self, asset_name, action):
         """
@@ -2499,25 +7986,22 @@ class Entry:
         If the action is 'close' or 'update', ensure the
         asset name is in the list of open orders.
         """
-        if Check().list_open_orders(silent=True):
-            open_assets = [
-                row[2] for row in Check().list_open_orders(silent=True)
-                ]
-
-            if action == "open" and asset_name in open_assets:
-                raise ValueError(f"\nAsset '{asset_name}' is already in the "
-                                 "list of open orders. You cannot have "
-                                 "multiple trades open for same asset."
+        is_open = DB.open_position("entry", asset_name) is not None
+
+        if action == "open" and is_open:
+            raise ValueError(f"\nAsset '{asset_name}' is already in the "
+                             "list of open orders. You cannot have "
+                             "multiple trades open for same asset."
+                             )
+
+        elif action in ["close", "update"]:
+            if not is_open:
+                raise ValueError(f"\nAsset '{asset_name}' is not in "
+                                 "the list of open orders. You "
+                                 f"cannot {action} if a trade "
+                                 "is not opened yet."
                                  )
 
-            elif action in ["close", "update"]:
-                if asset_name not in open_assets:
-                    raise ValueError(f"\nAsset '{asset_name}' is not in "
-                                     "the list of open orders. You "
-                                     f"cannot {action} if a trade "
-                                     "is not opened yet."
-                                     )
-
     def validate_for_action(self, data):
         """
         Validate the asset name based on the action.
@@ -2528,12 +8012,10 @@ class Entry:
         If the action is 'close' or 'update', ensure the
         asset name is in the list of open orders.
         """
-        if data["action"][1]:
-            action = data["action"][1].split(":")[1]
-        else:
-            action = self.data_settings["action"][1].split(":")[1]
-
-        asset_name = data["asset"][1].split(":")[1]
+        action = setting_value(
+            data["action"][1] or self.data_settings["action"][1]
+        )
+        asset_name = setting_value(data["asset"][1])
 
         try:
             self.validate_asset_name(asset_name, action)
@@ -2548,12 +8030,10 @@ class Entry:
         Revalidate the asset based on the current action. If the asset
         cannot be validated, set its value to None.
         """
-        action_value = self.data_settings["action"][1]
-        if action_value:
-            action = action_value.split(":")[1]
-            asset_value = self.data_settings["asset"][1]
-            if asset_value:
-                asset = asset_value.split(":")[1]
+        action = setting_value(self.data_settings["action"][1])
+        if action:
+            asset = setting_value(self.data_settings["asset"][1])
+            if asset:
                 try:
                     self.validate_asset_name(asset, action)
                 except ValueError as e:
@@ -2635,7 +8115,8 @@ class Help:
             format_text = "any value" if format == "any" else format
             print(f"- {key.capitalize()} options: {format_text}")
 
-        input(cyan("\nPress ENTER to continue:\n"))
+        with METRICS.waiting():
+            input(cyan("\nPress ENTER to continue:\n"))
         print(green(italic("\nFunctionalities:")))
         print(
             "- You can still use any of the main menu calls, plese note that "
@@ -2839,6 +8320,8 @@ class Help:
         print("  - Type 'entry' to enter a trade")
         print("  - Type 'check' to view stats")
         print("  - Type 'set' to open settings")
+        print("  - Type 'stats' to view storage call statistics")
+        print("  - Type 'archive' to archive closed trades")
         print("  - Type 'help' to get help")
         print("  - Type 'back' to return to previous location")
         print("  - Type 'cancel' to cancel current job")
@@ -2875,7 +8358,10 @@ class Help:
             self.main_help()
         else:
             if self.context in MainMenu().command.keys():
-                if self.context not in ("check", "exit", "cancel", "back"):
+                if self.context not in (
+                    "check", "stats", "archive", "exit", "cancel",
+                    "back"
+                ):
                     print(TITLE(f"Help for '{self.context}':"))
                     self.help_specifics()
 
@@ -2885,6 +8371,47 @@ class Help:
                         print(
                             "\n  - Command 'check' will show all open orders"
                             )
+                        print(
+                            "\n  - Command 'check verify' will check the"
+                            " open orders against the logged trades,"
+                            " 'check verify repair' will also fix them"
+                            " and 'check verify full' will read every"
+                            " month again"
+                            )
+                        print(
+                            "\n  - Command 'check books' will show the open"
+                            " orders of every book listed in"
+                            " TRADING_BOOK_BOOKS"
+                            )
+                        print(
+                            "\n  - Command 'check asof YYYY-MM-DD' will show"
+                            " the orders open at the end of that day,"
+                            " rebuilt from the logged trades"
+                            )
+                    if self.context == "stats":
+                        print(
+                            "\n  - Command 'stats' will show the storage"
+                            " calls made by each command and how long"
+                            " they took (p50/p95/p99)"
+                            )
+                        print(
+                            "\n  - Command 'stats dump' will also save"
+                            " them to a file"
+                            )
+                    if self.context == "archive":
+                        print(
+                            "\n  - Command 'archive' will move the closed"
+                            " trades out of 'entry', this also runs on"
+                            " its own once a day"
+                            )
+                        print(
+                            "\n  - Command 'archive history btc' will show"
+                            " every trade of an asset, archived or not"
+                            )
+                        print(
+                            "\n  - Command 'archive local' will show the"
+                            " local compressed copy of the trade history"
+                            )
                     if self.context == "exit":
                         print(
                             "\n  - Command 'exit' will safely close"
@@ -2912,13 +8439,11 @@ class Help:
 class Set:
     """
     Manages user settings for the trading book system. This class
-    allows users to update and retrieve settings stored in a Google
-    Sheets worksheet.
+    allows users to update and retrieve settings stored in the
+    'set' worksheet.
 
     Attributes:
         cmd (str): The name of the command ('set').
-        worksheet (gspread.Worksheet): The worksheet object
-                                        for the 'set' sheet.
         data (list): All values from the worksheet.
         input (list): Initial input data.
         data_settings (dict): A dictionary of settings with
@@ -2935,8 +8460,7 @@ class Set:
         including the worksheet data and data settings.
         """
         self.cmd = "set"
-        self.worksheet = DB.SHEET.worksheet(self.cmd)
-        self.data = self.worksheet.get_all_values()
+        self.data = DB.get_all_values(self.cmd)
         self.input = input
         self.data_settings = {
             "position": ("#", None),
@@ -2992,9 +8516,17 @@ class Set:
                                     amount
                                     ]
 
-                                DB.rewrite_target_row(
-                                    self.cmd, composed_new_data, 2
-                                    )
+                                # Committed before it is confirmed, not
+                                # with the rest of the command
+                                with DB.transaction() as transaction:
+                                    DB.rewrite_target_row(
+                                        self.cmd, composed_new_data, 2,
+                                        self.data[1] if len(self.data) > 1
+                                        else None
+                                        )
+                                if not transaction.committed:
+                                    print(ERROR("\nSettings not saved"))
+                                    continue
 
                                 print(SUCCESS(
                                     "\nNew settings saved:\n"
@@ -3052,7 +8584,8 @@ class Set:
                 "settings might be necessary"
                 )
             print(dim("   Example: position:15"))
-            input(cyan("\nPress ENTER to continue:\n"))
+            with METRICS.waiting():
+                input(cyan("\nPress ENTER to continue:\n"))
             print(green("\nCurrent settings:\n"))
 
         vertical_table = [
@@ -3074,24 +8607,23 @@ class Check:
     spreadsheet. This class interacts with a worksheet named 'entry' to
     retrieve and display information about open orders.
 
+    The open orders are found through the open rows index of the cached
+    'entry' worksheet (see CachedWorksheet.open_positions), so checking
+    them does not rebuild every row of the worksheet.
+
     Methods:
-        __init__():
-            Initializes the Check class by accessing the 'entry' worksheet
-            and retrieving all its data.
         check_open_order(silent=False):
             Checks if there are any open orders.
         list_open_orders(silent=False):
             Lists all open orders, calculates the duration for each open order,
             and formats them into a table.
+        verify(full=False, repair=False):
+            Checks the 'entry' worksheet against the logged trade events.
+        as_of(date):
+            Lists the trades open at the end of a past day.
+        list_books():
+            Lists the open orders of every book of the desk.
     """
-    def __init__(self):
-        """
-        Initializes the Check class by accessing the 'entry' worksheet
-        and retrieving all its data.
-        """
-        self.worksheet = DB.SHEET.worksheet("entry")
-        self.data = self.worksheet.get_all_values()
-
     def check_open_order(self, silent=False):
         """
         Check if there are any open orders.
@@ -3102,17 +8634,14 @@ class Check:
         Returns:
             bool: True if there is at least one open order, False otherwise.
 
-        This method iterates over the data to find any rows where the
+        This method looks up the rows of the 'entry' worksheet where the
         'Action' column has the value 'open'. If such a row is found,
         it returns True indicating there is an open order. If no open orders
         are found, it returns False. If an exception occurs and silent is
         False, it prints an error message.
         """
         try:
-            for row in self.data:
-                if row[1] == "open":
-                    return True
-            return False
+            return bool(DB.find_rows("entry", action="open"))
         except Exception as e:
             if not silent:
                 print(ERROR(f"No open orders found"))
@@ -3125,8 +8654,8 @@ class Check:
         Args:
             silent (bool): If True, suppresses output.
 
-        This method retrieves all data from the 'entry' worksheet, filters
-        for rows where the 'Action' column has the value 'open', and
+        This method retrieves the rows of the 'entry' worksheet where
+        the 'Action' column has the value 'open', and
         calculates the duration for each open order. The open orders are
         then formatted into a table with specified headers. If silent is
         False, the table is printed. If silent is True, the table is returned.
@@ -3137,28 +8666,25 @@ class Check:
         try:
             global open_orders
             open_orders = []
-            worksheet = DB.SHEET.worksheet("entry")
-            self.data = worksheet.get_all_values()
 
             headers = [
                 "Timestamp", "Action", "Asset", "Type",
                 "Price", "Stop", "ATR"
             ]
 
-            for row in self.data[1:]:  # Skip header row
-                if row[1] == "open":
-                    time_open = row[0]
-                    action = row[1]
-                    asset = row[2]
-                    type_ = row[3]
-                    price_open = row[4]
-                    stop_open = row[9]
-                    atr_open = row[10]
-
-                    open_orders.append([
-                        time_open, action, asset, type_,
-                        price_open, stop_open, atr_open
-                    ])
+            for _, row in DB.find_rows("entry", action="open"):
+                time_open = row[0]
+                action = row[1]
+                asset = row[2]
+                type_ = row[3]
+                price_open = row[4]
+                stop_open = row[9]
+                atr_open = row[10]
+
+                open_orders.append([
+                    time_open, action, asset, type_,
+                    price_open, stop_open, atr_open
+                ])
 
             if open_orders:
 
@@ -3175,6 +8701,249 @@ class Check:
             if not silent:
                 print(ERROR(f"Error while listing open orders: {e}"))
 
+    def verify(self, full=False, repair=False):
+        """
+        Checks the 'entry' worksheet against the trade events logged to
+        'raw_data' (see ConsistencyChecker) and lists the divergent
+        assets.
+
+        Args:
+            full (bool): If True, every month of events is read again.
+            repair (bool): If True, divergent rows are rewritten from
+                the events.
+        """
+        print(TITLE("Checking trades against the logged events...\n"))
+        problems = ConsistencyChecker(DB).run(full=full, repair=repair)
+        if not problems:
+            print(SUCCESS("Trades match the logged events"))
+            return
+        headers = ["Asset", "Problem", "Entry row"]
+        Table([headers] + [
+            [asset, problem, row or ""] for asset, problem, row in problems
+        ], headers).print_table()
+        if repair:
+            print(dim("\nRows that could be rebuilt from the events were "
+                      "rewritten, run 'check verify' again to confirm"))
+
+    def as_of(self, date):
+        """
+        Lists the trades open at the end of a past day, rebuilt from the
+        trade events logged to 'raw_data' (see TradeLog).
+
+        Args:
+            date (str): The 'YYYY-MM-DD' day.
+        """
+        try:
+            date = datetime.date.fromisoformat(date or "").isoformat()
+        except ValueError:
+            print(ERROR("Enter the day as 'check asof YYYY-MM-DD'"))
+            return
+        print(TITLE(f"Trades open on {date}:\n"))
+        open_trades, history = TradeLog(DB).as_of(date)
+        headers = [
+            "Timestamp", "Action", "Asset", "Type",
+            "Price", "Stop", "ATR"
+        ]
+        if open_trades:
+            Table([headers] + [
+                [row[0], row[1], row[2], row[3], row[4], row[9], row[10]]
+                for row in open_trades
+            ], headers).print_table()
+        else:
+            print(ERROR("No open orders found"))
+        print(dim(f"\n{len(history)} trade(s) closed by then"))
+
+    def list_books(self):
+        """
+        Lists the open orders of every book of the desk (see Books),
+        the books being read concurrently.
+        """
+        print(TITLE("Open trades of every book:\n"))
+        headers = [
+            "Book", "Timestamp", "Action", "Asset", "Type",
+            "Price", "Stop", "ATR"
+        ]
+        open_orders = []
+        for book, rows, error in BOOKS.fan_out(
+            lambda database: database.find_rows("entry", action="open")
+        ):
+            if error is not None:
+                print(ERROR(f"Failed to read the book '{book}': {error}"))
+                continue
+            open_orders.extend(
+                [book, row[0], row[1], row[2], row[3], row[4], row[9],
+                 row[10]]
+                for _, row in rows
+            )
+        if open_orders:
+            open_orders.sort(key=lambda row: row[1])
+            Table([headers] + open_orders, headers).print_table()
+        else:
+            print(ERROR("No open orders found"))
+
+
+class Stats:
+    """
+    A class to show how many storage operations each command made
+    during the session and how long they took.
+
+    Methods:
+        __init__(input=None):
+            Initializes the Stats class with the optional 'dump' option.
+        stats_loop():
+            Shows the statistics, saving them to a file when asked to.
+        dump():
+            Saves the statistics to a JSON file.
+    """
+    def __init__(self, input=None):
+        """
+        Initializes the Stats class.
+
+        Args:
+            input (list, optional): The words following the command,
+                'dump' saves the statistics to a file.
+        """
+        self.input = input or []
+
+    def stats_loop(self):
+        """
+        Prints the statistics as a table, one row per command and
+        operation, with durations in milliseconds. Commands over the
+        TRADING_BOOK_SLOW_COMMAND budget are listed in
+        'slow_commands.log'.
+        """
+        print(TITLE("Storage calls per command (ms):\n"))
+        rows = METRICS.report()
+        if rows:
+            headers = [
+                "Command", "Operation", "Calls", "p50", "p95", "p99", "KB",
+            ]
+            Table([headers] + rows, headers).print_table()
+        else:
+            print(ERROR("No storage calls made yet"))
+        print(dim(
+            f"\nCommands over {METRICS.budget:g}s are logged to "
+            f"{os.path.join(LOCAL_STATE_DIR, 'slow_commands.log')}"
+        ))
+        if "dump" in self.input:
+            self.dump()
+
+    def dump(self):
+        """
+        Saves the statistics to a JSON file in the local state folder.
+        """
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(LOCAL_STATE_DIR, f"stats_{stamp}.json")
+        try:
+            os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+            METRICS.dump(path)
+        except OSError as e:
+            print(ERROR(f"\nFailed to save the statistics: {e}"))
+            return
+        print(SUCCESS(f"\nStatistics saved to {path}"))
+
+
+class Archive:
+    """
+    A class to move the closed trades out of the 'entry' worksheet and
+    look them up once archived.
+
+    Methods:
+        __init__(input=None):
+            Initializes the Archive class with the optional 'history'
+            option.
+        archive_loop():
+            Archives the closed trades, or shows the history of an asset.
+        history(asset):
+            Shows every trade of an asset, archived or not.
+        local():
+            Shows the local history of the trades.
+    """
+    def __init__(self, input=None):
+        """
+        Initializes the Archive class.
+
+        Args:
+            input (list, optional): The words following the command,
+                'history' followed by an asset shows its trades, 'local'
+                shows the local history.
+        """
+        self.input = input or []
+
+    def archive_loop(self):
+        """
+        Archives the closed trades, printing how many were moved, or
+        shows the history requested.
+        """
+        if "history" in self.input:
+            assets = [word for word in self.input if word != "history"]
+            self.history(assets[0] if assets else None)
+            return
+        if "local" in self.input:
+            self.local()
+            return
+        print(TITLE("Archiving closed trades..."))
+        archived = DB.archive()
+        if archived is None:
+            print(ERROR("\nClosed trades not archived, try again later"))
+        elif archived:
+            print(SUCCESS(f"\n{archived} closed trade(s) archived"))
+        else:
+            print(ERROR("\nNo closed trades to archive"))
+        DB.save_history()
+
+    def local(self):
+        """
+        Saves the new events and closed trades to the local history,
+        then shows what it holds.
+        """
+        print(TITLE("Local history:\n"))
+        DB.save_history()
+        headers = ["Worksheet", "Rows", "Chunks", "From", "To", "KB"]
+        rows = []
+        for worksheet in ("raw_data", "entry_archive"):
+            archive = DB.local_history(worksheet)
+            index = archive.index
+            parts = [chunk[4:6] for chunk in index["chunks"]]
+            if index["tail"]:
+                parts.append(index["tail"]["dates"])
+            dates = [date for part in parts for date in part if date]
+            size = sum(chunk[1] for chunk in index["chunks"])
+            try:
+                size += os.path.getsize(archive.path + ".index")
+            except OSError:
+                pass
+            rows.append([
+                worksheet, index["rows"], len(index["chunks"]),
+                min(dates, default=""), max(dates, default=""),
+                round(size / 1024, 1),
+            ])
+        Table([headers] + rows, headers).print_table()
+
+    def history(self, asset=None):
+        """
+        Shows every trade of an asset, or of the whole book, archived
+        or not, oldest first.
+
+        Args:
+            asset (str, optional): The asset to show.
+        """
+        title = f"Trades of '{asset}':\n" if asset else "All trades:\n"
+        print(TITLE(title))
+        headers = [
+            "Timestamp", "Action", "Asset", "Type", "Price",
+            "Closed", "Close price", "Stored in",
+        ]
+        rows = [
+            [row[0], row[1], row[2], row[3], row[4],
+             row[7] if row[1] == "close" else "", row[8], location]
+            for row, location in DB.history(asset)
+        ]
+        if rows:
+            Table([headers] + rows, headers).print_table()
+        else:
+            print(ERROR("No trades found"))
+
 
 # Main loop
 
@@ -3217,6 +8986,8 @@ class TradingBookSystem:
         self.menu.menu_help()
         input(cyan("\nPress ENTER to continue:\n"))
         Help.pro_tips()
+        self.archive_if_due()
+        self.verify_if_due()
         Check().list_open_orders(silent=True)
 
         global main_menu
@@ -3228,7 +8999,39 @@ class TradingBookSystem:
             cmd = PATH()
             if cmd:
                 input_validate = InputValidation(cmd)
-                input_validate.multi_menu_call()
+                # Each worksheet is read once per command and the writes
+                # gathered during it are sent together at the end
+                with DB.unit_of_work():
+                    input_validate.multi_menu_call()
+                self.archive_if_due()
+                self.verify_if_due()
+
+    def archive_if_due(self):
+        """
+        Moves the closed trades to the archive when the scheduled run
+        is due, every TRADING_BOOK_ARCHIVE_INTERVAL seconds.
+        """
+        if DB.archive_due():
+            with METRICS.command("archive"):
+                if DB.archive(quiet=True) is not None:
+                    DB.save_history()
+
+    def verify_if_due(self):
+        """
+        Checks the trades against the logged events when the scheduled
+        run is due, every TRADING_BOOK_VERIFY_INTERVAL seconds, only
+        reporting divergences.
+        """
+        checker = ConsistencyChecker(DB)
+        if not checker.due():
+            return
+        with METRICS.command("verify"):
+            problems = checker.run()
+        if problems:
+            print(ERROR(
+                f"\n{len(problems)} trade(s) do not match the logged "
+                "events, type 'check verify' for details"
+            ))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The state folder is read when run is imported, every test shares it
+os.environ["TRADING_BOOK_STATE_DIR"] = tempfile.mkdtemp()
+os.environ.setdefault("TRADING_BOOK_BACKEND", "sqlite")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
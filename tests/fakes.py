@@ -0,0 +1,68 @@
+import os
+import threading
+import uuid
+
+import run
+
+
+class FakeSpreadsheets(run.SQLiteBackend):
+    """
+    Remote engine keeping each book in a SQLite file of its own, the
+    way Google Sheets keeps each book in a spreadsheet of its own.
+
+    Opening a book waits for reachable to be set, like a spreadsheet
+    reached over a slow network, and records the book in opened. While
+    down is True, opening a book fails like an unreachable spreadsheet.
+    """
+
+    name = "fake_sheets"
+    remote = True
+    opened = []
+    reachable = threading.Event()
+    reachable.set()
+    down = False
+
+    @classmethod
+    def open_book(cls, book, folder):
+        cls.reachable.wait(10)
+        if cls.down:
+            raise ConnectionError("spreadsheet unreachable")
+        cls.opened.append(book)
+        return cls.of(book)
+
+    @classmethod
+    def of(cls, book):
+        """
+        Returns a connection to the spreadsheet of a book, as another
+        session would see it.
+        """
+        folder = os.path.join(run.LOCAL_STATE_DIR, "remote")
+        os.makedirs(folder, exist_ok=True)
+        return cls(os.path.join(folder, f"{book}.sqlite3"))
+
+
+run.STORAGE_BACKENDS[FakeSpreadsheets.name] = FakeSpreadsheets
+
+
+def new_book():
+    """
+    Returns the name of a book no test used yet.
+    """
+    return f"book-{uuid.uuid4().hex[:8]}"
+
+
+def session(book, **kwargs):
+    """
+    Opens a book on the fake remote engine, like a new session.
+    """
+    return run.DataBaseActions(FakeSpreadsheets.name, book=book, **kwargs)
+
+
+def trade(date, action, asset, price="1", stop="1"):
+    """
+    Returns an 'entry' row.
+    """
+    return [
+        date, action, asset, "long", price, stop, "0.1",
+        date, price if action == "close" else "", stop, "0.1",
+    ]
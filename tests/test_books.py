@@ -0,0 +1,29 @@
+import run
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def test_warm_start_writes_to_its_own_book():
+    book, default = new_book(), run.DEFAULT_BOOK
+    database = session(book)
+    database.append("entry", trade("2026-10-01", "open", "btc"))
+    database.flush()
+    assert database.settle()
+    database.invalidate()
+    database.get_all_values("entry")
+    database.get_all_values("set")
+
+    FakeSpreadsheets.opened.clear()
+    FakeSpreadsheets.reachable.clear()
+    try:
+        database = session(book)
+        assert database.warm is not None
+        database.append("entry", trade("2026-10-01", "open", "eth"))
+        database.flush()
+    finally:
+        FakeSpreadsheets.reachable.set()
+    assert database.journal.wait(10)
+
+    assert set(FakeSpreadsheets.opened) == {book}
+    rows = FakeSpreadsheets.of(book).get_all_values("entry")[1:]
+    assert [row[2] for row in rows] == ["btc", "eth"]
+    assert FakeSpreadsheets.of(default).get_all_values("entry")[1:] == []
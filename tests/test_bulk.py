@@ -0,0 +1,35 @@
+import datetime
+import json
+
+import run
+from fakes import new_book, session
+
+
+TODAY = datetime.date.today()
+
+
+class Tomorrow(datetime.date):
+    @classmethod
+    def today(cls):
+        return TODAY + datetime.timedelta(days=1)
+
+
+def test_bulk_import_run_again_on_another_day_saves_nothing(monkeypatch):
+    database = session(new_book())
+    monkeypatch.setattr(run, "DB", database)
+    bulk = json.dumps([
+        {"action": "open", "asset": "btc", "type": "long",
+         "price": "15", "stop": "10", "atr": "0.01"},
+        {"action": "close", "asset": "btc", "type": "long",
+         "price": "17", "stop": "13", "atr": "0.01"},
+    ])
+    monkeypatch.setattr("builtins.input", lambda *args: bulk)
+
+    run.Entry().bulk_mode()
+    assert database.settle()
+    monkeypatch.setattr(datetime, "date", Tomorrow)
+    run.Entry().bulk_mode()
+    assert database.settle()
+
+    database.invalidate()
+    assert len(database.find_rows("entry", asset="btc")) == 1
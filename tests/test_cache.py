@@ -0,0 +1,25 @@
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def test_worksheet_larger_than_the_cache_is_still_read(monkeypatch):
+    monkeypatch.setenv("TRADING_BOOK_CACHE_SIZE", "200")
+    book = new_book()
+    FakeSpreadsheets.of(book).append_rows("entry", [
+        trade("2026-10-01", "open", f"asset{number}")
+        for number in range(50)
+    ])
+    database = session(book)
+    assert len(database.find_rows("entry", action="open")) == 50
+    assert len(database.get_all_values("entry")) == 51
+    assert "entry" not in database.cache
+
+
+def test_own_writes_are_served_from_the_cache():
+    book = new_book()
+    database = session(book)
+    database.get_all_values("entry")
+    database.append("entry", trade("2026-10-01", "open", "btc"))
+    assert database.cache["entry"].open_row("btc")[0] == 2
+    assert [row[2] for _, row in database.find_rows(
+        "entry", action="open"
+    )] == ["btc"]
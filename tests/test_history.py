@@ -0,0 +1,155 @@
+import run
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def event(date, action, asset, stop="1"):
+    """
+    Returns a 'raw_data' row, keyed by its content.
+    """
+    return [
+        date, action, asset, "long", "1", stop, "0.1",
+        f"{date}-{action}-{asset}",
+    ]
+
+
+def logged(database, *events):
+    """
+    Logs trade events and waits until they reached the spreadsheet.
+    """
+    for row in events:
+        database.append("raw_data", row)
+    assert database.flush() and database.journal.wait(5)
+
+
+def test_closed_trades_move_to_the_archive():
+    book = new_book()
+    FakeSpreadsheets.of(book).append_rows("entry", [
+        trade("2026-10-01", "open", "btc"),
+        trade("2026-10-01", "close", "eth"),
+        trade("2026-10-02", "open", "sol"),
+    ])
+    database = session(book)
+    assert database.archive() == 1
+
+    remote = FakeSpreadsheets.of(book)
+    assert [row[2] for row in remote.get_all_values("entry")[1:]] == [
+        "btc", "sol",
+    ]
+    archived = remote.get_all_values("entry_archive")[1:]
+    assert [row[2] for row in archived] == ["eth"]
+    assert archived[0][11] == "3"
+    assert database.history("eth")[0][1] == "archive row 2 (entry row 3)"
+    assert database.cached("entry").open_row("sol")[0] == 3
+
+
+def test_events_go_to_the_partition_of_their_month():
+    assert run.partition_name("raw_data", "2026-09-03") == "raw_data_2026_09"
+    book = new_book()
+    database = session(book)
+    logged(
+        database,
+        event("2026-09-03", "open", "btc"),
+        event("2026-10-01", "close", "btc"),
+        event("2026-10-02", "open", "eth"),
+    )
+
+    remote = FakeSpreadsheets.of(book)
+    catalog = remote.get_all_values("partitions")
+    assert run.catalog_partitions(catalog, "raw_data") == [
+        "raw_data_2026_09", "raw_data_2026_10",
+    ]
+    assert run.catalog_partitions(catalog, "raw_data", "2026-10-01") == [
+        "raw_data_2026_10",
+    ]
+    assert len(remote.get_all_values("raw_data_2026_10")) == 3
+    assert database.known_event("2026-10-02-open-eth")
+
+
+def test_trades_are_rebuilt_from_the_checkpoints():
+    database = session(new_book())
+    logged(
+        database,
+        event("2026-10-01", "open", "btc"),
+        event("2026-10-02", "update", "btc", stop="2"),
+        event("2026-10-03", "close", "btc", stop="2"),
+        event("2026-10-04", "open", "eth"),
+    )
+    log = run.TradeLog(database)
+    log.every = 2
+
+    open_trades, closed = log.as_of("2026-10-02")
+    assert [(row[2], row[9]) for row in open_trades] == [("btc", "2")]
+    assert closed == []
+    positions, closed = log.rebuild()
+    assert positions["eth"][1] == "open"
+    assert [row[2] for row in closed] == ["btc"]
+
+    logged(database, event("2026-10-05", "open", "sol"))
+    touched = {}
+    positions, closed = log.rebuild(touched=touched)
+    # Only the block holding the new event was replayed
+    assert [row[2] for row in touched.values()] == ["sol"]
+    assert sorted(positions) == ["btc", "eth", "sol"]
+    assert [row[2] for row in closed] == ["btc"]
+
+
+def test_entry_diverging_from_the_events_is_repaired():
+    book = new_book()
+    FakeSpreadsheets.of(book).append_rows("entry", [
+        trade("2026-10-01", "open", "btc", stop="3"),
+    ])
+    database = session(book)
+    logged(
+        database,
+        event("2026-10-01", "open", "btc"),
+        event("2026-10-02", "open", "eth"),
+    )
+
+    checker = run.ConsistencyChecker(database)
+    problems = checker.run(repair=True)
+    assert sorted(asset for asset, *_ in problems) == ["btc", "eth"]
+    assert database.journal.wait(5)
+    assert FakeSpreadsheets.of(book).get_all_values("entry")[1:] == [
+        trade("2026-10-01", "open", "btc"),
+        trade("2026-10-02", "open", "eth"),
+    ]
+    assert run.ConsistencyChecker(database).run() == []
+
+
+def test_history_is_kept_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setenv("TRADING_BOOK_HISTORY_CHUNK", "2")
+    rows = [event(f"2026-10-0{day}", "open", "btc") for day in range(1, 6)]
+    archive = run.HistoryArchive(str(tmp_path), "raw_data")
+    archive.extend(rows[:3], {"raw_data": 3})
+    archive.extend(rows[3:], {"raw_data": 5})
+
+    archive = run.HistoryArchive(str(tmp_path), "raw_data")
+    assert [chunk[2:4] for chunk in archive.index["chunks"]] == [
+        [0, 2], [2, 2],
+    ]
+    assert archive.tail() == rows[4:]
+    with open(tmp_path / "raw_data.chunks", "rb") as file:
+        data = file.read()
+    for offset, length, first, *_ in archive.index["chunks"]:
+        assert archive.unpack(data[offset:offset + length]) == rows[
+            first:first + 2
+        ]
+
+
+def test_history_sync_only_adds_the_new_rows(monkeypatch):
+    monkeypatch.setenv("TRADING_BOOK_HISTORY_CHUNK", "2")
+    database = session(new_book())
+    logged(
+        database,
+        event("2026-10-01", "open", "btc"),
+        event("2026-10-02", "open", "eth"),
+        event("2026-10-03", "open", "sol"),
+    )
+    assert database.save_history()["raw_data"] == 3
+    assert database.save_history()["raw_data"] == 0
+
+    logged(database, event("2026-10-04", "close", "btc"))
+    assert database.save_history()["raw_data"] == 1
+    history = database.local_history("raw_data")
+    assert history.index["rows"] == 4
+    assert len(history.index["chunks"]) == 2
@@ -0,0 +1,68 @@
+import run
+
+
+def record(asset):
+    return {
+        "engine": "backend",
+        "appends": {"entry": [["2026-10-01", "open", asset]]},
+        "updates": {},
+        "originals": {},
+    }
+
+
+def offline(record):
+    raise ConnectionError("spreadsheet unreachable")
+
+
+def assets(records):
+    return [record["appends"]["entry"][0][2] for record in records]
+
+
+def test_sessions_never_drop_each_others_records(tmp_path):
+    folder = str(tmp_path / "journals")
+    first = run.WriteJournal(folder, offline)
+    first.append(record("btc"))
+
+    applied = []
+    second = run.WriteJournal(folder, applied.append)
+    second.append(record("eth"))
+    assert second.wait(5)
+    second.compact()
+    assert assets(applied) == ["eth"]
+    assert assets(first.pending()) == ["btc"]
+
+    # The first session stops without sending its record
+    first.lock.close()
+    third = run.WriteJournal(folder, applied.append)
+    assert third.wait(5)
+    assert assets(applied) == ["eth", "btc"]
+    assert applied[-1]["replayed"]
+
+
+def test_running_sessions_keep_their_records(tmp_path):
+    folder = str(tmp_path / "journals")
+    first = run.WriteJournal(folder, offline)
+    first.append(record("btc"))
+
+    applied = []
+    second = run.WriteJournal(folder, applied.append)
+    assert not second.pending()
+    assert assets(first.pending()) == ["btc"]
+
+
+def test_shared_journal_of_older_versions_is_taken_over(tmp_path):
+    shared = tmp_path / "journal.log"
+    shared.write_text(
+        '{"id": 1, "engine": "backend", "appends": {"entry": '
+        '[["2026-10-01", "open", "btc"]]}, "updates": {}, '
+        '"originals": {}}\n'
+        '{"id": 2, "engine": "backend", "appends": {"entry": '
+        '[["2026-10-01", "open", "eth"]]}, "updates": {}, '
+        '"originals": {}}\n'
+        '{"ack": 1}\n'
+    )
+    applied = []
+    journal = run.WriteJournal(str(tmp_path / "journals"), applied.append)
+    assert journal.wait(5)
+    assert assets(applied) == ["eth"]
+    assert not shared.exists()
@@ -0,0 +1,34 @@
+import threading
+
+import pytest
+
+import run
+from fakes import new_book, session, trade
+
+
+def test_asset_stays_locked_until_the_trade_reached_the_remote():
+    book = new_book()
+    first, second = session(book), session(book)
+    second.locks.timeout = 0.2
+    sent = threading.Event()
+    apply = first.journal.apply
+    first.journal.apply = lambda record: sent.wait(10) and apply(record)
+
+    with first.locks.hold("btc"):
+        first.get_all_values("entry")
+        first.append("entry", trade("2026-10-01", "open", "btc"))
+        assert first.flush()
+    # The trade is only in the journal of the first session
+    with pytest.raises(run.AssetBusy):
+        with second.locks.hold("btc"):
+            pass
+    with first.locks.hold("btc"):
+        assert first.cache["entry"].open_row("btc")
+
+    sent.set()
+    assert first.journal.wait(5)
+    with second.locks.hold("btc"):
+        second.refresh("entry")
+        assert [row[2] for _, row in second.find_rows(
+            "entry", action="open"
+        )] == ["btc"]
@@ -0,0 +1,33 @@
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def test_trades_saved_offline_are_sent_once_the_spreadsheet_is_back(
+    monkeypatch,
+):
+    book = new_book()
+    # Fills the local copy the offline session starts from
+    session(book).get_all_values("entry")
+    monkeypatch.setattr(FakeSpreadsheets, "down", True)
+    database = session(book)
+    assert database.offline
+
+    database.append("entry", trade("2026-10-01", "open", "sol"))
+    assert database.flush()
+    database.append("entry", trade("2026-10-01", "open", "eth"))
+    assert database.flush()
+    # Meanwhile eth was opened from another device
+    FakeSpreadsheets.of(book).append_row(
+        "entry", trade("2026-10-01", "open", "eth", price="2")
+    )
+
+    monkeypatch.setattr(FakeSpreadsheets, "down", False)
+    assert database.journal.wait(10)
+    assert [
+        (row[2], row[4])
+        for row in FakeSpreadsheets.of(book).get_all_values("entry")[1:]
+    ] == [("eth", "2"), ("sol", "1")]
+    with open(f"{database.state_dir}/conflicts.log", encoding="utf-8") as file:
+        assert "eth is already open on the spreadsheet" in file.read()
+
+    database.get_all_values("entry")
+    assert not database.offline
@@ -0,0 +1,99 @@
+import json
+import os
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+import run
+
+
+class Response:
+    """
+    The part of a requests.Response an APIError reads.
+    """
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": "failed"}}
+
+
+def failing(*statuses):
+    """
+    Returns an API call failing with the given statuses before it
+    answers, and the list of its calls.
+    """
+    errors = [APIError(Response(status)) for status in statuses]
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if errors:
+            raise errors.pop(0)
+        return "done"
+    return call, calls
+
+
+def test_throttled_and_failed_reads_are_retried(monkeypatch):
+    monkeypatch.setattr(run.random, "uniform", lambda low, high: 0)
+    scheduler = run.RequestScheduler(quota=600)
+    call, calls = failing(429, 503)
+    assert scheduler.call(call) == "done"
+    assert len(calls) == 3
+    # The 429 emptied the bucket, the next call waited for a token
+    assert calls[2] - calls[0] >= 0.05
+
+
+def test_failed_writes_are_not_sent_twice(monkeypatch):
+    monkeypatch.setattr(run.random, "uniform", lambda low, high: 0)
+    scheduler = run.RequestScheduler(quota=600)
+    call, calls = failing(503)
+    with pytest.raises(APIError):
+        scheduler.call(call, idempotent=False)
+    assert len(calls) == 1
+
+    call, calls = failing(429)
+    assert scheduler.call(call, idempotent=False) == "done"
+    assert len(calls) == 2
+
+
+def test_calls_are_paced_at_the_quota():
+    scheduler = run.RequestScheduler(quota=600)
+    scheduler.tokens = 0
+    start = time.monotonic()
+    scheduler.call(lambda: None)
+    assert time.monotonic() - start >= 0.05
+
+
+def test_operations_are_counted_per_command():
+    metrics = run.CommandMetrics(budget=0)
+
+    class Engine:
+        name = "engine"
+
+        @metrics.measured
+        def read(self):
+            return []
+
+    engine = Engine()
+    with metrics.command("check"):
+        engine.read()
+        engine.read()
+    engine.read()
+    assert {
+        (command, operation): calls
+        for command, operation, calls, *_ in metrics.report()
+    } == {
+        ("check", "command"): 1,
+        ("check", "engine.read"): 2,
+        ("menu", "engine.read"): 1,
+    }
+
+    # Over the budget, the command was logged with its operations
+    path = os.path.join(run.LOCAL_STATE_DIR, "slow_commands.log")
+    with open(path, encoding="utf-8") as file:
+        logged = json.loads(file.readlines()[-1])
+    assert logged["command"] == "check"
+    assert logged["operations"] == {"engine.read": 2}
@@ -0,0 +1,55 @@
+import run
+
+
+class Scheduler:
+    def call(self, function, *args, idempotent=True, **kwargs):
+        return function(*args, **kwargs)
+
+
+class Worksheet:
+    """
+    Stands for a gspread Worksheet, counting the reads of its header.
+    """
+
+    def __init__(self, header):
+        self.header = list(header)
+        self.col_count = len(header)
+        self.reads = 0
+
+    def row_values(self, row):
+        self.reads += 1
+        return list(self.header)
+
+    def update(self, range_name, values):
+        self.header = list(values[0])
+
+    def add_cols(self, count):
+        self.col_count += count
+
+
+def sheets(folder):
+    """
+    Returns a GoogleSheetsBackend for a session of the book whose files
+    are in folder, without reaching Google Sheets.
+    """
+    backend = run.GoogleSheetsBackend.__new__(run.GoogleSheetsBackend)
+    backend.scheduler = Scheduler()
+    backend.headers = str(folder / "headers.json")
+    backend.checked = backend.load_checked()
+    return backend
+
+
+def test_header_row_is_read_once_per_schema(tmp_path):
+    columns = run.WORKSHEET_SCHEMAS["entry"]
+    handle = Worksheet(columns[:-1])
+    sheets(tmp_path).add_columns(handle, "entry")
+    assert handle.header == columns
+    assert handle.reads == 1
+
+    sheets(tmp_path).add_columns(handle, "entry")
+    assert handle.reads == 1
+
+    # A column added to the schema since is checked again
+    (tmp_path / "headers.json").write_text('{"entry": ["timestamp"]}')
+    sheets(tmp_path).add_columns(handle, "entry")
+    assert handle.reads == 2
@@ -0,0 +1,59 @@
+import os
+import struct
+
+import pytest
+
+import run
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def damage(path, column):
+    """
+    Flips a byte of a column block of a snapshot file.
+    """
+    with open(path, "r+b") as file:
+        data = file.read()
+        _, _, offset = run.BookSnapshot.COLUMN.unpack_from(
+            data, run.BookSnapshot.HEADER.size
+            + run.BookSnapshot.COLUMN.size * column
+        )
+        file.seek(offset)
+        file.write(bytes([data[offset] ^ 1]))
+
+
+def test_blocks_and_strings_are_read_as_they_are_used(tmp_path):
+    path = str(tmp_path / "entry.snapshot")
+    rows = [run.WORKSHEET_SCHEMAS["entry"]] + [
+        trade("2026-10-01", "open", f"asset{number}", price=str(number))
+        for number in range(100)
+    ]
+    run.BookSnapshot.write(path, run.RowStore("entry", rows), rows[-1], 0)
+    price = run.WORKSHEET_SCHEMAS["entry"].index("price")
+    damage(path, price)
+
+    store, boundary, _, _ = run.BookSnapshot.read(path, "entry")
+    assert boundary == rows[-1]
+    assert store.strings.decoded == {}
+    assert store.matching(2, "asset42") == [43]
+    assert store.cell(43, 2) == "asset42"
+    assert list(store.strings.decoded.values()) == ["asset42"]
+    with pytest.raises(run.SnapshotError):
+        store.cell(43, price)
+
+
+def test_damaged_snapshot_is_read_again_in_full():
+    book = new_book()
+    FakeSpreadsheets.of(book).append_rows("entry", [
+        trade("2026-10-01", "open", "btc"),
+    ])
+    session(book).get_all_values("entry")
+    path = os.path.join(
+        run.LOCAL_STATE_DIR, "books", book, "snapshots", "entry.snapshot"
+    )
+    damage(path, 0)
+
+    database = session(book)
+    assert database.warm is None
+    assert database.get_all_values("entry")[1][:3] == [
+        "2026-10-01", "open", "btc"
+    ]
@@ -0,0 +1,193 @@
+import threading
+
+import pytest
+
+import run
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def seeded(*rows):
+    """
+    Returns a new book whose spreadsheet holds the given 'entry' rows.
+    """
+    book = new_book()
+    FakeSpreadsheets.of(book).append_rows("entry", [list(r) for r in rows])
+    return book
+
+
+def entry_rows(book):
+    return FakeSpreadsheets.of(book).get_all_values("entry")[1:]
+
+
+def test_sqlite_commit_is_all_or_nothing(tmp_path):
+    engine = run.SQLiteBackend(str(tmp_path / "book.sqlite3"))
+    engine.append_row("entry", trade("2026-10-01", "open", "btc"))
+    engine.append_row("entry", trade("2026-10-01", "open", "eth"))
+    assert [number for number, _ in engine.find_rows(
+        "entry", asset="eth", action="open"
+    )] == [3]
+
+    with pytest.raises(KeyError):
+        engine.commit(
+            {"entry": [trade("2026-10-02", "open", "sol")]},
+            {"missing": [(2, ["x"])]},
+            {},
+        )
+    assert [row[2] for row in engine.get_all_values("entry")[1:]] == [
+        "btc", "eth",
+    ]
+
+
+def test_queued_writes_to_the_same_row_are_merged():
+    flushed = []
+    queue = run.WriteQueue(lambda: flushed.append(True), size=3, interval=0)
+    queue.add_append("entry", trade("2026-10-01", "open", "btc"), 2)
+    queue.add_update("entry", 2, [None, None, None, None, None, "2"])
+    queue.add_update("entry", 3, [None, None, None, None, None, "3"])
+    queue.add_update("entry", 3, [None] * 9 + ["4"])
+    assert len(queue) == 2 and not flushed
+
+    appends, updates = queue.drain()
+    assert appends["entry"][0][1][5] == "2"
+    assert updates["entry"][3][5:10] == ["3", None, None, None, "4"]
+
+    for row in (2, 3, 4):
+        queue.add_update("entry", row, ["x"])
+    assert flushed
+
+
+def test_failing_transaction_saves_nothing():
+    book = new_book()
+    database = session(book)
+    with pytest.raises(ValueError):
+        with database.transaction():
+            database.append("entry", trade("2026-10-01", "open", "btc"))
+            raise ValueError("validation failed")
+    assert database.flush() and database.journal.wait(5)
+    assert database.get_all_values("entry")[1:] == []
+    assert entry_rows(book) == []
+
+
+def test_open_position_index_follows_closes_and_reopens():
+    database = session(seeded(trade("2026-10-01", "open", "btc")))
+    entry = database.cached("entry")
+    assert entry.open_row("btc")[0] == 2
+
+    database.rewrite_target_row(
+        "entry", trade("2026-10-02", "close", "btc"), 2
+    )
+    assert entry.open_row("btc") is None
+    database.append("entry", trade("2026-10-03", "open", "btc"))
+    assert entry.open_row("btc")[0] == 3
+
+
+def test_row_store_reads_back_what_was_stored():
+    rows = [
+        run.WORKSHEET_SCHEMAS["entry"],
+        trade("2026-10-01", "open", "btc", price="1.50", stop="0.1"),
+        trade("2026-10-01", "close", "eth", price="2", stop=""),
+    ]
+    store = run.RowStore("entry", rows)
+    assert list(store) == rows
+    assert store.matching(2, "eth") == [2]
+
+    store[1] = trade("2026-10-02", "update", "btc", price="3")
+    assert store[1][1] == "update" and store[1][4] == "3"
+    head = store.head(2)
+    assert len(head) == 2 and head[1] == store[1]
+
+
+def test_rewrite_of_a_row_closed_by_another_session_is_set_aside():
+    book = seeded(trade("2026-10-01", "open", "btc"))
+    first, second = session(book), session(book)
+    first.get_all_values("entry")
+
+    second.rewrite_target_row(
+        "entry", trade("2026-10-01", "close", "btc"), 2
+    )
+    assert second.flush() and second.journal.wait(5)
+    first.rewrite_target_row(
+        "entry", trade("2026-10-01", "open", "btc", stop="2"), 2
+    )
+    assert first.flush() and first.journal.wait(5)
+
+    assert [row[1] for row in entry_rows(book)] == ["close"]
+    with open(f"{first.state_dir}/conflicts.log", encoding="utf-8") as file:
+        assert "marked 'close' by another session" in file.read()
+
+
+def test_rewrite_follows_a_row_moved_by_another_session():
+    book = seeded(
+        trade("2026-10-01", "open", "btc"), trade("2026-10-01", "open", "eth")
+    )
+    database = session(book)
+    database.get_all_values("entry")
+    FakeSpreadsheets.of(book).delete_rows("entry", 2, 2)
+
+    database.rewrite_target_row(
+        "entry", trade("2026-10-01", "open", "eth", stop="2"), 3
+    )
+    assert database.flush() and database.journal.wait(5)
+    assert entry_rows(book) == [trade("2026-10-01", "open", "eth", stop="2")]
+
+
+def test_unchanged_revision_skips_the_read(monkeypatch):
+    revision = ["1"]
+    monkeypatch.setattr(
+        FakeSpreadsheets, "revision", lambda engine: revision[0]
+    )
+    book = seeded(trade("2026-10-01", "open", "btc"))
+    database = session(book)
+    database.probe_window = database.revision_grace = 0
+
+    def assets():
+        database.cache.pop("entry", None)
+        return [row[2] for row in database.get_all_values("entry")[1:]]
+
+    assert assets() == ["btc"]
+    # Read again unchanged, which settles the revision
+    assert assets() == ["btc"]
+    FakeSpreadsheets.of(book).append_row(
+        "entry", trade("2026-10-01", "open", "eth")
+    )
+    assert assets() == ["btc"]
+    revision[0] = "2"
+    assert assets() == ["btc", "eth"]
+
+
+def test_unit_of_work_reads_each_worksheet_once(monkeypatch):
+    database = session(seeded(trade("2026-10-01", "open", "btc")))
+    reads = []
+    get_all_values = FakeSpreadsheets.get_all_values
+
+    def counted(engine, worksheet):
+        # The journal thread checks the trades it sends on its own
+        if threading.current_thread() is threading.main_thread():
+            reads.append(worksheet)
+        return get_all_values(engine, worksheet)
+
+    monkeypatch.setattr(FakeSpreadsheets, "get_all_values", counted)
+    with database.unit_of_work() as work:
+        database.get_all_values("entry")
+        database.cache.pop("entry")
+        database.find_rows("entry", asset="btc")
+        database.append("entry", trade("2026-10-02", "open", "eth"))
+    assert work.committed
+    assert reads == ["entry"]
+
+
+def test_replayed_record_is_not_applied_twice():
+    book = new_book()
+    database = session(book)
+    event = ["2026-10-01", "open", "btc", "long", "1", "1", "0.1", "k1"]
+    record = {
+        "engine": "backend",
+        "appends": {"raw_data": [event], "entry": [
+            trade("2026-10-01", "open", "btc")
+        ]},
+        "updates": {},
+        "originals": {},
+    }
+    database.apply_record(dict(record))
+    database.apply_record(dict(record, retried=True))
+    assert len(entry_rows(book)) == 1
@@ -0,0 +1,35 @@
+from fakes import FakeSpreadsheets, new_book, session, trade
+
+
+def test_rows_rewritten_in_place_are_read_after_a_refresh():
+    book = new_book()
+    remote = FakeSpreadsheets.of(book)
+    remote.append_rows("entry", [
+        trade("2026-10-01", "open", "btc"),
+        trade("2026-10-01", "open", "eth"),
+    ])
+    database = session(book)
+    assert len(database.find_rows("entry", action="open")) == 2
+    # Another session closes btc, its row being rewritten in place
+    remote.update_row("entry", 2, trade("2026-10-02", "close", "btc"))
+    database.refresh("entry")
+    assert [row[2] for _, row in database.find_rows(
+        "entry", action="close"
+    )] == ["btc"]
+
+
+def test_rows_appended_to_the_archive_are_fetched_from_the_tail():
+    book = new_book()
+    remote = FakeSpreadsheets.of(book)
+    remote.append_rows("entry_archive", [
+        trade("2026-10-01", "close", "btc"),
+    ])
+    database = session(book)
+    assert len(database.get_all_values("entry_archive")) == 2
+    remote.append_rows("entry_archive", [
+        trade("2026-10-02", "close", "eth"),
+    ])
+    database.cache.pop("entry_archive")
+    assert [row[2] for row in database.get_all_values(
+        "entry_archive"
+    )[1:]] == ["btc", "eth"]